@@ -0,0 +1,353 @@
+"""
+Bounding volume hierarchy over the triangles of one or more meshes, for ray casting on the CPU.
+
+bvh = BVH.fromMeshFile('scene.mesh')
+origins, directions = screenRays(camera, aspectRatio, np.array([[ndcX, ndcY]]))
+hits = bvh.intersect(origins, directions)
+if hits.distance[0] != np.inf:
+    pivot = origins[0] + directions[0] * hits.distance[0]
+
+The tree is built top-down with a binned surface area heuristic, one level of the tree at a time so every
+step is a numpy operation over all the triangles of that level. Nodes live in flat arrays, the children of
+an interior node are stored next to each other and the triangles of a leaf are contiguous in triangle order.
+
+Rays are traced together: every iteration tests all (ray, node) pairs that are left, keeps the ones that
+hit the node closer than the nearest triangle found so far, and replaces interior nodes by their children.
+
+Objects can be moved after the build with refit(), which updates the bounds of the affected nodes but
+keeps the tree as-is, so the tree degrades when objects move far from where they were built.
+"""
+from typing import *
+import numpy as np
+from .camera import matrixToArray
+from .mesh_format import MeshData, positionArray, readMeshFile
+
+
+class RayHits(NamedTuple):
+    # per ray, distance is inf and object and triangle are -1 for rays that hit nothing
+    distance: np.ndarray
+    object: np.ndarray
+    triangle: np.ndarray  # index of the triangle in its object
+    barycentrics: np.ndarray  # (N, 2) weights of the second and third vertex of the triangle
+
+
+def _boxArea(minimums: np.ndarray, maximums: np.ndarray) -> np.ndarray:
+    # half the surface area, empty boxes (min > max) have area 0
+    size = np.maximum(maximums - minimums, 0.0)
+    return size[..., 0] * size[..., 1] + size[..., 1] * size[..., 2] + size[..., 2] * size[..., 0]
+
+
+def _segments(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    # concatenated ranges [start, start + count) for every start and count
+    offsets = np.cumsum(counts) - counts
+    return np.repeat(starts - offsets, counts) + np.arange(int(counts.sum()))
+
+
+def _cross(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # np.cross has a lot of overhead for the small arrays we have in most iterations
+    return np.stack([a[:, 1] * b[:, 2] - a[:, 2] * b[:, 1],
+                     a[:, 2] * b[:, 0] - a[:, 0] * b[:, 2],
+                     a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]], axis=1)
+
+
+def _rank(flags: np.ndarray, local: np.ndarray, segmentStarts: np.ndarray) -> np.ndarray:
+    # for every element, the number of set flags that precede it in its segment
+    before = np.cumsum(flags) - flags
+    return before - before[segmentStarts][local]
+
+
+class BVH(object):
+    def __init__(self, objects: Sequence[Tuple[np.ndarray, np.ndarray]], matrices: Optional[Sequence[np.ndarray]] = None,
+                 leafSize: int = 4, binCount: int = 16):
+        """
+        objects are (positions, indices) pairs, positions is an (N, 3) array and indices a flat triangle list.
+        matrices are row-major 4x4 object to world transforms (see camera.matrixToArray), identity by default.
+        """
+        self.leafSize: int = leafSize
+        self.binCount: int = binCount
+        self._local: List[np.ndarray] = []
+        counts = []
+        for positions, indices in objects:
+            positions = np.asarray(positions, np.float32)[:, :3]
+            self._local.append(positions[np.asarray(indices, np.int64).reshape(-1, 3)])
+            counts.append(len(self._local[-1]))
+        counts = np.array(counts, np.int64)
+        self._objectStarts = np.cumsum(counts) - counts
+        self._triangleObject = np.repeat(np.arange(len(counts), dtype=np.int32), counts)
+        self._triangleIndex = (np.arange(int(counts.sum())) - np.repeat(self._objectStarts, counts)).astype(np.int32)
+
+        triangles = np.concatenate(self._local) if self._local else np.zeros((0, 3, 3), np.float32)
+        if matrices is not None:
+            triangles = triangles.copy()
+            for i, matrix in enumerate(matrices):
+                start = self._objectStarts[i]
+                triangles[start:start + counts[i]] = self._transform(self._local[i], matrix)
+        self._build(triangles)
+
+    @classmethod
+    def fromMeshData(cls, meshes: Sequence[MeshData], matrices: Optional[Sequence[np.ndarray]] = None,
+                     **kwargs) -> "BVH":
+        objects = []
+        for mesh in meshes:
+            positions = positionArray(mesh)
+            if positions is None:
+                positions = np.zeros((0, 3), np.float32)
+                indices = np.zeros(0, np.int64)
+            else:
+                indices = mesh.indexArray()
+            objects.append((positions, indices))
+        return cls(objects, matrices, **kwargs)
+
+    @classmethod
+    def fromMeshFile(cls, path: str, **kwargs) -> "BVH":
+        # one object per mesh returned by readMeshFile, so object ids match the meshes of loadBinaryMesh
+        return cls.fromMeshData(readMeshFile(path), **kwargs)
+
+    @staticmethod
+    def _transform(triangles: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+        matrix = np.asarray(matrix, np.float32)
+        return triangles @ matrix[:3, :3].T + matrix[:3, 3]
+
+    @property
+    def nodeCount(self) -> int:
+        return len(self._nodeStart)
+
+    @property
+    def triangleCount(self) -> int:
+        return len(self._order)
+
+    def _build(self, triangles: np.ndarray):
+        count = len(triangles)
+        triangleMin = triangles.min(axis=1)
+        triangleMax = triangles.max(axis=1)
+        centroids = (triangleMin + triangleMax) * 0.5
+
+        capacity = max(1, 2 * count - 1)
+        nodeMin = np.zeros((capacity, 3), np.float32)
+        nodeMax = np.zeros((capacity, 3), np.float32)
+        # interior nodes have count 0 and start at their first child, leaves start at their first triangle
+        nodeStart = np.zeros(capacity, np.int64)
+        nodeCount = np.zeros(capacity, np.int64)
+        nodeParent = np.full(capacity, -1, np.int64)
+        nodeCount[0] = count
+        if count:
+            nodeMin[0] = triangleMin.min(axis=0)
+            nodeMax[0] = triangleMax.max(axis=0)
+        order = np.arange(count, dtype=np.int64)
+        usedNodes = 1
+        # the bounds and centroids of the triangles, kept in the same order as order so we read them sequentially
+        boxes = np.concatenate([triangleMin, triangleMax, centroids], axis=1)
+
+        B = self.binCount
+        active = np.array([0] if count > self.leafSize else [], np.int64)
+        while len(active):
+            A = len(active)
+            starts = nodeStart[active]
+            counts = nodeCount[active]
+            positions = _segments(starts, counts)
+            segmentStarts = np.cumsum(counts) - counts
+            local = np.repeat(np.arange(A), counts)
+            primitives = order[positions]
+            levelBoxes = boxes[positions]
+
+            # bin the centroids along the axis in which they are spread out the most
+            c = levelBoxes[:, 6:]
+            centroidMin = np.minimum.reduceat(c, segmentStarts)
+            extent = np.maximum.reduceat(c, segmentStarts) - centroidMin
+            axis = np.argmax(extent, axis=1)
+            axisMin = centroidMin[np.arange(A), axis]
+            axisExtent = extent[np.arange(A), axis]
+            scale = np.where(axisExtent > 0.0, B / np.maximum(axisExtent, 1e-30), 0.0)
+            coordinate = np.take_along_axis(c, axis[local][:, None], axis=1)[:, 0]
+            bins = np.minimum(((coordinate - axisMin[local]) * scale[local]).astype(np.int64), B - 1)
+            key = local * B + bins
+
+            binCounts = np.bincount(key, minlength=A * B).reshape(A, B)
+            binMin = np.full((3, A * B), np.inf, np.float32)
+            binMax = np.full((3, A * B), -np.inf, np.float32)
+            for i in range(3):
+                np.minimum.at(binMin[i], key, levelBoxes[:, i])
+                np.maximum.at(binMax[i], key, levelBoxes[:, 3 + i])
+            binMin = binMin.T.reshape(A, B, 3)
+            binMax = binMax.T.reshape(A, B, 3)
+
+            # cost of splitting after each bin, the cost of the other terms of the heuristic is the same for all splits
+            leftCount = np.cumsum(binCounts, axis=1)[:, :-1]
+            rightCount = counts[:, None] - leftCount
+            leftArea = _boxArea(np.minimum.accumulate(binMin, axis=1), np.maximum.accumulate(binMax, axis=1))[:, :-1]
+            rightArea = _boxArea(np.minimum.accumulate(binMin[:, ::-1], axis=1),
+                                 np.maximum.accumulate(binMax[:, ::-1], axis=1))[:, ::-1][:, 1:]
+            cost = leftArea * leftCount + rightArea * rightCount
+            cost[(leftCount == 0) | (rightCount == 0)] = np.inf
+            split = np.argmin(cost, axis=1)
+
+            right = bins > split[local]
+            # when all centroids share a bin we can't do better than splitting the triangles in half
+            median = ~np.isfinite(cost[np.arange(A), split])
+            if median.any():
+                inMedian = median[local]
+                rank = np.arange(len(local)) - segmentStarts[local]
+                right[inMedian] = (rank >= counts[local] // 2)[inMedian]
+
+            left = ~right
+            leftCounts = np.bincount(local, left, A).astype(np.int64)
+            destination = starts[local] + np.where(left, _rank(left, local, segmentStarts),
+                                                   leftCounts[local] + _rank(right, local, segmentStarts))
+            order[destination] = primitives
+            boxes[destination] = levelBoxes
+
+            # allocate the children next to each other
+            children = usedNodes + 2 * np.arange(A)
+            usedNodes += 2 * A
+            childStarts = np.stack([starts, starts + leftCounts], axis=1).ravel()
+            childCounts = np.stack([leftCounts, counts - leftCounts], axis=1).ravel()
+            childIds = np.stack([children, children + 1], axis=1).ravel()
+            nodeStart[active] = children
+            nodeCount[active] = 0
+            nodeStart[childIds] = childStarts
+            nodeCount[childIds] = childCounts
+            nodeParent[childIds] = np.repeat(active, 2)
+            partitioned = boxes[positions]
+            childSegments = np.stack([segmentStarts, segmentStarts + leftCounts], axis=1).ravel()
+            nodeMin[childIds] = np.minimum.reduceat(partitioned[:, :3], childSegments)
+            nodeMax[childIds] = np.maximum.reduceat(partitioned[:, 3:6], childSegments)
+
+            active = childIds[childCounts > self.leafSize]
+
+        # minimum and maximum of every node, so a ray test needs one lookup
+        self._nodeBounds = np.stack([nodeMin[:usedNodes], nodeMax[:usedNodes]], axis=1)
+        self._nodeStart = nodeStart[:usedNodes]
+        self._nodeCount = nodeCount[:usedNodes]
+        self._nodeParent = nodeParent[:usedNodes]
+        # triangles are stored in tree order, so the triangles of a leaf are contiguous
+        self._order = order
+        self._position = np.empty(count, np.int64)
+        self._position[order] = np.arange(count)
+        self._triangles = np.ascontiguousarray(triangles[order])
+        leaves = np.flatnonzero(self._nodeCount)
+        self._triangleLeaf = np.empty(count, np.int64)
+        self._triangleLeaf[_segments(self._nodeStart[leaves], self._nodeCount[leaves])] = \
+            np.repeat(leaves, self._nodeCount[leaves])
+
+    def refit(self, objectIndex: int, matrix: np.ndarray):
+        """
+        Moves an object to a new row-major object to world matrix, and updates the bounds of its leaves and their parents.
+        """
+        start = self._objectStarts[objectIndex]
+        local = self._local[objectIndex]
+        positions = self._position[start:start + len(local)]
+        self._triangles[positions] = self._transform(local, matrix)
+
+        dirty = np.unique(self._triangleLeaf[positions])
+        if not len(dirty):
+            return
+        counts = self._nodeCount[dirty]
+        triangles = self._triangles[_segments(self._nodeStart[dirty], counts)]
+        segmentStarts = np.cumsum(counts) - counts
+        self._nodeBounds[dirty, 0] = np.minimum.reduceat(triangles.min(axis=1), segmentStarts)
+        self._nodeBounds[dirty, 1] = np.maximum.reduceat(triangles.max(axis=1), segmentStarts)
+        # a node may be updated more than once when its leaves are at different depths, the last update wins
+        while True:
+            dirty = np.unique(self._nodeParent[dirty])
+            dirty = dirty[dirty >= 0]
+            if not len(dirty):
+                break
+            children = self._nodeStart[dirty]
+            self._nodeBounds[dirty, 0] = np.minimum(self._nodeBounds[children, 0], self._nodeBounds[children + 1, 0])
+            self._nodeBounds[dirty, 1] = np.maximum(self._nodeBounds[children, 1], self._nodeBounds[children + 1, 1])
+
+    def intersect(self, origins: np.ndarray, directions: np.ndarray, maxDistance: float = np.inf) -> RayHits:
+        """
+        Finds the nearest triangle along each of the (N, 3) rays, in units of the direction vectors.
+        Triangles are hit from both sides.
+        """
+        origins = np.asarray(origins, np.float32).reshape(-1, 3)
+        directions = np.asarray(directions, np.float32).reshape(-1, 3)
+        count = len(origins)
+        distance = np.full(count, maxDistance, np.float32)
+        hitPosition = np.full(count, -1, np.int64)
+        barycentrics = np.zeros((count, 2), np.float32)
+        rays = np.arange(count) if self.triangleCount else np.zeros(0, np.int64)
+        nodes = np.zeros(len(rays), np.int64)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverse = 1.0 / directions
+            while len(rays):
+                # slab test, fmin and fmax ignore the nans of rays that lie in a slab plane
+                slabs = (self._nodeBounds[nodes] - origins[rays][:, None]) * inverse[rays][:, None]
+                near = np.fmax(np.fmax.reduce(np.fmin(slabs[:, 0], slabs[:, 1]), axis=1), 0.0)
+                far = np.fmin.reduce(np.fmax(slabs[:, 0], slabs[:, 1]), axis=1)
+                keep = (near <= far) & (near < distance[rays])
+                rays = rays[keep]
+                nodes = nodes[keep]
+
+                counts = self._nodeCount[nodes]
+                leaf = counts > 0
+                if leaf.any():
+                    self._intersectLeaves(origins, directions, rays[leaf], nodes[leaf], counts[leaf],
+                                          distance, hitPosition, barycentrics)
+                    interior = ~leaf
+                    rays = rays[interior]
+                    nodes = nodes[interior]
+                rays = np.repeat(rays, 2)
+                nodes = np.repeat(self._nodeStart[nodes], 2)
+                nodes[1::2] += 1
+
+        hit = hitPosition >= 0
+        triangles = self._order[hitPosition[hit]]
+        objects = np.full(count, -1, np.int32)
+        objects[hit] = self._triangleObject[triangles]
+        indices = np.full(count, -1, np.int32)
+        indices[hit] = self._triangleIndex[triangles]
+        distance[~hit] = np.inf
+        return RayHits(distance, objects, indices, barycentrics)
+
+    def _intersectLeaves(self, origins, directions, rays, nodes, counts, distance, hitPosition, barycentrics):
+        positions = _segments(self._nodeStart[nodes], counts)
+        rays = np.repeat(rays, counts)
+        triangles = self._triangles[positions]
+        o = origins[rays]
+        d = directions[rays]
+
+        # Moller-Trumbore
+        edge1 = triangles[:, 1] - triangles[:, 0]
+        edge2 = triangles[:, 2] - triangles[:, 0]
+        p = _cross(d, edge2)
+        determinant = np.einsum('ij,ij->i', edge1, p)
+        parallel = np.abs(determinant) < 1e-12
+        inverse = 1.0 / np.where(parallel, 1.0, determinant)
+        s = o - triangles[:, 0]
+        u = np.einsum('ij,ij->i', s, p) * inverse
+        q = _cross(s, edge1)
+        v = np.einsum('ij,ij->i', d, q) * inverse
+        t = np.einsum('ij,ij->i', edge2, q) * inverse
+        valid = ~parallel & (u >= 0.0) & (v >= 0.0) & (u + v <= 1.0) & (t >= 0.0) & (t < distance[rays])
+        if not valid.any():
+            return
+
+        rays, positions, t, u, v = rays[valid], positions[valid], t[valid], u[valid], v[valid]
+        np.minimum.at(distance, rays, t)
+        # ties between triangles at the same distance are resolved arbitrarily
+        nearest = t == distance[rays]
+        rays = rays[nearest]
+        hitPosition[rays] = positions[nearest]
+        barycentrics[rays, 0] = u[nearest]
+        barycentrics[rays, 1] = v[nearest]
+
+
+def screenRays(camera, aspectRatio: float, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns world space origins and unit directions of rays through (N, 2) points in normalized device
+    coordinates (-1 to 1, y up), starting at the near plane.
+    """
+    points = np.asarray(points, np.float64).reshape(-1, 2)
+    projection = matrixToArray(camera.projectionMatrix(aspectRatio))
+    cameraMatrix = matrixToArray(camera.cameraMatrix())
+    inverse = cameraMatrix @ np.linalg.inv(projection)
+    near = np.concatenate([points, np.full((len(points), 1), -1.0), np.ones((len(points), 1))], axis=1) @ inverse.T
+    far = np.concatenate([points, np.ones((len(points), 2))], axis=1) @ inverse.T
+    near = near[:, :3] / near[:, 3:]
+    far = far[:, :3] / far[:, 3:]
+    directions = far - near
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    return near.astype(np.float32), directions.astype(np.float32)
@@ -1,8 +1,14 @@
 import math
+import numpy as np
 from MMath.mmath import Vec3, Mat44, ERotateOrder
 from .core import TSignal
 
 
+def matrixToArray(matrix: Mat44) -> np.ndarray:
+    # Mat44 stores its columns back to back (like OpenGL expects), so the transpose gives us row-major
+    return np.array(matrix.m, np.float64).reshape(4, 4).T
+
+
 class Camera:
     def __init__(self):
         super().__init__()
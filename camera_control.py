@@ -1,9 +1,14 @@
 import time
-from math import radians
+from math import radians, atan, tan, sin
+from typing import *
 from PySide6.QtCore import *
 from PySide6.QtGui import *
 
 from MMath.mmath import Mat44, Float4, Vec3, ERotateOrder
+from .mesh_format import Bounds
+
+# A is also fly-left, releasing it within this many seconds counts as a tap, which frames the scene
+FRAME_TAP_SECONDS = 0.2
 
 
 def TransformCore_localTransform(transform):
@@ -13,8 +18,8 @@ def TransformCore_localTransform(transform):
 class CameraEventFilter(QObject):
     def __init__(self, camera):
         # panning moves the pivot
-        # pressing A moves the pivot to the center of the scene (using bounding boxes)
-        # pressing F moves the pivot to the center of the selection (using bounding boxes)
+        # tapping A moves the pivot to the center of the scene and zooms to fit it (using sceneBounds)
+        # pressing F moves the pivot to the center of the selection and zooms to fit it (using selectionBounds)
         # scrolling zooms in and out
         # dragging while holding ALT tumbles around the pivot
         super().__init__()
@@ -28,6 +33,13 @@ class CameraEventFilter(QObject):
         self.distance = 10.0
         self.dragStart = None
 
+        # callbacks that return world space bounds (see Mesh.worldBounds and Bounds.union), or None if there is nothing
+        self.sceneBounds: Optional[Callable[[], Optional[Bounds]]] = None
+        self.selectionBounds: Optional[Callable[[], Optional[Bounds]]] = None
+        # of the widget we filter events for, needed to fit bounds in the vertical field of view
+        self.aspectRatio = 1.0
+        self.framePressTime = None
+
         self.keys = {
             Qt.Key_W: 0,
             Qt.Key_A: 0,
@@ -63,6 +75,8 @@ class CameraEventFilter(QObject):
         self.camera.changed.emit()
 
     def eventFilter(self, obj, event):
+        if hasattr(obj, 'width') and hasattr(obj, 'height') and obj.height() > 0:
+            self.aspectRatio = obj.width() / obj.height()
         if isinstance(event, QWheelEvent):
             return self.wheelEvent(event)
         if isinstance(event, QMouseEvent):
@@ -85,6 +99,12 @@ class CameraEventFilter(QObject):
         return True
 
     def keyPressEvent(self, event):
+        if event.key() == Qt.Key_F:
+            if not event.isAutoRepeat():
+                self.frameSelection()
+            return True
+        if event.key() == Qt.Key_A and not event.isAutoRepeat():
+            self.framePressTime = time.time()
         if event.key() in self.keys:
             self.keys[event.key()] = 3
             return True
@@ -97,11 +117,34 @@ class CameraEventFilter(QObject):
         self.keys[None] = (int(alt) << 2) | (int(ctrl) << 1) | int(shift)
 
     def keyReleaseEvent(self, event):
+        if event.key() == Qt.Key_A and not event.isAutoRepeat() and self.framePressTime is not None:
+            if time.time() - self.framePressTime < FRAME_TAP_SECONDS:
+                # this replaces the pivot, so the bit of flying we did while the key was down does not matter
+                self.frameScene()
+            self.framePressTime = None
         if event.key() in self.keys:
             self.keys[event.key()] = 2
             return True
         return False
 
+    def frameBounds(self, bounds: Optional[Bounds]):
+        # moves the pivot to the center of the bounding sphere and zooms out until the sphere fits in the view
+        if bounds is None:
+            return
+        horizontal = radians(self.camera.horizontalFieldOfViewDegrees)
+        vertical = 2.0 * atan(tan(horizontal * 0.5) / self.aspectRatio)
+        self.pivot = Float4(float(bounds.center[0]), float(bounds.center[1]), float(bounds.center[2]), 1.0)
+        self.distance = max(bounds.radius, 1e-3) / sin(min(horizontal, vertical) * 0.5)
+        self.updateCamera()
+
+    def frameScene(self):
+        if self.sceneBounds is not None:
+            self.frameBounds(self.sceneBounds())
+
+    def frameSelection(self):
+        if self.selectionBounds is not None:
+            self.frameBounds(self.selectionBounds())
+
     def setCameraPosition(self, t):
         matrix = TransformCore_localTransform(self.camera)
         self.pivot = t - matrix.col2 * self.distance
@@ -0,0 +1,226 @@
+"""
+View frustum culling of many objects at once.
+
+planes = frustumPlanes(camera, aspectRatio)
+visible = cullBoxes(planes, minimums, maximums)  # bool mask
+for i in np.flatnonzero(visible):
+    meshes[i].draw()
+
+Or keep a FrustumCuller with the world bounds of all objects and ask it for the indices to draw every frame.
+Run this module to compare against culling in a Python loop:
+python -m TTOpenGL.culling [objectCount]
+"""
+import time
+from typing import *
+import numpy as np
+from .camera import matrixToArray
+from .mesh_format import Bounds
+
+
+def frustumPlanesFromMatrix(viewProjection: np.ndarray) -> np.ndarray:
+    """
+    Returns the (6, 4) planes (left, right, bottom, top, near, far) of a row-major view-projection matrix,
+    with normals pointing inwards and normalized so plane @ (x, y, z, 1) is the signed distance.
+    """
+    rows = np.asarray(viewProjection, np.float64)
+    planes = np.array((rows[3] + rows[0], rows[3] - rows[0],
+                       rows[3] + rows[1], rows[3] - rows[1],
+                       rows[3] + rows[2], rows[3] - rows[2]))
+    planes /= np.linalg.norm(planes[:, :3], axis=1)[:, None]
+    return planes
+
+
+def frustumPlanes(camera, aspectRatio: float) -> np.ndarray:
+    # world space planes of what the camera sees
+    projection = matrixToArray(camera.projectionMatrix(aspectRatio))
+    view = np.linalg.inv(matrixToArray(camera.cameraMatrix()))
+    return frustumPlanesFromMatrix(projection @ view)
+
+
+def localPlanes(planes: np.ndarray, modelMatrix: np.ndarray) -> np.ndarray:
+    """
+    Returns world space planes in the object space of a row-major model matrix, normalized in that space,
+    so objects can be culled with their object space bounds.
+    """
+    planes = planes @ modelMatrix
+    planes /= np.linalg.norm(planes[:, :3], axis=1)[:, None]
+    return planes
+
+
+def _planeDistances(planes: Iterable[Sequence[float]], x: np.ndarray, y: np.ndarray, z: np.ndarray,
+                    reach: Callable[[float, float, float, np.ndarray, np.ndarray], None]) -> np.ndarray:
+    # one plane at a time over contiguous float32 component arrays, writing into preallocated scratch
+    # arrays, this is several times faster than a (N, 3) @ (3, 6) product for these narrow matrices
+    visible = np.ones(len(x), bool)
+    distances = np.empty(len(x), np.float32)
+    scratch = np.empty(len(x), np.float32)
+    inside = np.empty(len(x), bool)
+    for a, b, c, d in planes:
+        np.multiply(x, a, out=distances)
+        np.multiply(y, b, out=scratch)
+        distances += scratch
+        np.multiply(z, c, out=scratch)
+        distances += scratch
+        reach(a, b, c, distances, scratch)
+        np.greater_equal(distances, -d, out=inside)
+        visible &= inside
+    return visible
+
+
+def _components(values: np.ndarray) -> np.ndarray:
+    # (N, 3) to a contiguous (3, N) float32 array
+    return np.ascontiguousarray(np.asarray(values, np.float32).T)
+
+
+def cullSpheres(planes: np.ndarray, centers: np.ndarray, radii: np.ndarray) -> np.ndarray:
+    """
+    Returns a bool mask of the (N, 3) centers and (N,) radii that intersect the frustum.
+    """
+    x, y, z = _components(centers)
+    radii = np.asarray(radii, np.float32)
+
+    def reach(a, b, c, distances, scratch):
+        distances += radii
+
+    return _planeDistances(planes.tolist(), x, y, z, reach)
+
+
+def _cullBoxes(planes: np.ndarray, centers: np.ndarray, extents: np.ndarray) -> np.ndarray:
+    # centers and extents are (3, N) float32 arrays
+    ex, ey, ez = extents
+
+    def reach(a, b, c, distances, scratch):
+        # how far the box reaches towards the plane
+        np.multiply(ex, abs(a), out=scratch)
+        distances += scratch
+        np.multiply(ey, abs(b), out=scratch)
+        distances += scratch
+        np.multiply(ez, abs(c), out=scratch)
+        distances += scratch
+
+    return _planeDistances(planes.tolist(), *centers, reach)
+
+
+def cullBoxes(planes: np.ndarray, minimums: np.ndarray, maximums: np.ndarray) -> np.ndarray:
+    """
+    Returns a bool mask of the (N, 3) axis aligned boxes that intersect the frustum.
+    A box is culled when it is entirely behind one of the planes, so some boxes near the corners
+    of the frustum are reported visible while they are not, like any plane based test.
+    """
+    minimums = np.asarray(minimums, np.float32)
+    maximums = np.asarray(maximums, np.float32)
+    return _cullBoxes(planes, _components((minimums + maximums) * 0.5), _components((maximums - minimums) * 0.5))
+
+
+def stackBounds(bounds: Sequence[Bounds]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # returns the minimums, maximums, centers and radii as arrays
+    count = len(bounds)
+    minimums = np.empty((count, 3), np.float32)
+    maximums = np.empty((count, 3), np.float32)
+    centers = np.empty((count, 3), np.float32)
+    radii = np.empty(count, np.float32)
+    for i, b in enumerate(bounds):
+        minimums[i], maximums[i], centers[i], radii[i] = b
+    return minimums, maximums, centers, radii
+
+
+class FrustumCuller(object):
+    """
+    World space bounding boxes of a list of objects, objects without bounds (None) are never culled.
+    The boxes are kept as centers and extents laid out per component, so culling does not copy anything.
+    """
+
+    def __init__(self, bounds: Sequence[Optional[Bounds]] = ()):
+        self.setBounds(bounds)
+
+    def setBounds(self, bounds: Sequence[Optional[Bounds]]):
+        self._unbounded = np.array([b is None for b in bounds], bool)
+        empty = Bounds(np.zeros(3, np.float32), np.zeros(3, np.float32), np.zeros(3, np.float32), 0.0)
+        minimums, maximums, _, _ = stackBounds([empty if b is None else b for b in bounds])
+        self.setBoxes(minimums, maximums, self._unbounded)
+
+    def setBoxes(self, minimums: np.ndarray, maximums: np.ndarray, unbounded: Optional[np.ndarray] = None):
+        # same as setBounds, for when the boxes are already in arrays
+        self._centers = _components((minimums + maximums) * 0.5)
+        self._extents = _components((maximums - minimums) * 0.5)
+        self._unbounded = np.zeros(len(minimums), bool) if unbounded is None else unbounded
+
+    def updateBounds(self, index: int, bounds: Optional[Bounds]):
+        # for objects that moved
+        self._unbounded[index] = bounds is None
+        if bounds is not None:
+            self._centers[:, index] = (bounds.minimum + bounds.maximum) * 0.5
+            self._extents[:, index] = (bounds.maximum - bounds.minimum) * 0.5
+
+    def __len__(self):
+        return len(self._unbounded)
+
+    def visibilityMask(self, planes: np.ndarray) -> np.ndarray:
+        return _cullBoxes(planes, self._centers, self._extents) | self._unbounded
+
+    def cull(self, camera, aspectRatio: float) -> np.ndarray:
+        # indices of the visible objects, in their original order
+        return np.flatnonzero(self.visibilityMask(frustumPlanes(camera, aspectRatio)))
+
+
+def _cullBoxesLoop(planes: np.ndarray, minimums: np.ndarray, maximums: np.ndarray) -> List[bool]:
+    # reference implementation for the benchmark, what we would write without numpy
+    planes = planes.tolist()
+    result = []
+    for minimum, maximum in zip(minimums.tolist(), maximums.tolist()):
+        visible = True
+        for a, b, c, d in planes:
+            # the corner furthest along the plane normal
+            x = maximum[0] if a >= 0.0 else minimum[0]
+            y = maximum[1] if b >= 0.0 else minimum[1]
+            z = maximum[2] if c >= 0.0 else minimum[2]
+            if a * x + b * y + c * z + d < 0.0:
+                visible = False
+                break
+        result.append(visible)
+    return result
+
+
+def benchmark(objectCount: int = 50000, repeat: int = 20) -> Tuple[float, float, float]:
+    """
+    Returns the milliseconds a FrustumCuller and the Python loop take for objectCount random boxes,
+    and the fraction of visible objects.
+    """
+    rng = np.random.default_rng(0)
+    centers = rng.uniform(-500.0, 500.0, (objectCount, 3)).astype(np.float32)
+    extents = rng.uniform(0.5, 5.0, (objectCount, 3)).astype(np.float32)
+    minimums, maximums = centers - extents, centers + extents
+
+    # a 72 degree camera at the origin looking down -z, see Mat44.perspectiveX
+    near, far, aspectRatio = 0.1, 1000.0, 16.0 / 9.0
+    x = 1.0 / np.tan(np.radians(72.0) * 0.5)
+    projection = np.array(((x, 0.0, 0.0, 0.0),
+                           (0.0, x * aspectRatio, 0.0, 0.0),
+                           (0.0, 0.0, (far + near) / (near - far), 2.0 * far * near / (near - far)),
+                           (0.0, 0.0, -1.0, 0.0)))
+    planes = frustumPlanesFromMatrix(projection)
+
+    culler = FrustumCuller()
+    culler.setBoxes(minimums, maximums)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        visible = culler.visibilityMask(planes)
+    vectorized = (time.perf_counter() - start) * 1000.0 / repeat
+
+    start = time.perf_counter()
+    reference = _cullBoxesLoop(planes, minimums, maximums)
+    loop = (time.perf_counter() - start) * 1000.0
+
+    # float32 against float64, boxes that touch a plane may go either way
+    assert np.mean(visible == np.array(reference)) > 0.999
+    return vectorized, loop, float(visible.mean())
+
+
+if __name__ == '__main__':
+    import sys
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    vectorized, loop, fraction = benchmark(count)
+    print('%i objects, %.1f%% visible' % (count, fraction * 100.0))
+    print('numpy:  %.3f ms' % vectorized)
+    print('python: %.3f ms (%.0fx slower)' % (loop, loop / max(vectorized, 1e-9)))
@@ -0,0 +1,563 @@
+"""
+Reads meshes from Maya ASCII (.ma) files without Maya, producing the same layout as maya_mesh.exportAllMeshes:
+world space POSITION, NORMAL and TANGENT, a TEXCOORD per uv set and a COLOR per color set.
+
+meshes = readMayaAscii('scene.ma')
+writeMeshFile('scene.mesh', meshes, b'MAYA')
+
+mesh_convert.py converts .ma files too. The file is read statement by statement, the text of statements we have no
+use for (like script nodes) is never kept, so memory use is bounded by the mesh data itself.
+Running this module checks the reader against the baked hinge.ma, with a path it prints the meshes in that file.
+
+Only baked meshes can be read: a mesh with construction history or deformers (an incoming connection to its inMesh)
+is computed by Maya when the scene loads and its data is not in the file. These meshes are reported in
+MayaAsciiScene.skipped instead, delete the history (or bake the deformers) in Maya to convert them.
+
+Differences with the Maya exporter:
+- polygons are fan triangulated, Maya may pick other diagonals, and holes are ignored
+- normals that are not locked are computed from the hard and soft edges, area weighted
+- tangents are computed from the current uv set in the same smoothing groups, split at uv seams
+- skinning is not exported, node names are resolved by their last path component when they are not full paths
+"""
+import os
+import re
+import warnings
+from typing import *
+import numpy as np
+from .mesh_builder import MeshBuilder, fanTriangles
+from .mesh_format import VertexAttribute, MeshData
+
+# attributes we read, by their short name, and the long names Maya may write instead
+_meshAttributes = {'vt', 'pt', 'ed', 'fc', 'n', 'uvst', 'clst', 'io', 'cuvs'}
+_transformAttributes = {'t', 'tx', 'ty', 'tz', 'r', 'rx', 'ry', 'rz', 's', 'sx', 'sy', 'sz', 'ro',
+                        'rp', 'sp', 'rpt', 'spt', 'ra', 'sh', 'jo'}
+_longNames = {'vrts': 'vt', 'pnts': 'pt', 'edge': 'ed', 'face': 'fc', 'normals': 'n', 'uvSet': 'uvst',
+              'uvSetName': 'uvsn', 'uvSetPoints': 'uvsp', 'colorSet': 'clst', 'colorName': 'clsn',
+              'colorSetPoints': 'clsp', 'intermediateObject': 'io', 'currentUVSet': 'cuvs',
+              'translate': 't', 'rotate': 'r', 'scale': 's', 'rotateOrder': 'ro', 'rotatePivot': 'rp',
+              'scalePivot': 'sp', 'rotatePivotTranslate': 'rpt', 'scalePivotTranslate': 'spt', 'rotateAxis': 'ra',
+              'shear': 'sh', 'jointOrient': 'jo', 'inMesh': 'i', 'instObjGroups': 'iog', 'dagSetMembers': 'dsm',
+              'surfaceShader': 'ss', 'outColor': 'oc'}
+_transformTypes = {'transform', 'joint'}
+_keywords = ('createNode', 'setAttr', 'connectAttr', 'select', 'currentUnit')
+_quoted = re.compile(r'"(?:[^"\\]|\\.)*"')
+_attributePart = re.compile(r'(\w+)(?:\[(\d+)(?::(\d+))?\])?')
+# maya leaves normals that are not locked at this value
+_UNLOCKED_NORMAL = 1e19
+# the default shading group has no connection to its material in the file
+_defaultMaterials = {'initialShadingGroup': 'lambert1'}
+
+
+def _statements(path: str) -> Iterator[str]:
+    """
+    Yields the text of every MEL statement we can use, other statements are skipped line by line.
+    A statement ends at the first line with a semicolon outside of quotes, maya never puts two statements on a line.
+    """
+    lines = []
+    inStatement = False
+    keep = False
+    with open(path, 'r', encoding='utf8', errors='replace') as fh:
+        for line in fh:
+            if not inStatement:
+                stripped = line.lstrip()
+                if not stripped or stripped.startswith('//'):
+                    continue
+                inStatement = True
+                keep = stripped.startswith(_keywords)
+            if keep:
+                lines.append(line)
+            if ';' in _quoted.sub('', line):
+                if keep:
+                    yield ''.join(lines)
+                lines.clear()
+                inStatement = False
+
+
+def _arguments(statement: str) -> Tuple[Dict[str, str], List[str]]:
+    # flags with their value and positional (quoted) arguments of a short command like createNode or connectAttr
+    tokens = re.findall(r'"(?:[^"\\]|\\.)*"|[^\s;]+', statement)[1:]
+    flags = {}
+    positional = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token.startswith('-') and not token[1:2].isdigit():
+            hasValue = i + 1 < len(tokens) and not tokens[i + 1].startswith('-')
+            flags[token] = tokens[i + 1].strip('"') if hasValue else ''
+            i += 2 if hasValue else 1
+        else:
+            positional.append(token.strip('"'))
+            i += 1
+    return flags, positional
+
+
+def _attributePath(name: str) -> List[Tuple[str, Optional[int], Optional[int]]]:
+    # ".uvst[0].uvsp[0:13]" to [('uvst', 0, 0), ('uvsp', 0, 13)]
+    result = []
+    for part in name.strip('.').split('.'):
+        match = _attributePart.fullmatch(part)
+        if match is None:
+            return []
+        attribute, start, end = match.groups()
+        start = None if start is None else int(start)
+        end = start if end is None else int(end)
+        result.append((_longNames.get(attribute, attribute), start, end))
+    return result
+
+
+class _Node(object):
+    def __init__(self, nodeType: str, name: str, path: str, parent: Optional['_Node']):
+        self.type = nodeType
+        self.name = name
+        self.path = path
+        self.parent = parent
+        self.values: Dict[str, Any] = {}
+        # chunks of array attributes as (first index, values), by attribute name like 'vt' or 'uvst[0].uvsp'
+        self.arrays: Dict[str, List[Tuple[int, Any]]] = {}
+        self.hasHistory = False
+        self.shadingGroup: Optional[str] = None
+
+
+def _gather(chunks: List[Tuple[int, np.ndarray]], components: int, fill: float = 0.0) -> np.ndarray:
+    # assembles the chunks of an array attribute into one (count, components) array
+    if not chunks:
+        return np.zeros((0, components), np.float64)
+    count = max(start + len(values) // components for start, values in chunks)
+    result = np.full((count, components), fill, np.float64)
+    for start, values in chunks:
+        values = values[:len(values) // components * components].reshape(-1, components)
+        result[start:start + len(values)] = values
+    return result
+
+
+def _parsePolyFaces(tokens: List[str]) -> List[Tuple[List[int], Dict[int, List[int]], Dict[int, List[int]]]]:
+    # the edges, uv ids per uv set and color ids per color set of every face
+    faces = []
+    inHole = False
+    i = 0
+    while i < len(tokens):
+        keyword = tokens[i]
+        if keyword in ('f', 'h'):
+            count = int(tokens[i + 1])
+            if keyword == 'f':
+                faces.append(([int(t) for t in tokens[i + 2:i + 2 + count]], {}, {}))
+            inHole = keyword == 'h'
+            i += 2 + count
+        elif keyword in ('mu', 'mc'):
+            setIndex, count = int(tokens[i + 1]), int(tokens[i + 2])
+            if not inHole:
+                faces[-1][1 if keyword == 'mu' else 2][setIndex] = [int(t) for t in tokens[i + 3:i + 3 + count]]
+            i += 3 + count
+        elif keyword in ('mf', 'mh'):
+            # old style uv ids of faces and holes, unused since the uv sets
+            i += 2 + int(tokens[i + 1])
+        else:
+            raise ValueError(f'Unknown polyFaces keyword "{keyword}".')
+    return faces
+
+
+def _rotation(angles: np.ndarray, order: int = 0) -> np.ndarray:
+    # column vector rotation matrix, the rotate order names the axes in the order they are applied
+    x, y, z = angles
+    cx, sx, cy, sy, cz, sz = np.cos(x), np.sin(x), np.cos(y), np.sin(y), np.cos(z), np.sin(z)
+    axes = {'x': np.array(((1.0, 0.0, 0.0), (0.0, cx, -sx), (0.0, sx, cx))),
+            'y': np.array(((cy, 0.0, sy), (0.0, 1.0, 0.0), (-sy, 0.0, cy))),
+            'z': np.array(((cz, -sz, 0.0), (sz, cz, 0.0), (0.0, 0.0, 1.0)))}
+    result = np.eye(3)
+    for axis in ('xyz', 'yzx', 'zxy', 'xzy', 'yxz', 'zyx')[order]:
+        result = axes[axis] @ result
+    return result
+
+
+def _translation(offset: np.ndarray) -> np.ndarray:
+    result = np.eye(4)
+    result[:3, 3] = offset
+    return result
+
+
+def _linear(matrix: np.ndarray) -> np.ndarray:
+    result = np.eye(4)
+    result[:3, :3] = matrix
+    return result
+
+
+def _localMatrix(node: _Node, angleScale: float) -> np.ndarray:
+    """
+    Row-major matrix of a transform or joint as documented for the transform node, applied right to left:
+    T * RPT * RP * JO * R * RA * RP^-1 * SPT * SP * SH * S * SP^-1
+    """
+    def vector(name, default):
+        return np.array(node.values.get(name, default), np.float64)
+
+    rotatePivot = vector('rp', (0.0, 0.0, 0.0))
+    scalePivot = vector('sp', (0.0, 0.0, 0.0))
+    shear = vector('sh', (0.0, 0.0, 0.0))
+    shearMatrix = np.array(((1.0, shear[0], shear[1]), (0.0, 1.0, shear[2]), (0.0, 0.0, 1.0)))
+    return (_translation(vector('t', (0.0, 0.0, 0.0)) + vector('rpt', (0.0, 0.0, 0.0))) @
+            _translation(rotatePivot) @
+            _linear(_rotation(vector('jo', (0.0, 0.0, 0.0)) * angleScale)) @
+            _linear(_rotation(vector('r', (0.0, 0.0, 0.0)) * angleScale, int(node.values.get('ro', 0)))) @
+            _linear(_rotation(vector('ra', (0.0, 0.0, 0.0)) * angleScale)) @
+            _translation(vector('spt', (0.0, 0.0, 0.0)) - rotatePivot) @
+            _translation(scalePivot) @
+            _linear(shearMatrix @ np.diag(vector('s', (1.0, 1.0, 1.0)))) @
+            _translation(-scalePivot))
+
+
+def _normalized(vectors: np.ndarray) -> np.ndarray:
+    lengths = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(lengths > 0.0, lengths, 1.0)
+
+
+def _connectedLabels(count: int, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # labels every element with the lowest element it is connected to through the (a, b) pairs
+    labels = np.arange(count)
+    while len(a):
+        lowest = np.minimum(labels[a], labels[b])
+        if (labels[a] == labels[b]).all():
+            break
+        np.minimum.at(labels, a, lowest)
+        np.minimum.at(labels, b, lowest)
+        labels = labels[labels]
+    while True:
+        jumped = labels[labels]
+        if (jumped == labels).all():
+            return labels
+        labels = jumped
+
+
+def _sumPerGroup(groups: np.ndarray, values: np.ndarray, groupCount: int) -> np.ndarray:
+    return np.stack([np.bincount(groups, values[:, i], groupCount) for i in range(values.shape[1])], axis=1)
+
+
+class MayaAsciiScene(object):
+    def __init__(self, path: str):
+        self.path = path
+        self.nodes: Dict[str, _Node] = {}
+        self._byName: Dict[str, List[_Node]] = {}
+        self._materials: Dict[str, str] = dict(_defaultMaterials)
+        self._angleScale = np.pi / 180.0
+        # (mesh path, reason) of meshes that can not be converted
+        self.skipped: List[Tuple[str, str]] = []
+        current = None
+        for statement in _statements(path):
+            command = statement.split(None, 1)[0]
+            if command == 'createNode':
+                current = self._createNode(statement)
+            elif command == 'select':
+                _, positional = _arguments(statement)
+                current = self._resolve(positional[0]) if positional else None
+            elif command == 'setAttr':
+                if current is not None:
+                    self._setAttr(current, statement)
+            elif command == 'connectAttr':
+                self._connectAttr(statement)
+            elif command == 'currentUnit':
+                flags, _ = _arguments(statement)
+                if flags.get('-a', flags.get('-angle')) in ('rad', 'radian'):
+                    self._angleScale = 1.0
+
+    def _resolve(self, reference: str) -> Optional[_Node]:
+        # nodes by full path, unique name, or the end of their path
+        reference = reference.lstrip(':')
+        if reference in self.nodes:
+            return self.nodes[reference]
+        candidates = self._byName.get(reference.rsplit('|', 1)[-1], [])
+        if '|' in reference:
+            candidates = [node for node in candidates if node.path.endswith(reference)]
+        return candidates[0] if candidates else None
+
+    def _createNode(self, statement: str) -> Optional[_Node]:
+        flags, positional = _arguments(statement)
+        nodeType = positional[0]
+        name = flags.get('-n', flags.get('-name', nodeType + '1'))
+        parentName = flags.get('-p', flags.get('-parent'))
+        parent = self._resolve(parentName) if parentName else None
+        path = (parent.path if parent is not None else '') + '|' + name if nodeType in _transformTypes or nodeType == 'mesh' else name
+        node = _Node(nodeType, name, path, parent)
+        self.nodes[path] = node
+        self._byName.setdefault(name, []).append(node)
+        return node
+
+    def _setAttr(self, node: _Node, statement: str):
+        match = _quoted.search(statement)
+        if match is None:
+            return
+        path = _attributePath(match.group()[1:-1])
+        if not path:
+            return
+        attributes = _meshAttributes if node.type == 'mesh' else _transformAttributes if node.type in _transformTypes else set()
+        if path[0][0] not in attributes:
+            return
+        rest = statement[match.end():].strip().rstrip(';')
+        dataType = None
+        typeMatch = re.match(r'-type\s+"([^"]*)"', rest)
+        if typeMatch is not None:
+            dataType = typeMatch.group(1)
+            rest = rest[typeMatch.end():]
+        key = '.'.join('%s[%i]' % (name, start) if i < len(path) - 1 and start is not None else name
+                       for i, (name, start, end) in enumerate(path))
+        start = path[-1][1] or 0
+
+        if dataType == 'string':
+            strings = _quoted.findall(rest)
+            if strings:
+                node.values[key] = strings[0][1:-1]
+        elif dataType == 'polyFaces':
+            node.arrays.setdefault(key, []).append((start, _parsePolyFaces(rest.split())))
+        elif key in ('io',):
+            node.values[key] = rest.strip() in ('yes', 'on', 'true', '1')
+        else:
+            try:
+                values = np.array(rest.split(), np.float64)
+            except ValueError:
+                return
+            if not len(values):
+                return
+            if key in _transformAttributes:
+                if len(key) == 2 and key[1] in 'xyz' and key[0] in 'trs':
+                    # single components like tx
+                    vector = list(node.values.get(key[0], (1.0, 1.0, 1.0) if key[0] == 's' else (0.0, 0.0, 0.0)))
+                    vector['xyz'.index(key[1])] = values[0]
+                    node.values[key[0]] = vector
+                else:
+                    node.values[key] = values if len(values) > 1 else values[0]
+            else:
+                node.arrays.setdefault(key, []).append((start, values))
+
+    def _connectAttr(self, statement: str):
+        _, positional = _arguments(statement)
+        if len(positional) < 2:
+            return
+        # node names can not contain dots, the plug is everything after the first one
+        (sourceNode, _, sourcePlug), (targetNode, _, targetPlug) = (plug.partition('.') for plug in positional[:2])
+        source = _attributePath(sourcePlug)
+        target = _attributePath(targetPlug)
+        if not source or not target:
+            return
+        if target[0][0] == 'i':
+            node = self._resolve(targetNode)
+            if node is not None and node.type == 'mesh':
+                node.hasHistory = True
+        elif source[0][0] == 'iog' and target[0][0] == 'dsm':
+            node = self._resolve(sourceNode)
+            if node is not None and node.shadingGroup is None:
+                node.shadingGroup = targetNode.lstrip(':')
+        elif source[0][0] == 'oc' and target[0][0] == 'ss':
+            self._materials[targetNode.lstrip(':')] = sourceNode.lstrip(':')
+
+    def worldMatrix(self, node: _Node) -> np.ndarray:
+        matrix = np.eye(4)
+        parent = node.parent
+        while parent is not None:
+            if parent.type in _transformTypes:
+                matrix = _localMatrix(parent, self._angleScale) @ matrix
+            parent = parent.parent
+        return matrix
+
+    def meshNodes(self) -> List[_Node]:
+        # all meshes that are not intermediate objects, like cmds.ls(type='mesh', ni=True)
+        return [node for node in self.nodes.values() if node.type == 'mesh' and not node.values.get('io', False)]
+
+    def meshes(self) -> List[MeshData]:
+        self.skipped.clear()
+        result = []
+        for node in self.meshNodes():
+            if node.hasHistory:
+                self.skipped.append((node.path, 'the mesh is computed by construction history or deformers'))
+            elif not node.arrays.get('vt') or not node.arrays.get('fc'):
+                self.skipped.append((node.path, 'the mesh has no geometry'))
+            else:
+                result.append(self.meshBuilder(node).build())
+        return result
+
+    def meshBuilder(self, node: _Node) -> MeshBuilder:
+        material = self._materials.get(node.shadingGroup, '') if node.shadingGroup else ''
+        builder = MeshBuilder(node.path, material)
+
+        points = _gather(node.arrays['vt'], 3)
+        tweaks = _gather(node.arrays.get('pt', []), 3)[:len(points)]
+        points[:len(tweaks)] += tweaks
+        edges = _gather(node.arrays.get('ed', []), 3).astype(np.int64)
+        faces = [face for _, chunk in sorted(node.arrays['fc'], key=lambda chunk: chunk[0]) for face in chunk]
+
+        # face-vertices are numbered face by face, each starts the edge with the same number in its face
+        cornerCounts = np.array([len(face[0]) for face in faces], np.int64)
+        faceEdges = np.fromiter((edge for face in faces for edge in face[0]), np.int64, int(cornerCounts.sum()))
+        reversedEdges = faceEdges < 0
+        faceEdges = np.where(reversedEdges, ~faceEdges, faceEdges)
+        faceVertices = np.where(reversedEdges, edges[faceEdges, 1], edges[faceEdges, 0])
+        faceOfCorner = np.repeat(np.arange(len(faces)), cornerCounts)
+        firstCorners = np.cumsum(cornerCounts) - cornerCounts
+        nextCorners = firstCorners[faceOfCorner] + (np.arange(len(faceVertices)) - firstCorners[faceOfCorner] + 1) % cornerCounts[faceOfCorner]
+        triangles = fanTriangles(cornerCounts)
+        corners = triangles.ravel()
+
+        normals, groups = self._faceVertexNormals(node, points, edges, faceEdges, faceVertices, faceOfCorner, nextCorners)
+
+        uvSets = []
+        for key in sorted(k for k in node.arrays if k.startswith('uvst[') and k.endswith('.uvsp')):
+            setIndex = int(key[5:key.index(']')])
+            uvIds = np.full(len(faceVertices), -1, np.int64)
+            for face, first in zip(faces, firstCorners):
+                ids = face[1].get(setIndex)
+                if ids is not None:
+                    uvIds[first:first + len(ids)] = ids
+            uvSets.append((node.values.get('uvst[%i].uvsn' % setIndex, ''), _gather(node.arrays[key], 2), uvIds))
+
+        # tangents follow the current uv set
+        currentUVSet = next((uvSet for uvSet in uvSets if uvSet[0] == node.values.get('cuvs')), uvSets[0] if uvSets else None)
+        tangents = self._faceVertexTangents(points, faceVertices, triangles, normals, groups, currentUVSet)
+
+        matrix = self.worldMatrix(node)
+        rotation = matrix[:3, :3]
+        builder.addAttribute(VertexAttribute.Semantic.POSITION, (points @ rotation.T + matrix[:3, 3])[faceVertices[corners]])
+        builder.addAttribute(VertexAttribute.Semantic.NORMAL, _normalized(normals @ np.linalg.inv(rotation))[corners])
+        builder.addAttribute(VertexAttribute.Semantic.TANGENT, _normalized(tangents @ rotation.T)[corners])
+
+        for i, (_, uvs, uvIds) in enumerate(uvSets):
+            assert i < 8, 'We currently only anticipated 8 texcoords, please use a color set instead.'
+            uvs = np.concatenate([uvs, np.zeros((1, 2))])
+            builder.addAttribute(VertexAttribute.Semantic(VertexAttribute.Semantic.TEXCOORD0.value + i), uvs[uvIds[corners]])
+
+        colorSets = sorted(k for k in node.arrays if k.startswith('clst[') and k.endswith('.clsp'))
+        for i, key in enumerate(colorSets):
+            setIndex = int(key[5:key.index(']')])
+            colorIds = np.full(len(faceVertices), -1, np.int64)
+            for face, first in zip(faces, firstCorners):
+                ids = face[2].get(setIndex)
+                if ids is not None:
+                    colorIds[first:first + len(ids)] = ids
+            # face-vertices without a color get -1, like MFnMesh.getFaceVertexColors
+            colors = np.concatenate([_gather(node.arrays[key], 4), np.full((1, 4), -1.0)])
+            builder.addAttribute(VertexAttribute.Semantic(VertexAttribute.Semantic.COLOR0.value + i), colors[colorIds[corners]])
+
+        return builder
+
+    @staticmethod
+    def _faceVertexNormals(node: _Node, points: np.ndarray, edges: np.ndarray, faceEdges: np.ndarray,
+                           faceVertices: np.ndarray, faceOfCorner: np.ndarray,
+                           nextCorners: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns object space normals of all face-vertices and their smoothing group, face-vertices of a vertex are in
+        the same group when their faces are connected through soft edges around it.
+        """
+        # area weighted face normals
+        p = points[faceVertices]
+        q = points[faceVertices[nextCorners]]
+        crossed = np.stack([p[:, 1] * q[:, 2] - p[:, 2] * q[:, 1],
+                            p[:, 2] * q[:, 0] - p[:, 0] * q[:, 2],
+                            p[:, 0] * q[:, 1] - p[:, 1] * q[:, 0]], axis=1)
+        faceNormals = _sumPerGroup(faceOfCorner, crossed, int(faceOfCorner.max()) + 1)
+
+        # soft edges used by exactly two faces join the face-vertices at both ends
+        order = np.argsort(faceEdges, kind='stable')
+        uses = np.bincount(faceEdges, minlength=len(edges))
+        firstUse = np.cumsum(uses) - uses
+        soft = np.flatnonzero((uses == 2) & (edges[:, 2] != 0))
+        a, b = order[firstUse[soft]], order[firstUse[soft] + 1]
+        aNext, bNext = nextCorners[a], nextCorners[b]
+        sameDirection = faceVertices[a] == faceVertices[b]
+        joinsA = np.concatenate([a, aNext])
+        joinsB = np.concatenate([np.where(sameDirection, b, bNext), np.where(sameDirection, bNext, b)])
+        groups = _connectedLabels(len(faceVertices), joinsA, joinsB)
+
+        normals = _normalized(_sumPerGroup(groups, faceNormals[faceOfCorner], len(faceVertices))[groups])
+        locked = _gather(node.arrays.get('n', []), 3, _UNLOCKED_NORMAL)[:len(normals)]
+        isLocked = np.abs(locked).max(axis=1) < _UNLOCKED_NORMAL
+        normals[:len(locked)][isLocked] = _normalized(locked[isLocked])
+        return normals, groups
+
+    @staticmethod
+    def _faceVertexTangents(points: np.ndarray, faceVertices: np.ndarray, triangles: np.ndarray, normals: np.ndarray,
+                            groups: np.ndarray, uvSet: Optional[Tuple[str, np.ndarray, np.ndarray]]) -> np.ndarray:
+        # object space tangents, orthogonal to the normals
+        tangents = np.zeros_like(normals)
+        if uvSet is not None and len(triangles):
+            _, uvs, uvIds = uvSet
+            uvs = np.concatenate([uvs, np.zeros((1, 2))])[uvIds]
+            p0, p1, p2 = (points[faceVertices[triangles[:, i]]] for i in range(3))
+            t0, t1, t2 = (uvs[triangles[:, i]] for i in range(3))
+            e1, e2, d1, d2 = p1 - p0, p2 - p0, t1 - t0, t2 - t0
+            determinant = d1[:, 0] * d2[:, 1] - d2[:, 0] * d1[:, 1]
+            determinant = np.where(np.abs(determinant) > 1e-20, determinant, 1.0)
+            triangleTangents = (e1 * d2[:, 1:] - e2 * d1[:, 1:]) / determinant[:, None]
+            # sum in the smoothing groups, split at uv seams
+            _, keys = np.unique(np.stack([groups, uvIds], axis=1), axis=0, return_inverse=True)
+            keys = keys.ravel()
+            sums = _sumPerGroup(keys[triangles.ravel()], np.repeat(triangleTangents, 3, axis=0), int(keys.max()) + 1)
+            tangents = sums[keys]
+        tangents -= normals * (tangents * normals).sum(axis=1, keepdims=True)
+        # any perpendicular vector where the uvs do not define one
+        missing = np.linalg.norm(tangents, axis=1) < 1e-12
+        fallback = np.where(np.abs(normals[:, :1]) < 0.9, np.array([[1.0, 0.0, 0.0]]), np.array([[0.0, 1.0, 0.0]]))
+        fallback -= normals * (fallback * normals).sum(axis=1, keepdims=True)
+        tangents[missing] = fallback[missing]
+        return _normalized(tangents)
+
+
+def readMayaAscii(path: str) -> List[MeshData]:
+    """
+    Returns all meshes in the file, warns about meshes that could not be read and raises a ValueError when the file
+    has meshes but none of them could be read.
+    """
+    scene = MayaAsciiScene(path)
+    meshes = scene.meshes()
+    for meshPath, reason in scene.skipped:
+        warnings.warn(f'Skipped {meshPath} in "{path}": {reason}.')
+    if scene.skipped and not meshes:
+        raise ValueError(f'None of the meshes in "{path}" could be read, delete their history in Maya first.')
+    return meshes
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) > 1:
+        scene = MayaAsciiScene(sys.argv[1])
+        for mesh in scene.meshes():
+            print('%s: %i vertices, %i triangles, material "%s"' % (
+                mesh.name, mesh.vertexCount, mesh.indexCount // 3, mesh.materialName))
+        for meshPath, reason in scene.skipped:
+            print('skipped %s: %s' % (meshPath, reason))
+        sys.exit()
+
+    # hinge.ma is baked: three quads bent along a soft and a hard edge, with a uv seam at the hard edge and a color
+    # per face, under a parent that is rotated around a pivot
+    scene = MayaAsciiScene(os.path.join(os.path.dirname(__file__), 'hinge.ma'))
+    meshes = scene.meshes()
+    assert len(meshes) == 1 and not scene.skipped
+    mesh = meshes[0]
+    assert (mesh.name, mesh.materialName) == ('|pivot|hinge|hingeShape', 'hingeMaterial')
+    assert [va.semantic for va in mesh.attributeLayout] == [
+        VertexAttribute.Semantic.POSITION, VertexAttribute.Semantic.NORMAL, VertexAttribute.Semantic.TANGENT,
+        VertexAttribute.Semantic.TEXCOORD0, VertexAttribute.Semantic.COLOR0]
+    assert np.allclose(scene.worldMatrix(scene.meshNodes()[0]), ((0, 0, 1, 2), (0, 1, 0, 2), (-1, 0, 0, 1), (0, 0, 0, 1)))
+    h = 0.5 ** 0.5
+    # position, normal, tangent, uv, color of every vertex, in any order
+    expected = np.array((
+        # the top quad, its hard edge keeps the face normal
+        (2, 2, 1, 0, 1, 0, 0, 0, -1, 0, 0, 1, 0, 0, 1),
+        (3, 2, 1, 0, 1, 0, 0, 0, -1, 0, 1, 1, 0, 0, 1),
+        # both sides of the soft edge share the normal and the tangent, only the colors differ
+        (3, 2, 0, 0, h, -h, 0, -h, -h, 1, 1, 1, 0, 0, 1),
+        (2, 2, 0, 0, h, -h, 0, -h, -h, 1, 0, 1, 0, 0, 1),
+        (2, 2, 0, 0, h, -h, 0, -h, -h, 1, 0, 0, 1, 0, 1),
+        (3, 2, 0, 0, h, -h, 0, -h, -h, 1, 1, 0, 1, 0, 1),
+        (3, 1, 0, 0, 0, -1, 0, -1, 0, 2, 1, 0, 1, 0, 1),
+        (2, 1, 0, 0, 0, -1, 0, -1, 0, 2, 0, 0, 1, 0, 1),
+        # the quad across the hard edge and the uv seam
+        (2, 1, 1, 0, 0, 1, 0, 1, 0, 3, 0, 0, 0, 1, 0.5),
+        (3, 1, 1, 0, 0, 1, 0, 1, 0, 3, 1, 0, 0, 1, 0.5),
+        (3, 2, 1, 0, 0, 1, 0, 1, 0, 4, 1, 0, 0, 1, 0.5),
+        (2, 2, 1, 0, 0, 1, 0, 1, 0, 4, 0, 0, 0, 1, 0.5)), np.float32)
+    vertices = np.frombuffer(mesh.vertexData, np.float32).reshape(mesh.vertexCount, -1)
+    matches = np.isclose(vertices[:, None], expected[None], atol=1e-6).all(axis=2)
+    assert (matches.sum(axis=0) == 1).all() and (matches.sum(axis=1) == 1).all(), vertices
+    assert mesh.indexCount == 18
+    print('hinge.ma: ok')
+
+    # shitori.ma has construction history, it can only be skipped
+    scene = MayaAsciiScene(os.path.join(os.path.dirname(__file__), 'shitori.ma'))
+    assert not scene.meshes() and scene.skipped
+    print('shitori.ma: skipped %i meshes' % len(scene.skipped))
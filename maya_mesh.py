@@ -3,9 +3,13 @@ I needed custom meshes, so here's a quick exporter.
 I lifted this from another project and I recall there was something
 wrong with the bind poses so do not rely on the skinning too much.
 
+The exporter reads every mesh into a mesh_builder.MeshBuilder and writes the current
+version of the format (see mesh_format.py), run it with mayapy -m TTOpenGL.maya_mesh.
+Older versions of this exporter wrote version 0, which is described below and can still be read.
+
 u8[3]: ascii file type "MSH"
-u8: binary file verison (starts at 0, may get bumped in the future)
-u8[4]: ascii exporter identifier (like "MAYA" for the Maya exporter, or "CONV" for the Assimp converter)
+u8: binary file verison (this describes version 0, see mesh_format.py for later versions)
+u8[4]: ascii exporter identifier (like "MAYA" for the Maya exporter, or "CONV" for mesh_convert.py)
 u32: mesh count
 for each mesh:
   u32: name length
@@ -24,7 +28,7 @@ for each mesh:
 Semantics are "magic numbers" that we agree to use in vertex shaders using layout syntax:
 layout(location=0) vec3 aPosition;
 
-Valid semantics are defined in the VertexAttribute.Semantic class in mesh.py:
+Valid semantics are defined in the VertexAttribute.Semantic class in mesh_format.py:
 
 Note that colors can go on indefinitely, for any additional data
 that needs to be stored. They can have different meanings per shader
@@ -43,33 +47,16 @@ add this attribute if the mesh is not skinned).
 
 import uuid
 import os
-import struct
 import json
-import enum
+from typing import *
 
+import numpy as np
 from maya import cmds
-from maya.api.OpenMaya import MGlobal, MSpace, MItMeshPolygon, MFnMesh, MColor
+from maya.api.OpenMaya import MGlobal, MSpace, MItMeshFaceVertex, MFnMesh
 from maya.api.OpenMayaAnim import MFnSkinCluster
 
-
-# Copied from mesh.py because else Maya needs to install PyOpenGL OR I need to fix my imports
-class VertexAttribute:
-    class Semantic(enum.Enum):
-        POSITION = 0
-        NORMAL = 1
-        TANGENT = 2
-        TEXCOORD0 = 3
-        TEXCOORD1 = 4
-        TEXCOORD2 = 5
-        TEXCOORD3 = 6
-        TEXCOORD4 = 7
-        TEXCOORD5 = 8
-        TEXCOORD6 = 9
-        TEXCOORD7 = 10
-        BLENDINDICES = 11
-        BLENDWEIGHT = 12
-        COLOR0 = 13
-        # COLOR# = COLOR0 + i
+from .mesh_format import VertexAttribute, writeMeshFile
+from .mesh_builder import MeshBuilder
 
 
 def getJointIndexMap(inSkinCluster):
@@ -141,6 +128,96 @@ def skinClusterData(skinCluster, meshPath, component):
     return indexMap, jointWeights
 
 
+def _pointsToArray(points) -> np.ndarray:
+    return np.array([(p.x, p.y, p.z) for p in points], np.float32).reshape(-1, 3)
+
+
+def _vectorsToArray(vectors) -> np.ndarray:
+    return np.array([(v.x, v.y, v.z) for v in vectors], np.float32).reshape(-1, 3)
+
+
+def _colorsToArray(colors) -> np.ndarray:
+    return np.array([(c.r, c.g, c.b, c.a) for c in colors], np.float32).reshape(-1, 4)
+
+
+def _skinAttributes(jointWeights, jointCount: int, vertexIds: np.ndarray, jointIds: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # the 4 biggest weights of every corner, normalized, and the global ids of their joints
+    MAX_INDICES = 4
+    weights = np.array(jointWeights, np.float32).reshape(-1, jointCount)[vertexIds]
+    if jointCount < MAX_INDICES:
+        weights = np.concatenate([weights, np.zeros((len(weights), MAX_INDICES - jointCount), np.float32)], axis=1)
+        jointIds = np.concatenate([jointIds, np.zeros(MAX_INDICES - jointCount, jointIds.dtype)])
+    highToLow = np.argsort(-weights, axis=1, kind='stable')[:, :MAX_INDICES]
+    weights = np.take_along_axis(weights, highToLow, axis=1)
+    factor = weights.sum(axis=1, keepdims=True)
+    weights /= np.where(factor > 0.0, factor, 1.0)
+    return jointIds[highToLow].astype(np.float32), weights
+
+
+def meshBuilder(mesh, skinnedJoints: Dict[str, int], isSkinned: bool) -> MeshBuilder:
+    """
+    Reads a mesh shape into a MeshBuilder, all data is in world space.
+    """
+    try:
+        lambert = cmds.listConnections(cmds.listConnections(mesh, type='shadingEngine'), d=False, s=True, type='lambert')[0]
+    except:
+        lambert = ''
+    builder = MeshBuilder(mesh, lambert)
+
+    # get API handles to object name
+    selectionList = MGlobal.getSelectionListByName(mesh)
+    dagPath = selectionList.getDagPath(0)
+    meshFn = MFnMesh(dagPath)
+
+    # the face-vertex of every triangle corner, face-vertices are numbered face by face
+    _, corners = meshFn.getTriangleOffsets()
+    corners = np.array(corners, np.int64)
+    _, faceVertexVertices = meshFn.getVertices()
+    vertexIds = np.array(faceVertexVertices, np.int64)[corners]
+
+    # normal and tangent ids are per face-vertex, but there is no call to get all tangent ids at once
+    normalIds = []
+    tangentIds = []
+    faceVertexIterator = MItMeshFaceVertex(dagPath)
+    while not faceVertexIterator.isDone():
+        normalIds.append(faceVertexIterator.normalId())
+        tangentIds.append(faceVertexIterator.tangentId())
+        faceVertexIterator.next()
+    normalIds = np.array(normalIds, np.int64)[corners]
+    tangentIds = np.array(tangentIds, np.int64)[corners]
+
+    builder.addAttribute(VertexAttribute.Semantic.POSITION, _pointsToArray(meshFn.getPoints(MSpace.kWorld))[vertexIds])
+    builder.addAttribute(VertexAttribute.Semantic.NORMAL, _vectorsToArray(meshFn.getNormals(MSpace.kWorld))[normalIds])
+    builder.addAttribute(VertexAttribute.Semantic.TANGENT, _vectorsToArray(meshFn.getTangents(MSpace.kWorld))[tangentIds])
+
+    for i, uvSetName in enumerate(meshFn.getUVSetNames()):
+        assert i < 8, 'We currently only anticipated 8 texcoords, please use a color set instead.'
+        us, vs = meshFn.getUVs(uvSetName)
+        _, uvIds = meshFn.getAssignedUVs(uvSetName)
+        uvs = np.stack([np.array(us, np.float32), np.array(vs, np.float32)], axis=1)
+        builder.addAttribute(VertexAttribute.Semantic(VertexAttribute.Semantic.TEXCOORD0.value + i),
+                             uvs[np.array(uvIds, np.int64)][corners])
+
+    for i, colorSetName in enumerate(meshFn.getColorSetNames()):
+        colors = _colorsToArray(meshFn.getFaceVertexColors(colorSetName))[corners]
+        builder.addAttribute(VertexAttribute.Semantic(VertexAttribute.Semantic.COLOR0.value + i), colors)
+
+    if isSkinned:
+        # if we flag the mesh as skinned lets have a look if we have a skincluster
+        skinCluster = cmds.ls(cmds.listHistory(mesh), type="skinCluster")
+        if skinCluster:
+            meshPath, component = selectionList.getComponent(0)
+            logicalIndexMap, jointWeights = skinClusterData(skinCluster, meshPath, component)
+            # weights are ordered by physical index, map those to the joint ids of the exported skeleton
+            jointIds = np.array([skinnedJoints.get(logicalIndexMap[logicalIndex], 0)
+                                 for logicalIndex in logicalIndexMap.keys()], np.int64)
+            indices, weights = _skinAttributes(jointWeights, len(logicalIndexMap), vertexIds, jointIds)
+            builder.addAttribute(VertexAttribute.Semantic.BLENDINDICES, indices)
+            builder.addAttribute(VertexAttribute.Semantic.BLENDWEIGHT, weights)
+
+    return builder
+
+
 def exportAllMeshes(source, target, isSkinned=False):
     if source:
         cmds.file(source, open=True, force=True)
@@ -148,167 +225,10 @@ def exportAllMeshes(source, target, isSkinned=False):
     if isSkinned:
         skinnedJoints = exportSkeleton(target)
     else:
-        skinnedJoints = []
-
-    with open(target, 'wb') as fh:
-        # write version
-        fh.write(b'MSH\0MAYA')
-
-        meshes = cmds.ls(type='mesh', ni=True, l=True)
-
-        # write mesh count
-        fh.write(struct.pack('<I', len(meshes)))
-
-        for mesh in meshes:
-            # write mesh name
-            name = mesh.encode('utf8')
-            fh.write(struct.pack('<I', len(name)))
-            fh.write(name)
-
-            # write material name
-            try:
-                lambert = cmds.listConnections(cmds.listConnections(mesh, type='shadingEngine'), d=False, s=True, type='lambert')[0]
-            except:
-                lambert = ''
-            material = lambert.encode('utf8')
-            fh.write(struct.pack('<I', len(material)))
-            fh.write(material)
-
-            # get API handles to object name
-            selectionList = MGlobal.getSelectionListByName(mesh)
-            dagPath = selectionList.getDagPath(0)
-            polyIterator = MItMeshPolygon(dagPath)
-            meshFn = MFnMesh(dagPath)
-
-            jointWeights = []
-            logicalIndexMap = {}
-            physicalToLogicalMap = {}
-
-            if isSkinned:
-                # if we flag the mesh as skinned lets have a look if we have a skincluster
-                # some of these values are predetermined so if it turns out not to be skinned then we leave it alone
-                skinCluster = cmds.ls(cmds.listHistory(mesh), type="skinCluster")
-                if skinCluster:
-                    meshPath, component = selectionList.getComponent(0)
-                    logicalIndexMap, jointWeights = skinClusterData(skinCluster, meshPath, component)
-                    physicalToLogicalMap = {physicalIndex: logicalIndex for (physicalIndex, logicalIndex) in
-                                            enumerate(logicalIndexMap.keys())}
-                else:
-                    isSkinned = False
-
-            # extract mesh data in 1 go, uses more memory but faster to execute and I assume a duplicate of 1 mesh will fit in memory
-            normals = meshFn.getNormals(MSpace.kWorld)
-            tangents = meshFn.getTangents(MSpace.kWorld)
-            uvSetNames = meshFn.getUVSetNames()
-            colorSetNames = meshFn.getColorSetNames()
-
-            # write attribute layout now we know all the attributes
-            floatsPerVertex = 3 + 3 + 3 + len(uvSetNames) * 2 + len(colorSetNames) * 4 + int(isSkinned) * 8
-
-            # num attributes
-            fh.write(struct.pack('<I', 3 + len(uvSetNames) + len(colorSetNames) + int(isSkinned) * 2))
-            # write position, normal and tangent attributes: semantic & nr of floats
-            fh.write(struct.pack('<II', VertexAttribute.Semantic.POSITION.value, 3))
-            fh.write(struct.pack('<II', VertexAttribute.Semantic.NORMAL.value, 3))
-            fh.write(struct.pack('<II', VertexAttribute.Semantic.TANGENT.value, 3))
-
-            for i, n in enumerate(uvSetNames):
-                assert i < 8, 'We currently only anticipated 8 texcoords, please use a color set instead.'
-                fh.write(struct.pack('<II', VertexAttribute.Semantic.TEXCOORD0.value + i, 2))
-
-            for i, n in enumerate(colorSetNames):
-                fh.write(struct.pack('<II', VertexAttribute.Semantic.COLOR0.value + i, 4))
-
-            if isSkinned:
-                fh.write(struct.pack('<II', VertexAttribute.Semantic.BLENDINDICES.value, 4))
-                fh.write(struct.pack('<II', VertexAttribute.Semantic.BLENDWEIGHT.value, 4))
-
-            # storage
-            vertexDataHashes = {}
-            vertexData = []
-            indexData = []
-
-            # pre-alloc
-            uvSets = [None] * len(uvSetNames)
-            colorSets = [None] * len(colorSetNames)
-            vertexChunk = [0.0] * floatsPerVertex
-
-            # walk mesh faces
-            while not polyIterator.isDone():
-                positions, vertexIndices = polyIterator.getTriangles(MSpace.kWorld)
-                # get colors and uvs for this face
-                for index, n in enumerate(uvSetNames):
-                    u, v = polyIterator.getUVs(n)
-                    uvSets[index] = (u, v, n)
-                for index, n in enumerate(colorSetNames):
-                    c = polyIterator.getColors(n)
-                    colorSets[index] = (c, n)
-                # itr.getNormals(normals, MSpace.kWorld)
-                untriangulatedVertexIndices = polyIterator.getVertices()
-                localVertexIndices = {j: i for i, j in enumerate(untriangulatedVertexIndices)}
-
-                # walk face triangulation
-                for i in range(len(vertexIndices)):
-                    localVertexIndex = localVertexIndices[vertexIndices[i]]
-                    # build vertex data for this face-vertex
-                    P = positions[i]
-                    N = normals[polyIterator.normalIndex(localVertexIndex)]
-                    T = tangents[polyIterator.tangentIndex(localVertexIndex)]
-                    vertexChunk[:9] = P.x, P.y, P.z, N.x, N.y, N.z, T.x, T.y, T.z
-                    j = 9
-
-                    for u, v, n in uvSets:
-                        vertexChunk[j] = u[localVertexIndex]
-                        vertexChunk[j + 1] = v[localVertexIndex]
-                        j += 2
-
-                    for c, n in colorSets:
-                        C = c[localVertexIndex]
-                        vertexChunk[j] = C.r
-                        vertexChunk[j + 1] = C.g
-                        vertexChunk[j + 2] = C.b
-                        vertexChunk[j + 3] = C.a
-                        j += 4
-
-                    if isSkinned:
-                        jointCount = len(logicalIndexMap)
-                        weightRange = list(
-                            jointWeights[vertexIndices[i] * jointCount:(vertexIndices[i] + 1) * jointCount])
-                        highToLow = sorted(enumerate(weightRange), key=lambda pair: -pair[1])
-
-                        MAX_INDICES = 4
-                        padded = highToLow[:MAX_INDICES] + [(0, 0.0)] * (MAX_INDICES - len(highToLow))
-                        factor = sum(pair[1] for pair in padded)
-                        if factor:
-                            factor = 1.0 / factor
-
-                        for index, (jointId, weight) in enumerate(padded):
-                            # this jointId is local to this skin-cluster,
-                            # use the indexMap to extract the name and then map it to a global jointId
-                            logicalIndex = physicalToLogicalMap[jointId]
-                            index = logicalIndexMap[logicalIndex]
-                            vertexChunk[j + index] = skinnedJoints.get(index, 0)
-                            vertexChunk[j + MAX_INDICES + index] = weight * factor  # normalized
-
-                        j += MAX_INDICES * 2
-
-                    vertex = tuple(vertexChunk)
-                    hsh = hash(vertex)
-                    # reuse vertex data if possible
-                    n = len(vertexDataHashes)
-                    vertexId = vertexDataHashes.setdefault(hsh, n)
-                    if vertexId == n:
-                        vertexData.append(vertex)
-                    # build index buffer
-                    indexData.append(vertexId)
-                polyIterator.next()
-
-            # write buffer sizes
-            fh.write(struct.pack('<II', len(vertexData) * floatsPerVertex, len(indexData)))
-            # write mesh data
-            for vertex in vertexData:
-                fh.write(struct.pack('<%if' % floatsPerVertex, *vertex))
-            fh.write(struct.pack('<%iI' % len(indexData), *indexData))
+        skinnedJoints = {}
+
+    meshes = [meshBuilder(mesh, skinnedJoints, isSkinned).build() for mesh in cmds.ls(type='mesh', ni=True, l=True)]
+    writeMeshFile(target, meshes, b'MAYA')
 
 
 def exportAllMeshesAuto(skin=False):
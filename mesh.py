@@ -1,59 +1,41 @@
-import struct
-import enum
 from typing import *
+import numpy as np
 from OpenGL.GL import *
+from MMath.mmath import Mat44
 from .core import GLObject
+from .camera import matrixToArray
+from .mesh_format import VertexAttribute, Bounds, MeshData, MeshFileReader, MeshProcessor, processMeshData, \
+    mergeMeshData, narrowIndices, narrowIndexData, readMeshFile, meshBounds, withBounds, streamStrides, \
+    splitVertexStreams
+from .mesh_cache import MeshCache
+from .mesh_lod import LOD_SECTION, LodLevel, decodeLodSection, selectLevel as selectLodLevel
+from .mesh_meshlet import Meshlets, meshMeshlets
+from .mesh_instance import groupInstances
+from .culling import frustumPlanes, localPlanes
 
 
-class VertexAttribute:
-    class Semantic(enum.Enum):
-        POSITION = 0
-        NORMAL = 1
-        TANGENT = 2
-        TEXCOORD0 = 3
-        TEXCOORD1 = 4
-        TEXCOORD2 = 5
-        TEXCOORD3 = 6
-        TEXCOORD4 = 7
-        TEXCOORD5 = 8
-        TEXCOORD6 = 9
-        TEXCOORD7 = 10
-        BLENDINDICES = 11
-        BLENDWEIGHT = 12
-        COLOR0 = 13
-        COLOR1 = 14
-        COLOR2 = 15
-        COLOR3 = 16
-        # COLOR# = COLOR0 + i
-
-    class Size(enum.Enum):
-        Single = 1
-        Vec2 = 2
-        Vec3 = 3
-        Vec4 = 4
-
-    class Type(enum.Enum):
-        Float = GL_FLOAT
-
-    def __init__(self, semantic, size, type):
-        if isinstance(semantic, str):
-            semantic = getattr(VertexAttribute.Semantic, semantic)
-        self.semantic: Semantic = VertexAttribute.Semantic(semantic)
-        self.size: Size = VertexAttribute.Size(size)
-        self.type: Type = VertexAttribute.Type(type)
-
-    def __repr__(self):
-        return '(%s, %s, %s)' % (self.semantic, self.size, self.type)
-
-    def sizeInBytes(self):
-        return {VertexAttribute.Type.Float: 4}[self.type] * self.size.value
+class BufferUploadStats(NamedTuple):
+    uploads: int
+    bytes: int
+
+
+def _byteView(data: Any) -> np.ndarray:
+    # uint8 view of anything that supports the buffer protocol
+    if isinstance(data, np.ndarray):
+        data = np.ascontiguousarray(data)
+    return np.frombuffer(memoryview(data).cast('B'), np.uint8)
 
 
 class Buffer(GLObject):
-    def __init__(self, target: int, data: Union[int, bytes, ctypes.Array], mode: int = GL_STATIC_DRAW):
+    # uploads of all buffers since the last takeUploadStats
+    _uploads: int = 0
+    _uploadedBytes: int = 0
+
+    def __init__(self, target: int, data: Union[int, bytes, memoryview, np.ndarray, ctypes.Array], mode: int = GL_STATIC_DRAW,
+                 shadowed: bool = False):
         super().__init__()
 
-        # data must be a ctypes array or bytes or int (representing size of buffer that is not initialized with data)
+        # data must be a ctypes array, bytes, memoryview, numpy array or int (representing size of buffer that is not initialized with data)
         self._target = target
         self._currentTarget = None
 
@@ -62,18 +44,103 @@ class Buffer(GLObject):
             data = None
         elif isinstance(data, bytes):
             self._size = len(data)
+        elif isinstance(data, memoryview):
+            self._size = data.nbytes
+        elif isinstance(data, np.ndarray):
+            self._size = data.nbytes
         else:
             self._size = ctypes.sizeof(data)
 
+        self._mode = mode
         self._handle = glGenBuffers(1)
-        self.bind()
-        glBufferData(self._target, self._size, data, mode)
+        # upload through the copy target, binding the element array target would change the bound vertex array
+        self.bind(GL_COPY_WRITE_BUFFER)
+        glBufferData(GL_COPY_WRITE_BUFFER, self._size, data, mode)
         self.unbind()
 
+        # with shadowed we keep a CPU copy, so write() can gather small writes and flush() uploads them together
+        self._shadow: Optional[np.ndarray] = None
+        self._dirty: List[Tuple[int, int]] = []
+        if shadowed:
+            self._shadow = np.zeros(self._size, np.uint8)
+            if data is not None:
+                self._shadow[:] = _byteView(data)
+
     @property
     def size(self):
         return self._size
 
+    @property
+    def shadow(self) -> Optional[np.ndarray]:
+        # the CPU copy of a shadowed buffer, changes to it are uploaded by flush() after calling markDirty()
+        return self._shadow
+
+    def _upload(self, offset: int, data: np.ndarray, orphan: bool = False):
+        self.bind(GL_COPY_WRITE_BUFFER)
+        if orphan and data.nbytes != self._size:
+            glBufferData(GL_COPY_WRITE_BUFFER, self._size, None, self._mode)
+        if offset == 0 and data.nbytes == self._size:
+            # orphan: the driver gives us new memory instead of waiting for draws that read the old contents
+            glBufferData(GL_COPY_WRITE_BUFFER, self._size, data, self._mode)
+        else:
+            glBufferSubData(GL_COPY_WRITE_BUFFER, offset, data.nbytes, data)
+        self.unbind()
+        Buffer._uploads += 1
+        Buffer._uploadedBytes += data.nbytes
+
+    def update(self, data: Any, offset: int = 0, orphan: bool = False):
+        """
+        Uploads data at a byte offset right away, data can be anything that supports the buffer protocol.
+        Rewriting the entire buffer orphans it, with orphan the buffer is orphaned first on partial updates too
+        (the rest of its contents become undefined), for data rewritten every frame.
+        """
+        data = _byteView(data)
+        assert 0 <= offset and offset + data.nbytes <= self._size, \
+            f'Update of {data.nbytes} bytes at {offset} does not fit in a buffer of {self._size} bytes.'
+        if self._shadow is not None:
+            self._shadow[offset:offset + data.nbytes] = data
+        self._upload(offset, data, orphan)
+
+    def write(self, data: Any, offset: int = 0):
+        # like update, but only changes the shadow copy until the next flush
+        data = _byteView(data)
+        assert self._shadow is not None, 'write() requires a shadowed buffer, use update() instead.'
+        self._shadow[offset:offset + data.nbytes] = data
+        self.markDirty(offset, data.nbytes)
+
+    def markDirty(self, offset: int, size: int):
+        assert 0 <= offset and offset + size <= self._size, \
+            f'Range of {size} bytes at {offset} does not fit in a buffer of {self._size} bytes.'
+        if size:
+            self._dirty.append((offset, offset + size))
+
+    def flush(self, mergeGap: int = 1024) -> int:
+        """
+        Uploads the ranges written since the last flush, call once per frame before drawing.
+        Ranges less than mergeGap bytes apart are uploaded as one, because every upload has a fixed cost that
+        outweighs copying a few unchanged bytes. Returns the number of uploads.
+        """
+        if not self._dirty:
+            return 0
+        ranges = sorted(self._dirty)
+        self._dirty.clear()
+        merged = [list(ranges[0])]
+        for start, end in ranges[1:]:
+            if start <= merged[-1][1] + mergeGap:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        for start, end in merged:
+            self._upload(start, self._shadow[start:end])
+        return len(merged)
+
+    @staticmethod
+    def takeUploadStats() -> BufferUploadStats:
+        # the uploads of all buffers since the previous call, call it once per frame for the bytes per frame
+        stats = BufferUploadStats(Buffer._uploads, Buffer._uploadedBytes)
+        Buffer._uploads = Buffer._uploadedBytes = 0
+        return stats
+
     def bind(self, overrideTarget: Optional[int] = None):
         assert self._currentTarget is None, self._currentTarget
         target = self._target if overrideTarget is None else overrideTarget
@@ -89,54 +156,314 @@ class Buffer(GLObject):
     def unbindTarget(target: int):
         glBindBuffer(target, 0)
 
+    def delete(self):
+        # frees the GPU memory, the buffer can not be used afterwards
+        if self._handle != -1:
+            glDeleteBuffers(1, [self._handle])
+            self._handle = -1
+            self._shadow = None
+            self._dirty.clear()
+
+
+class VertexArray(GLObject):
+    """
+    A vertex array object that only holds the attribute formats (glVertexAttribFormat), the vertex and index buffers
+    are bound when drawing, so all meshes with the same attribute layout can share it. See VertexArrayCache.
+    """
+    # the bound vertex array, so binding it again is skipped, like Material._activeProgram
+    _active: int = 0
+
+    def __init__(self, attributeLayout: Iterable[VertexAttribute]):
+        super().__init__()
+        attributeLayout = list(attributeLayout)
+        self.strides: List[int] = streamStrides(attributeLayout)
+        self._handle = glGenVertexArrays(1)
+        VertexArray.bindHandle(self._handle)
+        offsets = [0] * len(self.strides)
+        for va in attributeLayout:
+            glVertexAttribFormat(va.semantic.value, va.size.value, va.type.value, va.normalized, offsets[va.stream])
+            glVertexAttribBinding(va.semantic.value, va.stream)
+            glEnableVertexAttribArray(va.semantic.value)
+            offsets[va.stream] += va.sizeInBytes()
+        VertexArray.bindHandle(0)
+        # handles of the buffers bound to this vertex array, and how often they were switched
+        self._buffers: Optional[Tuple[Tuple[int, ...], int]] = None
+        self.bufferSwitches: int = 0
+
+    @staticmethod
+    def bindHandle(handle: int):
+        if VertexArray._active != handle:
+            VertexArray._active = handle
+            glBindVertexArray(handle)
+
+    def bind(self, vertexBuffers: Sequence[Buffer], indexBuffer: Optional[Buffer]):
+        VertexArray.bindHandle(self._handle)
+        buffers = tuple(buffer.handle for buffer in vertexBuffers), indexBuffer.handle if indexBuffer is not None else 0
+        if buffers == self._buffers:
+            return
+        for stream, (handle, stride) in enumerate(zip(buffers[0], self.strides)):
+            glBindVertexBuffer(stream, handle, 0, stride)
+        # the element array binding is part of the vertex array state
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, buffers[1])
+        self._buffers = buffers
+        self.bufferSwitches += 1
+
+    def forget(self, vertexBuffers: Sequence[Buffer], indexBuffer: Optional[Buffer]):
+        # call before deleting bound buffers, their handles may be reused by new buffers
+        if self._buffers is not None and (self._buffers[1] == (indexBuffer.handle if indexBuffer is not None else 0)
+                                          or any(buffer.handle in self._buffers[0] for buffer in vertexBuffers)):
+            self._buffers = None
+
+    def delete(self):
+        if self._handle != -1:
+            if VertexArray._active == self._handle:
+                VertexArray._active = 0
+            glDeleteVertexArrays(1, [self._handle])
+            self._handle = -1
+
+
+class VertexArrayCache(object):
+    """
+    One shared VertexArray per attribute layout (including the attribute streams), pass it to the meshes of a
+    scene so switching between meshes with the same layout only rebinds their buffers.
+    len() is the number of distinct vertex arrays the meshes needed.
+    """
+
+    def __init__(self):
+        self._vertexArrays: Dict[Tuple[Any, ...], VertexArray] = {}
+
+    def __len__(self):
+        return len(self._vertexArrays)
+
+    def get(self, attributeLayout: Iterable[VertexAttribute]) -> VertexArray:
+        attributeLayout = list(attributeLayout)
+        key = tuple((va.key(), va.stream) for va in attributeLayout)
+        if key not in self._vertexArrays:
+            self._vertexArrays[key] = VertexArray(attributeLayout)
+        return self._vertexArrays[key]
+
+    @property
+    def bufferSwitches(self) -> int:
+        # how often the buffers of a shared vertex array were rebound
+        return sum(vertexArray.bufferSwitches for vertexArray in self._vertexArrays.values())
+
+    def delete(self):
+        # deletes the vertex arrays, meshes using them can not be drawn afterwards
+        for vertexArray in self._vertexArrays.values():
+            vertexArray.delete()
+        self._vertexArrays.clear()
+
+
+# the first location of instance attributes, a matrix takes 4 locations (TEXCOORD4 to TEXCOORD7, which meshes rarely
+# use), GL only guarantees 16 attribute locations so there is no room behind COLOR3
+INSTANCE_ATTRIBUTE_LOCATION = VertexAttribute.Semantic.TEXCOORD4.value
+
+_instanceAttributeTypes = {np.dtype('<f4'): GL_FLOAT, np.dtype('<f2'): GL_HALF_FLOAT, np.dtype('i1'): GL_BYTE,
+                           np.dtype('u1'): GL_UNSIGNED_BYTE, np.dtype('<i2'): GL_SHORT, np.dtype('<u2'): GL_UNSIGNED_SHORT}
+
+
+class InstanceBuffer(object):
+    """
+    Per-instance vertex attributes, read once per instance (glVertexAttribDivisor) by the meshes they are attached
+    to with Mesh.setInstanceBuffer, so all instances are drawn with one Mesh.drawInstanced call.
+
+    The data is a structured array, every field is an attribute at the next location starting at location, fields
+    with 2 dimensions take a location per row. An (N, 4, 4) float array is taken as row-major matrices (like
+    camera.matrixToArray) and stored as a mat4 attribute named "matrix":
+    layout(location = 7) in mat4 aInstanceMatrix;
+    gl_Position = uViewProjection * aInstanceMatrix * vec4(aPosition, 1.0);
+
+    Updates only change a CPU copy, the changed ranges are uploaded when drawing.
+    """
+
+    def __init__(self, data: np.ndarray, location: int = INSTANCE_ATTRIBUTE_LOCATION, normalized: Iterable[str] = (),
+                 capacity: Optional[int] = None, mode: int = GL_DYNAMIC_DRAW):
+        # normalized lists the integer fields that map to [0, 1] or [-1, 1], capacity reserves room for more instances
+        data = self._structured(data)
+        self.dtype: np.dtype = data.dtype
+        self.location: int = location
+        self._normalized = set(normalized)
+        self._count: int = len(data)
+        initial = np.zeros(max(capacity or 0, len(data)), self.dtype)
+        initial[:len(data)] = data
+        self.buffer: Buffer = Buffer(GL_ARRAY_BUFFER, initial, mode, shadowed=True)
+        # location, size, type, normalized and offset of every attribute
+        self.attributes: List[Tuple[int, int, int, bool, int]] = self._attributes()
+
+    @staticmethod
+    def _structured(data: np.ndarray) -> np.ndarray:
+        data = np.asarray(data)
+        if data.dtype.names is not None:
+            return data
+        if data.shape[1:] == (4, 4):
+            result = np.empty(len(data), [('matrix', '<f4', (4, 4))])
+            # glsl matrices are column-major
+            result['matrix'] = data.transpose(0, 2, 1)
+            return result
+        # doubles become floats, there is no double precision vertex attribute format we support
+        dtype = np.dtype('<f4') if data.dtype.kind == 'f' and data.dtype.itemsize > 4 else data.dtype.newbyteorder('<')
+        result = np.empty(len(data), [('value', dtype, data.shape[1:])])
+        result['value'] = data
+        return result
+
+    def _attributes(self) -> List[Tuple[int, int, int, bool, int]]:
+        result = []
+        location = self.location
+        for name in self.dtype.names:
+            fieldType, offset = self.dtype.fields[name][:2]
+            base, shape = fieldType.base, fieldType.shape
+            assert base in _instanceAttributeTypes, f'Instance attribute "{name}" has unsupported type {base}.'
+            assert len(shape) <= 2 and (not shape or 1 <= shape[-1] <= 4), \
+                f'Instance attribute "{name}" has unsupported shape {shape}.'
+            rows = shape[0] if len(shape) == 2 else 1
+            size = shape[-1] if shape else 1
+            for row in range(rows):
+                result.append((location, size, _instanceAttributeTypes[base], name in self._normalized,
+                               offset + row * size * base.itemsize))
+                location += 1
+        return result
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def count(self) -> int:
+        # the number of instances drawn
+        return self._count
+
+    @count.setter
+    def count(self, count: int):
+        assert 0 <= count <= self.capacity, f'{count} instances do not fit in a capacity of {self.capacity}.'
+        self._count = count
+
+    @property
+    def capacity(self) -> int:
+        return self.buffer.size // self.dtype.itemsize
+
+    @property
+    def locations(self) -> List[int]:
+        return [attribute[0] for attribute in self.attributes]
+
+    def update(self, data: np.ndarray, first: int = 0):
+        """
+        Replaces the instances from first on, growing the count if they go past it (up to the capacity).
+        """
+        data = self._structured(data)
+        assert data.dtype == self.dtype, f'Expected instances of type {self.dtype}, got {data.dtype}.'
+        assert first + len(data) <= self.capacity, \
+            f'{first + len(data)} instances do not fit in a capacity of {self.capacity}.'
+        self.buffer.write(data, first * self.dtype.itemsize)
+        self._count = max(self._count, first + len(data))
+
+    def flush(self) -> int:
+        # uploads the updates, drawing does this
+        return self.buffer.flush()
+
+    def delete(self):
+        self.buffer.delete()
+
+
+_indexTypes = {1: GL_UNSIGNED_BYTE, 2: GL_UNSIGNED_SHORT, 4: GL_UNSIGNED_INT}
+_indexSizes = {GL_UNSIGNED_BYTE: 1, GL_UNSIGNED_SHORT: 2, GL_UNSIGNED_INT: 4}
+
 
 class Mesh(object):
     def __init__(self,
                  attributeLayout: Iterable[VertexAttribute],
-                 vertexBuffer: Buffer,
+                 vertexBuffer: Union[Buffer, Sequence[Buffer]],
                  indexBuffer: Optional[Buffer] = None,
                  mode: int = GL_TRIANGLES,
-                 indexType: int = GL_UNSIGNED_INT):
-        self._vertexBuffer: Buffer = vertexBuffer
+                 indexType: int = GL_UNSIGNED_INT,
+                 vertexArrays: Optional[VertexArrayCache] = None):
+        # with multiple vertex buffers every attribute is read from the buffer of its stream (see VertexAttribute)
+        # with vertexArrays the mesh uses the shared vertex array of its layout instead of creating its own
+        attributeLayout = list(attributeLayout)
+        self._vertexBuffers: List[Buffer] = [vertexBuffer] if isinstance(vertexBuffer, Buffer) else list(vertexBuffer)
         self._indexBuffer: Optional[Buffer] = indexBuffer
 
         self._mode: int = mode
         self._indexType: int = indexType
-        self._stride = sum(va.sizeInBytes() for va in attributeLayout)
+        self._strides: List[int] = streamStrides(attributeLayout)
+        assert len(self._strides) <= len(self._vertexBuffers), 'Missing vertex buffers for the attribute streams.'
 
-        # initialize the VAO
-        self._handle: int = glGenVertexArrays(1)
-        glBindVertexArray(self._handle)
-        vertexBuffer.bind(GL_ARRAY_BUFFER)
         if indexBuffer is not None:
-            indexBuffer.bind(GL_ELEMENT_ARRAY_BUFFER)
-
-            sz = {GL_UNSIGNED_BYTE: 1, GL_UNSIGNED_SHORT: 2, GL_UNSIGNED_INT: 4}[self._indexType]
+            sz = _indexSizes[self._indexType]
             self._count: int = self._indexBuffer.size // sz
         else:
-            self._count: int = self._vertexBuffer.size // self._stride
+            self._count: int = self._vertexBuffers[0].size // self._strides[0]
 
-        # initialize the attribute bindings
-        cursor = 0
-        for va in attributeLayout:
-            glVertexAttribPointer(va.semantic.value, va.size.value, va.type.value,
-                                  False, self._stride, ctypes.c_void_p(cursor))
-            glEnableVertexAttribArray(va.semantic.value)
-            cursor += va.sizeInBytes()
+        self._vertexArray: Optional[VertexArray] = None
+        self._handle: int = -1
+        if vertexArrays is not None:
+            self._vertexArray = vertexArrays.get(attributeLayout)
+        else:
+            self._initVertexArray(attributeLayout)
+
+        # level of detail index ranges, level 0 is the entire index buffer
+        self._levels: List[LodLevel] = [LodLevel(0, self._count, 0.0)]
+        self._boundingSphere: Optional[Tuple[np.ndarray, float]] = None
+        self._bounds: Optional[Bounds] = None
+        self._meshlets: Optional[Meshlets] = None
+        self._locations: Set[int] = {va.semantic.value for va in attributeLayout}
+        self._instances: Optional[InstanceBuffer] = None
+
+    def _initVertexArray(self, attributeLayout: List[VertexAttribute]):
+        self._handle = glGenVertexArrays(1)
+        VertexArray.bindHandle(self._handle)
+        if self._indexBuffer is not None:
+            self._indexBuffer.bind(GL_ELEMENT_ARRAY_BUFFER)
+
+        # initialize the attribute bindings, the VAO remembers the buffer bound when an attribute is specified
+        for stream, vertexBuffer in enumerate(self._vertexBuffers[:len(self._strides)]):
+            vertexBuffer.bind(GL_ARRAY_BUFFER)
+            cursor = 0
+            for va in attributeLayout:
+                if va.stream != stream:
+                    continue
+                glVertexAttribPointer(va.semantic.value, va.size.value, va.type.value,
+                                      va.normalized, self._strides[stream], ctypes.c_void_p(cursor))
+                glEnableVertexAttribArray(va.semantic.value)
+                cursor += va.sizeInBytes()
+            vertexBuffer.unbind()
 
         # clean up
-        glBindVertexArray(0)
-        vertexBuffer.unbind()
-        if indexBuffer is not None:
-            indexBuffer.unbind()
+        VertexArray.bindHandle(0)
+        if self._indexBuffer is not None:
+            self._indexBuffer.unbind()
+
+    def bind(self):
+        # binds the vertex array, and for shared vertex arrays the buffers of this mesh
+        if self._vertexArray is not None:
+            self._vertexArray.bind(self._vertexBuffers, self._indexBuffer)
+        else:
+            VertexArray.bindHandle(self._handle)
+
+    @property
+    def vertexArrayHandle(self) -> int:
+        # the vertex array draw() binds, shared or not
+        return self._vertexArray.handle if self._vertexArray is not None else self._handle
+
+    @property
+    def vertexArray(self) -> Optional[VertexArray]:
+        # the shared vertex array, None if the mesh has its own
+        return self._vertexArray
 
     @property
     def stride(self):
-        return self._stride
+        # of the first stream
+        return self._strides[0]
+
+    @property
+    def strides(self) -> List[int]:
+        return self._strides
 
     @property
     def vertexBuffer(self):
-        return self._vertexBuffer
+        return self._vertexBuffers[0]
+
+    @property
+    def vertexBuffers(self) -> List[Buffer]:
+        return self._vertexBuffers
 
     @property
     def indexBuffer(self):
@@ -147,75 +474,315 @@ class Mesh(object):
         return self._mode
 
     def draw(self):
-        glBindVertexArray(self._handle)
+        self.bind()
         if self._indexBuffer is None:
             glDrawArrays(self._mode, 0, self._count)
         else:
             glDrawElements(self._mode, self._count, self._indexType, None)
 
-    def drawInstanced(self, count):
-        glBindVertexArray(self._handle)
+    @property
+    def sizeInBytes(self) -> int:
+        # GPU memory of the buffers
+        return sum(buffer.size for buffer in self._vertexBuffers) + (self._indexBuffer.size if self._indexBuffer is not None else 0)
+
+    def delete(self):
+        # frees the vertex array (unless it is shared) and the buffers, the mesh can not be drawn afterwards
+        if self._vertexArray is not None:
+            self._vertexArray.forget(self._vertexBuffers, self._indexBuffer)
+        else:
+            if VertexArray._active == self._handle:
+                VertexArray._active = 0
+            glDeleteVertexArrays(1, [self._handle])
+        for buffer in self._vertexBuffers:
+            buffer.delete()
+        if self._indexBuffer is not None:
+            self._indexBuffer.delete()
+
+    @property
+    def bounds(self) -> Optional[Bounds]:
+        # object space bounds of the vertices, None if unknown
+        return self._bounds
+
+    @bounds.setter
+    def bounds(self, bounds: Optional[Bounds]):
+        self._bounds = bounds
+
+    def worldBounds(self, modelMatrix: Optional[Mat44] = None) -> Optional[Bounds]:
+        if self._bounds is None or modelMatrix is None:
+            return self._bounds
+        return self._bounds.transformed(matrixToArray(modelMatrix))
+
+    @property
+    def meshlets(self) -> Optional[Meshlets]:
+        # clusters of the level 0 triangles, see mesh_meshlet
+        return self._meshlets
+
+    @meshlets.setter
+    def meshlets(self, meshlets: Optional[Meshlets]):
+        assert meshlets is None or self._indexBuffer is not None, 'Meshlets require an index buffer.'
+        self._meshlets = meshlets
+
+    def drawMeshlets(self, camera, aspectRatio: float, modelMatrix: Optional[Mat44] = None,
+                     coneCulling: bool = True) -> int:
+        """
+        Draws the meshlets that are in view and not facing away from the camera, culled in object space.
+        Meshes without meshlets are drawn entirely. Returns the number of indices drawn.
+        """
+        if self._meshlets is None:
+            self.draw()
+            return self._count
+        planes = frustumPlanes(camera, aspectRatio)
+        cameraPosition = matrixToArray(camera.cameraMatrix())[:3, 3]
+        if modelMatrix is not None:
+            model = matrixToArray(modelMatrix)
+            planes = localPlanes(planes, model)
+            cameraPosition = np.linalg.solve(model, np.append(cameraPosition, 1.0))[:3]
+            # mirroring turns the triangles inside out
+            coneCulling = coneCulling and np.linalg.det(model[:3, :3]) > 0.0
+        visible = self._meshlets.visibilityMask(planes, cameraPosition if coneCulling else None)
+        firstIndices, indexCounts = self._meshlets.ranges(visible)
+        indexSize = _indexSizes[self._indexType]
+        self.bind()
+        for firstIndex, count in zip(firstIndices.tolist(), indexCounts.tolist()):
+            glDrawElements(self._mode, count, self._indexType, ctypes.c_void_p(firstIndex * indexSize))
+        return int(indexCounts.sum())
+
+    def setLevels(self, levels: Sequence[LodLevel], center: np.ndarray, radius: float):
+        # levels are index ranges in the index buffer with increasing error, draw() keeps drawing level 0
+        assert self._indexBuffer is not None, 'Levels of detail require an index buffer.'
+        self._levels = list(levels)
+        self._count = self._levels[0].indexCount
+        self._boundingSphere = np.asarray(center, np.float64), radius
+
+    @property
+    def levelCount(self) -> int:
+        return len(self._levels)
+
+    def selectLevel(self, camera, aspectRatio: float, viewportHeight: int,
+                    modelMatrix: Optional[Mat44] = None, pixelError: float = 1.0) -> int:
+        """
+        Returns the coarsest level that deviates at most pixelError pixels from the full mesh on screen.
+        """
+        if len(self._levels) == 1:
+            return 0
+        center, radius = self._boundingSphere
+        errors = [level.error for level in self._levels]
+        if modelMatrix is not None:
+            model = matrixToArray(modelMatrix)
+            center = model[:3, :3] @ center + model[:3, 3]
+            scale = float(np.linalg.norm(model[:3, :3], axis=0).max())
+            radius *= scale
+            errors = [error * scale for error in errors]
+        projection = matrixToArray(camera.projectionMatrix(aspectRatio))
+        cameraPosition = matrixToArray(camera.cameraMatrix())[:3, 3]
+        return selectLodLevel(errors, center, radius, cameraPosition, projection[1, 1], viewportHeight, pixelError)
+
+    def drawLevel(self, level: int):
+        firstIndex, count, _ = self._levels[level]
+        self.bind()
+        if self._indexBuffer is None:
+            glDrawArrays(self._mode, 0, self._count)
+        else:
+            glDrawElements(self._mode, count, self._indexType, ctypes.c_void_p(firstIndex * _indexSizes[self._indexType]))
+
+    def drawLod(self, camera, aspectRatio: float, viewportHeight: int,
+                modelMatrix: Optional[Mat44] = None, pixelError: float = 1.0) -> int:
+        # draws the level picked by selectLevel and returns it
+        level = self.selectLevel(camera, aspectRatio, viewportHeight, modelMatrix, pixelError)
+        self.drawLevel(level)
+        return level
+
+    @property
+    def instanceBuffer(self) -> Optional[InstanceBuffer]:
+        return self._instances
+
+    def setInstanceBuffer(self, instances: Optional[InstanceBuffer]):
+        """
+        Attaches per-instance attributes to the vertex array, drawInstanced() then draws all of them.
+        Only meshes with their own vertex array can have instance attributes, shared vertex arrays are used by every
+        mesh with the same layout (see VertexArrayCache).
+        """
+        assert self._vertexArray is None, 'Instance attributes require a mesh with its own vertex array.'
+        self.bind()
+        if self._instances is not None:
+            for location in self._instances.locations:
+                glVertexAttribDivisor(location, 0)
+                glDisableVertexAttribArray(location)
+        if instances is not None:
+            overlap = self._locations.intersection(instances.locations)
+            assert not overlap, f'Instance attributes use locations {sorted(overlap)} of the vertex attributes.'
+            instances.buffer.bind(GL_ARRAY_BUFFER)
+            for location, size, type, normalized, offset in instances.attributes:
+                glVertexAttribPointer(location, size, type, normalized, instances.dtype.itemsize,
+                                      ctypes.c_void_p(offset))
+                glVertexAttribDivisor(location, 1)
+                glEnableVertexAttribArray(location)
+            instances.buffer.unbind()
+        self._instances = instances
+
+    def drawInstanced(self, count: Optional[int] = None):
+        # count defaults to the instances in the instance buffer
+        if self._instances is not None:
+            self._instances.flush()
+            if count is None:
+                count = len(self._instances)
+        self.bind()
         if self._indexBuffer is None:
             glDrawArraysInstanced(self._mode, 0, self._count, count)
         else:
             glDrawElementsInstanced(self._mode, self._count, self._indexType, None, count)
 
+
 class IndexedMesh(Mesh):
     def __init__(self, attributeLayout, vertexData, indexDataOrDrawCount,
                  mode: int = GL_TRIANGLES,
-                 indexType: int = GL_UNSIGNED_INT):
-        vbo = Buffer(GL_ARRAY_BUFFER, vertexData, GL_STATIC_DRAW)
+                 indexType: int = GL_UNSIGNED_INT,
+                 autoIndexType: bool = False,
+                 vertexArrays: Optional[VertexArrayCache] = None):
+        # with autoIndexType the index data (of the given indexType) is converted to the smallest type that fits
+        # vertexData may be a list with the data of every stream
+        if isinstance(vertexData, (list, tuple)):
+            vbo = [Buffer(GL_ARRAY_BUFFER, data, GL_STATIC_DRAW) for data in vertexData]
+        else:
+            vbo = Buffer(GL_ARRAY_BUFFER, vertexData, GL_STATIC_DRAW)
         if not isinstance(indexDataOrDrawCount, int):
+            if autoIndexType:
+                indexSize = {size: enum for enum, size in _indexTypes.items()}[indexType]
+                indexDataOrDrawCount = narrowIndices(np.frombuffer(indexDataOrDrawCount, '<u%i' % indexSize))
+                indexType = _indexTypes[indexDataOrDrawCount.itemsize]
             ibo = Buffer(GL_ELEMENT_ARRAY_BUFFER, indexDataOrDrawCount, GL_STATIC_DRAW)
         else:
             ibo = None
-        super().__init__(attributeLayout, vbo, ibo, mode, indexType)
-
-
-def loadBinaryMesh(path: str) -> Tuple[Tuple[IndexedMesh, str]]:
-    """
-    See maya_mesh for the file format specification.
-    """
-
-    def u32(fh):
-        return struct.unpack('<I', fh.read(4))[0]
-
-    meshesByLayoutAndMaterial = {}
-    with open(path, 'rb') as fh:
-        assert fh.read(4) == b'MSH\0', f'Unsupported file format for file "{path}".'
-        fh.read(4)
-        meshCount = u32(fh)
-        for meshIndex in range(meshCount):
-            nameLength = u32(fh)
-            name = fh.read(nameLength).decode('utf8')
-            materialNameLength = u32(fh)
-            materialName = fh.read(materialNameLength).decode('utf8')
-            attributeCount = u32(fh)
-            attributeLayout = []
-            key = []
-            for attributeIndex in range(attributeCount):
-                semanticId = u32(fh)
-                numFloats = u32(fh)
-                key.append((semanticId, numFloats))
-                attributeLayout.append(VertexAttribute(VertexAttribute.Semantic(semanticId),
-                                                       VertexAttribute.Size(numFloats),
-                                                       VertexAttribute.Type.Float))
-            key = tuple(key) + (materialName,)
-            numFloats = u32(fh)
-            numInts = u32(fh)
-            vboBlob = fh.read(numFloats * ctypes.sizeof(ctypes.c_float))
-            assert len(vboBlob) == numFloats * ctypes.sizeof(ctypes.c_float)
-            sizeof_uint = ctypes.sizeof(ctypes.c_uint)
-            iboBlob = fh.read(numInts * sizeof_uint)
-            assert len(iboBlob) == numInts * sizeof_uint
-            if key not in meshesByLayoutAndMaterial:
-                meshesByLayoutAndMaterial[key] = attributeLayout, vboBlob, iboBlob, materialName
-            else:
-                prevLayout, prevVboBlob, prevIboBlob, prevMaterialName = meshesByLayoutAndMaterial[key]
-                indexData = (ctypes.c_uint * numInts)()
-                ctypes.memmove(ctypes.pointer(indexData), iboBlob, ctypes.sizeof(indexData))
-                offset = len(prevIboBlob) // sizeof_uint
-                for j in range(numInts):
-                    indexData[j] += offset
-                meshesByLayoutAndMaterial[key] = prevLayout, prevVboBlob + vboBlob, prevIboBlob + iboBlob, prevMaterialName
-    return tuple((IndexedMesh(args[0], args[1], args[2]), args[3]) for args in meshesByLayoutAndMaterial.values())
+        super().__init__(attributeLayout, vbo, ibo, mode, indexType, vertexArrays)
+
+    @classmethod
+    def fromMeshData(cls, mesh: MeshData, splitPositions: bool = False,
+                     vertexArrays: Optional[VertexArrayCache] = None) -> "IndexedMesh":
+        # splitPositions puts POSITION in its own stream, so position-only passes don't fetch the other attributes
+        indexData, indexType, levels = meshIndexData(mesh)
+        if splitPositions:
+            attributeLayout, vertexData = splitVertexStreams(mesh, [[VertexAttribute.Semantic.POSITION]])
+        else:
+            attributeLayout, vertexData = mesh.attributeLayout, mesh.vertexData
+        result = cls(attributeLayout, vertexData, indexData, indexType=indexType, vertexArrays=vertexArrays)
+        if levels is not None:
+            result.setLevels(*levels)
+        result.bounds = meshBounds(mesh)
+        result.meshlets = meshMeshlets(mesh)
+        return result
+
+
+# the shader storage buffer binding of the instance matrices, see InstancedMesh
+INSTANCE_MATRICES_BINDING = 0
+
+
+class InstancedMesh(object):
+    """
+    A mesh drawn once for every instance matrix, the matrices are in a shader storage buffer that the vertex shader
+    indexes with gl_InstanceID (see InstanceBuffer to read them as vertex attributes instead):
+    layout(std430, binding = 0) readonly buffer InstanceMatrices { mat4 uInstanceMatrices[]; };
+    gl_Position = uViewProjection * uInstanceMatrices[gl_InstanceID] * vec4(aPosition, 1.0);
+    """
+
+    def __init__(self, mesh: Mesh, matrices: np.ndarray, binding: int = INSTANCE_MATRICES_BINDING):
+        # matrices are row-major (N, 4, 4), like camera.matrixToArray
+        self.mesh: Mesh = mesh
+        self.matrices: np.ndarray = np.asarray(matrices, np.float32).reshape(-1, 4, 4)
+        self.binding: int = binding
+        # glsl matrices are column-major
+        self.matrixBuffer: Buffer = Buffer(GL_SHADER_STORAGE_BUFFER,
+                                           np.ascontiguousarray(self.matrices.transpose(0, 2, 1)))
+
+    def __len__(self):
+        return len(self.matrices)
+
+    @property
+    def bounds(self) -> Optional[Bounds]:
+        # bounds around all instances
+        if self.mesh.bounds is None:
+            return None
+        return Bounds.union(self.mesh.bounds.transformed(matrix) for matrix in self.matrices.astype(np.float64))
+
+    def draw(self):
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, self.binding, self.matrixBuffer.handle)
+        self.mesh.drawInstanced(len(self.matrices))
+
+
+def meshIndexData(mesh: MeshData) -> Tuple[Any, int, Optional[Tuple[List[LodLevel], np.ndarray, float]]]:
+    """
+    Returns the data for the index buffer of a mesh, its GL index type and the
+    arguments for Mesh.setLevels (or None if the mesh has no levels of detail).
+    """
+    if LOD_SECTION not in mesh.sections:
+        return mesh.indexData, _indexTypes[mesh.indexSize], None
+    # the levels of detail go in the same index buffer, behind the regular indices
+    center, radius, levels, lodIndices = decodeLodSection(mesh.sections[LOD_SECTION])
+    indices = narrowIndices(np.concatenate([mesh.indexArray(), lodIndices]))
+    levels = [LodLevel(0, mesh.indexCount, 0.0)] + \
+             [LodLevel(level.firstIndex + mesh.indexCount, level.indexCount, level.error) for level in levels]
+    return indices, _indexTypes[indices.itemsize], (levels, center, radius)
+
+
+class MeshFile(MeshFileReader):
+    """
+    Lazy access to the meshes in a .mesh file, see mesh_format for the file format specification.
+    Listing the contents only reads the table of contents, meshes are uploaded when they are loaded.
+    """
+
+    def load(self, nameOrIndex: Union[str, int], processors: Sequence[MeshProcessor] = ()) -> IndexedMesh:
+        mesh = narrowIndexData(processMeshData(self.meshData(nameOrIndex), processors))
+        return IndexedMesh.fromMeshData(mesh)
+
+    def loadAll(self, processors: Sequence[MeshProcessor] = ()) -> Tuple[Tuple[IndexedMesh, str]]:
+        # meshes that share an attribute layout and material are merged, see mesh_format.mergeMeshData
+        meshes = mergeMeshData([processMeshData(self.meshData(i), processors) for i in range(len(self))])
+        return tuple((IndexedMesh.fromMeshData(mesh), mesh.materialName) for mesh in meshes)
+
+
+def loadBinaryMesh(path: str, memoryMapped: bool = False, processors: Sequence[MeshProcessor] = (),
+                   cache: Optional[MeshCache] = None, splitPositions: bool = False,
+                   vertexArrays: Optional[VertexArrayCache] = None) -> Tuple[Tuple[IndexedMesh, str]]:
+    """
+    See mesh_format for the file format specification.
+
+    Meshes that share an attribute layout and material are merged, as long as the indices still fit in
+    16 bits, so the same material may be returned more than once.
+
+    With memoryMapped the file is mapped instead of read, and (unmerged) vertex and index
+    data is uploaded straight from the mapping so we never hold a second copy of the file.
+
+    Processors are applied to every mesh before merging, e.g. mesh_quantize.quantizeMeshData.
+    With a cache the processed result is stored, and later loads of the same file map that instead.
+
+    With splitPositions the positions are uploaded to a buffer of their own (stream 0) and the other attributes
+    to a second buffer (stream 1), so depth, shadow and ID passes only fetch positions. The attribute locations
+    stay the same, so shaders work with either layout. This copies the vertex data, also when memoryMapped.
+
+    With vertexArrays the meshes share a vertex array per attribute layout, pass the same cache to every load.
+    """
+    if cache is not None:
+        meshes = cache.read(path, processors, memoryMapped)
+    else:
+        meshes = readMeshFile(path, processors, memoryMapped)
+    return tuple((IndexedMesh.fromMeshData(mesh, splitPositions, vertexArrays), mesh.materialName) for mesh in meshes)
+
+
+def loadInstancedMeshes(path: str, memoryMapped: bool = False, processors: Sequence[MeshProcessor] = (),
+                        tolerance: float = 1e-5) -> Tuple[Tuple[Union[IndexedMesh, InstancedMesh], str]]:
+    """
+    Like loadBinaryMesh, but copies of the same geometry (see mesh_instance.groupInstances) are uploaded once and
+    returned as an InstancedMesh. The other meshes are merged as usual and returned as a plain IndexedMesh.
+    """
+    result = []
+    with MeshFileReader(path, memoryMapped) as reader:
+        meshes = [processMeshData(reader.meshData(i), processors) for i in range(len(reader))]
+        groups = groupInstances(meshes, tolerance)
+        # the bounds of processed meshes may be stale, like in readMeshFile
+        for mesh in mergeMeshData(group.mesh for group in groups if len(group.matrices) == 1):
+            mesh = withBounds(mesh, recompute=bool(processors))
+            result.append((IndexedMesh.fromMeshData(mesh), mesh.materialName))
+        for group in groups:
+            if len(group.matrices) > 1:
+                mesh = withBounds(narrowIndexData(group.mesh), recompute=bool(processors))
+                result.append((InstancedMesh(IndexedMesh.fromMeshData(mesh), group.matrices), mesh.materialName))
+    return tuple(result)
@@ -0,0 +1,115 @@
+"""
+Builds indexed meshes from per corner attribute arrays, e.g. for exporters.
+This module only depends on numpy and mesh_format, so it can run inside Maya and in tests.
+
+builder = MeshBuilder('pCube1', 'lambert1')
+builder.addAttribute(VertexAttribute.Semantic.POSITION, positions)  # (cornerCount, 3), 3 corners per triangle
+builder.addAttribute(VertexAttribute.Semantic.NORMAL, normals)
+writeMeshFile('cube.mesh', [builder.build()])
+
+Corners with the same bytes in all attributes are merged into one vertex, this is exact: it compares the
+interleaved vertices as raw bytes rows, so there are no hash collisions and no tolerance.
+Note that this means -0.0 and 0.0 are different values.
+"""
+from typing import *
+import numpy as np
+from .mesh_format import VertexAttribute, MeshData, narrowIndices
+
+_types = {
+    np.dtype('<f4'): VertexAttribute.Type.Float,
+    np.dtype('<f2'): VertexAttribute.Type.HalfFloat,
+    np.dtype('i1'): VertexAttribute.Type.Byte,
+    np.dtype('u1'): VertexAttribute.Type.UnsignedByte,
+    np.dtype('<i2'): VertexAttribute.Type.Short,
+    np.dtype('<u2'): VertexAttribute.Type.UnsignedShort,
+}
+
+
+def deduplicate(rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Takes (N, stride) uint8 vertex rows and returns the unique rows, in the order they are first used,
+    and for every input row the index of its unique row.
+    """
+    count, stride = rows.shape
+    if not count:
+        return rows.copy(), np.zeros(0, np.uint32)
+    # compare whole rows as single opaque values
+    keys = np.ascontiguousarray(rows).view(np.dtype((np.void, stride))).ravel()
+    _, firstUse, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    # np.unique sorts by bytes, renumber so vertices appear in the order the triangles use them
+    order = np.argsort(firstUse, kind='stable')
+    remap = np.empty(len(order), np.uint32)
+    remap[order] = np.arange(len(order), dtype=np.uint32)
+    return rows[firstUse[order]], remap[inverse.ravel()]
+
+
+def fanTriangles(cornerCounts: np.ndarray) -> np.ndarray:
+    """
+    Triangulates polygons as fans, cornerCounts has the number of corners of every polygon and corners are numbered
+    polygon by polygon. Returns the (triangleCount, 3) corner numbers of the triangles.
+    """
+    cornerCounts = np.asarray(cornerCounts, np.int64)
+    firstCorners = np.cumsum(cornerCounts) - cornerCounts
+    trianglesPerPolygon = np.maximum(cornerCounts - 2, 0)
+    # triangle k of a polygon with first corner f uses corners f, f + k + 1, f + k + 2
+    first = np.repeat(firstCorners, trianglesPerPolygon)
+    k = np.arange(int(trianglesPerPolygon.sum())) - np.repeat(np.cumsum(trianglesPerPolygon) - trianglesPerPolygon, trianglesPerPolygon)
+    return np.stack([first, first + k + 1, first + k + 2], axis=1)
+
+
+class MeshBuilder(object):
+    def __init__(self, name: str, materialName: str = ''):
+        self.name: str = name
+        self.materialName: str = materialName
+        self._attributes: List[Tuple[VertexAttribute, np.ndarray]] = []
+
+    @property
+    def cornerCount(self) -> int:
+        return len(self._attributes[0][1]) if self._attributes else 0
+
+    @property
+    def attributeLayout(self) -> List[VertexAttribute]:
+        return [va for va, _ in self._attributes]
+
+    def addAttribute(self, semantic: VertexAttribute.Semantic, values: np.ndarray, normalized: bool = False):
+        """
+        Values are (cornerCount, componentCount) with a row for every corner of every triangle, the corners of
+        triangle i are rows 3i to 3i+2. Float64 values are stored as float32, other types as they are.
+        Attributes are interleaved in the order they are added.
+        """
+        values = np.asarray(values)
+        if values.ndim == 1:
+            values = values[:, None]
+        if values.dtype == np.float64:
+            values = values.astype(np.float32)
+        values = values.astype(values.dtype.newbyteorder('<'), copy=False)
+        if values.dtype not in _types:
+            raise ValueError(f'Unsupported type {values.dtype} for attribute {semantic}.')
+        if not 1 <= values.shape[1] <= 4:
+            raise ValueError(f'Attribute {semantic} has {values.shape[1]} components, expected 1 to 4.')
+        if self._attributes and len(values) != self.cornerCount:
+            raise ValueError(f'Attribute {semantic} has {len(values)} corners, expected {self.cornerCount}.')
+        if len(values) % 3:
+            raise ValueError(f'Attribute {semantic} has {len(values)} corners, which is not a triangle list.')
+        self._attributes.append((VertexAttribute(semantic, values.shape[1], _types[values.dtype], normalized), values))
+
+    def interleave(self) -> np.ndarray:
+        # returns the (cornerCount, stride) uint8 interleaved vertices of all corners
+        layout = self.attributeLayout
+        stride = sum(va.sizeInBytes() for va in layout)
+        rows = np.empty((self.cornerCount, stride), np.uint8)
+        offset = 0
+        for va, values in self._attributes:
+            size = va.sizeInBytes()
+            rows[:, offset:offset + size] = np.ascontiguousarray(values).view(np.uint8).reshape(-1, size)
+            offset += size
+        return rows
+
+    def build(self, minIndexSize: int = 2) -> MeshData:
+        """
+        Returns the deduplicated mesh, its data are contiguous arrays so writeMeshFile writes each buffer at once.
+        """
+        assert self._attributes, 'A mesh needs at least one attribute.'
+        vertices, indices = deduplicate(self.interleave())
+        indices = narrowIndices(indices, minIndexSize)
+        return MeshData(self.name, self.materialName, self.attributeLayout, vertices.ravel(), indices, indices.itemsize)
@@ -0,0 +1,217 @@
+"""
+Content addressed cache of processed meshes.
+
+readMeshFile reads, processes and merges the meshes of a file every time. A MeshCache stores that result as a
+.mesh file named after a hash of the source file contents and the processors, so the next load only has to map
+the cached file. The cache directory is trimmed to maxBytes, least recently used files are removed first.
+The content hashes of source files are kept in an index next to the cached files, by path, size and modification
+time, so a warm load only hashes sources that changed since they were last hashed.
+
+cache = MeshCache(os.path.expanduser('~/.cache/ttopengl'))
+meshes = loadBinaryMesh('scene.mesh', processors=[quantizeMeshData], cache=cache)
+
+Processors are identified by their cacheKey() if they have one, functools.partial objects by their function and
+arguments, functions by their module and name, and everything else by its repr. Processor classes must define
+a __repr__ (or cacheKey) that includes all their settings (see MeshOptimizer), default reprs contain an address
+and raise a ValueError. Code changes to a processor should come with a bump of CACHE_VERSION or a clear() of
+the cache.
+"""
+import functools
+import hashlib
+import json
+import os
+import re
+import struct
+import tempfile
+from typing import *
+from .mesh_format import FORMAT_VERSION, MeshData, MeshFileReader, MeshProcessor, readMeshFile, writeMeshFile
+
+# part of every key, bump this when processing results change
+CACHE_VERSION = 1
+_EXTENSION = '.mesh'
+_HASH_INDEX = 'hashes.json'
+# default reprs contain the address of the object
+_ADDRESS = re.compile(r' at 0x[0-9a-fA-F]+')
+
+
+def _stableRepr(value: Any) -> str:
+    # the repr of a value, unless it contains an address that changes between runs
+    text = repr(value)
+    if _ADDRESS.search(text):
+        raise ValueError(f'{text} has no repr that is stable between runs, give it a __repr__ with its settings '
+                         f'or a cacheKey() method.')
+    return text
+
+
+def processorKey(processor: MeshProcessor) -> str:
+    """
+    Returns a key for a processor that is the same between runs: its cacheKey() if it has one, the function and
+    arguments of a functools.partial, the module and name of a function, or else its repr.
+    Processors without any of those (so with the default repr, which contains their address) raise a ValueError.
+    """
+    if hasattr(processor, 'cacheKey'):
+        return processor.cacheKey()
+    if isinstance(processor, functools.partial):
+        return 'partial(%s, %s, %s)' % (processorKey(processor.func),
+                                        ', '.join(_argumentKey(arg) for arg in processor.args),
+                                        ', '.join('%s=%s' % (key, _argumentKey(value))
+                                                  for key, value in sorted(processor.keywords.items())))
+    # the default repr of functions contains their address, which changes between runs
+    if hasattr(processor, '__module__') and hasattr(processor, '__qualname__'):
+        if '<lambda>' in processor.__qualname__:
+            raise ValueError(f'Lambda {processor.__qualname__} in {processor.__module__} has no unique name, it can '
+                             f'not be part of a cache key.')
+        return '%s.%s' % (processor.__module__, processor.__qualname__)
+    return _stableRepr(processor)
+
+
+def _argumentKey(value: Any) -> str:
+    # arguments of partials can be processors themselves
+    return processorKey(value) if callable(value) else _stableRepr(value)
+
+
+def hashFile(path: str, chunkSize: int = 1 << 20) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as fh:
+        while True:
+            chunk = fh.read(chunkSize)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MeshCacheStats(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    sizeInBytes: int
+
+
+class MeshCache(object):
+    def __init__(self, directory: str, maxBytes: int = 2 * 1024 * 1024 * 1024):
+        self.directory: str = directory
+        self.maxBytes: int = maxBytes
+        self._hits: int = 0
+        self._misses: int = 0
+        self._evictions: int = 0
+        # absolute source path to [size, mtime_ns, content hash], loaded on first use
+        self._hashIndex: Optional[Dict[str, List[Any]]] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def sourceHash(self, path: str) -> str:
+        """
+        Returns the content hash of a source file, only reading the file if its size or modification time changed
+        since it was last hashed.
+        """
+        if self._hashIndex is None:
+            try:
+                with open(os.path.join(self.directory, _HASH_INDEX), 'r', encoding='utf8') as fh:
+                    self._hashIndex = json.load(fh)
+            except (OSError, ValueError):
+                self._hashIndex = {}
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self._hashIndex.get(path)
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        digest = hashFile(path)
+        self._hashIndex[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        self._writeHashIndex()
+        return digest
+
+    def _writeHashIndex(self):
+        # like write(), other processes never see a partial file
+        handle, temporaryPath = tempfile.mkstemp('.tmp', dir=self.directory)
+        try:
+            with os.fdopen(handle, 'w', encoding='utf8') as fh:
+                json.dump(self._hashIndex, fh)
+            os.replace(temporaryPath, os.path.join(self.directory, _HASH_INDEX))
+        except BaseException:
+            os.remove(temporaryPath)
+            raise
+
+    def key(self, path: str, processors: Sequence[MeshProcessor] = ()) -> str:
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(('%i.%i\0%s\0' % (CACHE_VERSION, FORMAT_VERSION, self.sourceHash(path))).encode('utf8'))
+        for processor in processors:
+            digest.update(processorKey(processor).encode('utf8') + b'\0')
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + _EXTENSION)
+
+    def read(self, path: str, processors: Sequence[MeshProcessor] = (), memoryMapped: bool = True) -> List[MeshData]:
+        """
+        Same as mesh_format.readMeshFile, but processes the file only if it is not in the cache yet.
+        When memoryMapped the returned data points into the mapped cache file.
+        """
+        cachePath = self._path(self.key(path, processors))
+        try:
+            reader = MeshFileReader(cachePath, memoryMapped)
+        except (OSError, ValueError, AssertionError, struct.error):
+            # not cached, or unreadable (e.g. written by an incompatible version), regenerate it
+            pass
+        else:
+            self._hits += 1
+            with reader:
+                # mark as recently used
+                os.utime(cachePath)
+                return [reader.meshData(i) for i in range(len(reader))]
+
+        self._misses += 1
+        meshes = readMeshFile(path, processors, memoryMapped)
+        self.write(cachePath, meshes)
+        self.evict()
+        return meshes
+
+    @staticmethod
+    def write(cachePath: str, meshes: Iterable[MeshData]):
+        # write to a temporary file first so other processes never see a partial file
+        handle, temporaryPath = tempfile.mkstemp('.tmp', dir=os.path.dirname(cachePath))
+        os.close(handle)
+        try:
+            writeMeshFile(temporaryPath, meshes, b'CACH')
+            os.replace(temporaryPath, cachePath)
+        except BaseException:
+            os.remove(temporaryPath)
+            raise
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(_EXTENSION):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self, maxBytes: Optional[int] = None):
+        """
+        Removes the least recently used files until the cache is at most maxBytes in size.
+        """
+        if maxBytes is None:
+            maxBytes = self.maxBytes
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= maxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # in use (Windows can't delete mapped files), try again next time
+                continue
+            total -= size
+            self._evictions += 1
+
+    def clear(self):
+        self.evict(0)
+
+    @property
+    def stats(self) -> MeshCacheStats:
+        return MeshCacheStats(self._hits, self._misses, self._evictions, sum(size for _, size, _ in self._entries()))
@@ -0,0 +1,398 @@
+"""
+Converts glTF 2.0 (.gltf with .bin or data uris, and .glb), Wavefront OBJ and Maya ASCII files to .mesh files.
+Maya ASCII files are read by maya_ascii.py, see there for what it supports.
+
+python -m TTOpenGL.mesh_convert [-j jobs] [-o outputDirectory] path [path ...]
+
+Paths can be files or directories, which are searched recursively. Every input is written next to itself
+(or to the same relative path in the output directory) with the .mesh extension, files are converted in parallel
+in a process pool, one file per process at a time.
+
+Like the Maya exporter all geometry is in world space: glTF node transforms are applied, OBJ has none.
+glTF texture coordinates are flipped vertically to the OpenGL convention that OBJ and Maya use.
+Every glTF primitive and every OBJ material range becomes one mesh in the file.
+"""
+import base64
+import json
+import os
+import struct
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import *
+import numpy as np
+from .maya_ascii import readMayaAscii
+from .mesh_builder import MeshBuilder, fanTriangles
+from .mesh_format import VertexAttribute, MeshData, writeMeshFile
+
+EXPORTER = b'CONV'
+EXTENSIONS = ('.gltf', '.glb', '.obj', '.ma')
+
+_componentTypes = {
+    5120: np.dtype('i1'),
+    5121: np.dtype('u1'),
+    5122: np.dtype('<i2'),
+    5123: np.dtype('<u2'),
+    5125: np.dtype('<u4'),
+    5126: np.dtype('<f4'),
+}
+_componentCounts = {'SCALAR': 1, 'VEC2': 2, 'VEC3': 3, 'VEC4': 4}
+_GLTF_TRIANGLES = 4
+
+
+def _gltfSemantic(name: str) -> Optional[VertexAttribute.Semantic]:
+    S = VertexAttribute.Semantic
+    fixed = {'POSITION': S.POSITION, 'NORMAL': S.NORMAL, 'TANGENT': S.TANGENT,
+             'JOINTS_0': S.BLENDINDICES, 'WEIGHTS_0': S.BLENDWEIGHT}
+    if name in fixed:
+        return fixed[name]
+    prefix, _, index = name.partition('_')
+    if prefix == 'TEXCOORD' and index.isdigit() and int(index) < 8:
+        return S(S.TEXCOORD0.value + int(index))
+    if prefix == 'COLOR' and index.isdigit() and int(index) < 4:
+        return S(S.COLOR0.value + int(index))
+    # custom attributes (starting with _), extra joint sets and sets past TEXCOORD7 or COLOR3 have no semantic
+    return None
+
+
+class _GLTF(object):
+    def __init__(self, path: str):
+        self.directory = os.path.dirname(path)
+        with open(path, 'rb') as fh:
+            data = fh.read()
+        binaryChunk = None
+        if data[:4] == b'glTF':
+            # header, then chunks of (length, type, data), the JSON chunk comes first and the optional BIN chunk second
+            cursor = 12
+            chunks = {}
+            while cursor < len(data):
+                length, chunkType = struct.unpack_from('<I4s', data, cursor)
+                chunks[chunkType] = memoryview(data)[cursor + 8:cursor + 8 + length]
+                cursor += 8 + length
+            self.document = json.loads(bytes(chunks[b'JSON']).decode('utf8'))
+            binaryChunk = chunks.get(b'BIN\0')
+        else:
+            self.document = json.loads(data.decode('utf8'))
+        self.buffers = [self._loadBuffer(buffer, binaryChunk) for buffer in self.document.get('buffers', [])]
+
+    def _loadBuffer(self, buffer: dict, binaryChunk: Optional[memoryview]) -> Any:
+        uri = buffer.get('uri')
+        if uri is None:
+            return binaryChunk
+        if uri.startswith('data:'):
+            return base64.b64decode(uri.partition(',')[2])
+        from urllib.parse import unquote
+        with open(os.path.join(self.directory, unquote(uri)), 'rb') as fh:
+            return fh.read()
+
+    def accessor(self, index: int) -> np.ndarray:
+        """
+        Returns an (count, components) view of an accessor, or a copy for strided or sparse data.
+        """
+        accessor = self.document['accessors'][index]
+        dtype = _componentTypes[accessor['componentType']]
+        components = _componentCounts[accessor['type']]
+        count = accessor['count']
+        if 'bufferView' in accessor:
+            view = self.document['bufferViews'][accessor['bufferView']]
+            offset = view.get('byteOffset', 0) + accessor.get('byteOffset', 0)
+            stride = view.get('byteStride', dtype.itemsize * components)
+            buffer = np.frombuffer(self.buffers[view['buffer']], np.uint8)
+            values = np.ndarray((count, components), dtype, buffer, offset, (stride, dtype.itemsize))
+        else:
+            values = np.zeros((count, components), dtype)
+        if 'sparse' in accessor:
+            sparse = accessor['sparse']
+            values = values.copy()
+            indices = self._sparseArray(sparse['indices'], _componentTypes[sparse['indices']['componentType']], sparse['count'], 1)
+            replacements = self._sparseArray(sparse['values'], dtype, sparse['count'], components)
+            values[indices[:, 0]] = replacements
+        return values
+
+    def _sparseArray(self, info: dict, dtype: np.dtype, count: int, components: int) -> np.ndarray:
+        view = self.document['bufferViews'][info['bufferView']]
+        offset = view.get('byteOffset', 0) + info.get('byteOffset', 0)
+        return np.frombuffer(self.buffers[view['buffer']], dtype, count * components, offset).reshape(count, components)
+
+    def floatAccessor(self, index: int) -> np.ndarray:
+        # decodes normalized integers, for data we transform
+        values = self.accessor(index)
+        if values.dtype.kind in 'iu' and self.document['accessors'][index].get('normalized', False):
+            info = np.iinfo(values.dtype)
+            return np.maximum(values.astype(np.float32) / info.max, -1.0)
+        return values.astype(np.float32)
+
+    def worldMatrices(self) -> Iterable[Tuple[dict, np.ndarray]]:
+        # every node of the default scene (or all root nodes) with its world matrix, row-major
+        nodes = self.document.get('nodes', [])
+        scenes = self.document.get('scenes', [])
+        if scenes:
+            roots = scenes[self.document.get('scene', 0)].get('nodes', [])
+        else:
+            children = {child for node in nodes for child in node.get('children', [])}
+            roots = [i for i in range(len(nodes)) if i not in children]
+        stack = [(root, np.eye(4)) for root in reversed(roots)]
+        while stack:
+            index, parent = stack.pop()
+            node = nodes[index]
+            world = parent @ _nodeMatrix(node)
+            yield node, world
+            stack.extend((child, world) for child in reversed(node.get('children', [])))
+
+
+def _nodeMatrix(node: dict) -> np.ndarray:
+    if 'matrix' in node:
+        # glTF matrices are column-major
+        return np.array(node['matrix'], np.float64).reshape(4, 4).T
+    x, y, z, w = node.get('rotation', (0.0, 0.0, 0.0, 1.0))
+    rotation = np.array(((1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)),
+                         (2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)),
+                         (2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y))))
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation * np.array(node.get('scale', (1.0, 1.0, 1.0)))
+    matrix[:3, 3] = node.get('translation', (0.0, 0.0, 0.0))
+    return matrix
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-20)
+
+
+def readGLTF(path: str) -> List[MeshData]:
+    gltf = _GLTF(path)
+    document = gltf.document
+    materials = document.get('materials', [])
+    meshes = []
+    for node, world in gltf.worldMatrices():
+        if 'mesh' not in node:
+            continue
+        mesh = document['meshes'][node['mesh']]
+        rotation = world[:3, :3]
+        normalMatrix = np.linalg.inv(rotation).T
+        # mirroring transforms flip the winding order
+        flip = np.linalg.det(rotation) < 0.0
+        for primitiveIndex, primitive in enumerate(mesh['primitives']):
+            if primitive.get('mode', _GLTF_TRIANGLES) != _GLTF_TRIANGLES:
+                continue
+            attributes = primitive['attributes']
+            vertexCount = document['accessors'][attributes['POSITION']]['count']
+            if 'indices' in primitive:
+                corners = gltf.accessor(primitive['indices'])[:, 0].astype(np.int64)
+            else:
+                corners = np.arange(vertexCount)
+            corners = corners[:len(corners) // 3 * 3]
+            if flip:
+                corners = corners.reshape(-1, 3)[:, ::-1].ravel()
+
+            name = node.get('name') or mesh.get('name') or 'mesh%i' % node['mesh']
+            if len(mesh['primitives']) > 1:
+                name = '%s_%i' % (name, primitiveIndex)
+            material = materials[primitive['material']].get('name', '') if 'material' in primitive else ''
+            builder = MeshBuilder(name, material)
+            # sorted by semantic so files with the same attributes get the same layout and can be merged
+            semantics = []
+            for key in attributes:
+                semantic = _gltfSemantic(key)
+                if semantic is not None:
+                    semantics.append((semantic, key))
+                elif key.startswith(('TEXCOORD_', 'COLOR_')):
+                    warnings.warn(f'Skipped {key} of {name} in "{path}": only TEXCOORD_0 to TEXCOORD_7 and COLOR_0 to '
+                                  f'COLOR_3 are supported.')
+            semantics.sort(key=lambda pair: pair[0].value)
+            for semantic, key in semantics:
+                S = VertexAttribute.Semantic
+                if semantic == S.POSITION:
+                    values = gltf.floatAccessor(attributes[key]) @ rotation.T.astype(np.float32) + world[:3, 3].astype(np.float32)
+                elif semantic == S.NORMAL:
+                    values = _normalize(gltf.floatAccessor(attributes[key]) @ normalMatrix.T.astype(np.float32))
+                elif semantic == S.TANGENT:
+                    values = gltf.floatAccessor(attributes[key])
+                    values[:, :3] = _normalize(values[:, :3] @ rotation.T.astype(np.float32))
+                    if flip:
+                        values[:, 3] = -values[:, 3]
+                elif S.TEXCOORD0.value <= semantic.value <= S.TEXCOORD7.value:
+                    values = gltf.floatAccessor(attributes[key])
+                    values[:, 1] = 1.0 - values[:, 1]
+                else:
+                    values = gltf.accessor(attributes[key])
+                    if values.dtype == np.dtype('<u4'):
+                        values = values.astype(np.float32)
+                normalized = document['accessors'][attributes[key]].get('normalized', False) and values.dtype.kind in 'iu'
+                builder.addAttribute(semantic, values[corners], normalized)
+            meshes.append(builder.build())
+    return meshes
+
+
+def _parseFloats(lines: List[bytes], components: int) -> np.ndarray:
+    # parses the numbers after the keyword of all lines at once, lines may have extra optional components
+    if not lines:
+        return np.zeros((0, components), np.float32)
+    rows = [line.split()[1:components + 1] for line in lines]
+    if all(len(row) == components for row in rows):
+        return np.array(b' '.join(b' '.join(row) for row in rows).split(), np.float32).reshape(-1, components)
+    return np.array([[float(v) for v in row] + [0.0] * (components - len(row)) for row in rows], np.float32)
+
+
+def _parseCorners(lines: List[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parses the corners of all f lines at once.
+    Returns every corner as v/vt/vn with missing parts as 0, which is not a valid index, and the corners per face.
+    """
+    # one line per face without the keyword, missing parts written out as 0
+    data = b'\n'.join(line[1:] for line in lines).replace(b'\t', b' ').replace(b'\r', b' ') + b'\n'
+    data = data.replace(b'//', b'/0/').replace(b'/ ', b'/0 ').replace(b'/\n', b'/0\n')
+    chars = np.frombuffer(data, np.uint8)
+    space = (chars == ord(' ')) | (chars == ord('\n'))
+    starts = ~space
+    starts[1:] &= space[:-1]
+    newlines = chars == ord('\n')
+    # the face of every corner and the corner of every slash
+    faces = (np.cumsum(newlines) - newlines)[starts]
+    cornersPerFace = np.bincount(faces, minlength=len(lines)).astype(np.int64)
+    cornerCount = int(cornersPerFace.sum())
+    parts = np.bincount((np.cumsum(starts) - 1)[chars == ord('/')], minlength=cornerCount) + 1
+    assert (parts <= 3).all(), 'Face corners have at most 3 parts.'
+
+    values = np.fromstring(data.replace(b'/', b' '), np.int64, sep=' ')
+    assert len(values) == parts.sum(), 'Face corners must be integers.'
+    corners = np.zeros((cornerCount, 3), np.int64)
+    firstValues = np.cumsum(parts) - parts
+    for part in range(3):
+        selected = parts > part
+        corners[selected, part] = values[firstValues[selected] + part]
+    return corners, cornersPerFace
+
+
+def readOBJ(path: str) -> List[MeshData]:
+    """
+    Supports v, vt, vn, f (with negative indices, any polygon is fan triangulated), o, g and usemtl.
+    """
+    with open(path, 'rb') as fh:
+        lines = fh.read().replace(b'\\\r\n', b' ').replace(b'\\\n', b' ').splitlines()
+    # comments may follow the data on any line
+    lines = [line.split(b'#', 1)[0].strip() for line in lines]
+    keywords = [line.split(None, 1)[0] if line else b'' for line in lines]
+
+    positions = _parseFloats([line for line, key in zip(lines, keywords) if key == b'v'], 3)
+    uvs = _parseFloats([line for line, key in zip(lines, keywords) if key == b'vt'], 2)
+    normals = _parseFloats([line for line, key in zip(lines, keywords) if key == b'vn'], 3)
+    # number of elements defined before every line, for relative (negative) indices
+    counts = {key: np.cumsum([k == key for k in keywords]) for key in (b'v', b'vt', b'vn')}
+
+    # faces, with the name and material they belong to
+    faceLines = []
+    faceGroups = []
+    groups = {}
+    name = os.path.splitext(os.path.basename(path))[0]
+    material = ''
+    for lineIndex, (line, key) in enumerate(zip(lines, keywords)):
+        if key == b'f':
+            faceLines.append(lineIndex)
+            faceGroups.append(groups.setdefault((name, material), len(groups)))
+        elif key in (b'o', b'g'):
+            name = line[1:].strip().decode('utf8') or name
+        elif key == b'usemtl':
+            material = line[6:].strip().decode('utf8')
+    if not faceLines:
+        return []
+
+    corners, cornersPerFace = _parseCorners([lines[lineIndex] for lineIndex in faceLines])
+    cornerLines = np.repeat(np.array(faceLines), cornersPerFace)
+    for column, key in enumerate((b'v', b'vt', b'vn')):
+        values = corners[:, column]
+        # 1 based, negative indices count back from the last element defined before the face
+        corners[:, column] = np.where(values < 0, counts[key][cornerLines] + values, values - 1)
+
+    triangleCorners = fanTriangles(cornersPerFace)
+    triangleGroups = np.repeat(np.array(faceGroups), np.maximum(cornersPerFace - 2, 0))
+
+    meshes = []
+    for (name, material), group in groups.items():
+        selected = triangleCorners[triangleGroups == group].ravel()
+        if not len(selected):
+            continue
+        builder = MeshBuilder(name, material)
+        builder.addAttribute(VertexAttribute.Semantic.POSITION, positions[corners[selected, 0]])
+        if (corners[selected, 2] >= 0).all() and len(normals):
+            builder.addAttribute(VertexAttribute.Semantic.NORMAL, normals[corners[selected, 2]])
+        if (corners[selected, 1] >= 0).all() and len(uvs):
+            builder.addAttribute(VertexAttribute.Semantic.TEXCOORD0, uvs[corners[selected, 1]])
+        meshes.append(builder.build())
+    return meshes
+
+
+def readFile(path: str) -> List[MeshData]:
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.obj':
+        return readOBJ(path)
+    if extension in ('.gltf', '.glb'):
+        return readGLTF(path)
+    if extension == '.ma':
+        return readMayaAscii(path)
+    raise ValueError(f'Unsupported file type "{path}".')
+
+
+def convertFile(source: str, target: str) -> Tuple[str, int]:
+    # returns the target and the number of meshes written
+    meshes = readFile(source)
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    writeMeshFile(target, meshes, EXPORTER)
+    return target, len(meshes)
+
+
+def findInputs(paths: Iterable[str]) -> List[Tuple[str, str]]:
+    # (file, path relative to the given directory) for every convertible file
+    result = []
+    for path in paths:
+        if not os.path.isdir(path):
+            result.append((path, os.path.basename(path)))
+            continue
+        for directory, _, names in os.walk(path):
+            for name in sorted(names):
+                if os.path.splitext(name)[1].lower() in EXTENSIONS:
+                    source = os.path.join(directory, name)
+                    result.append((source, os.path.relpath(source, path)))
+    return result
+
+
+def convertFiles(paths: Iterable[str], outputDirectory: Optional[str] = None,
+                 jobs: Optional[int] = None) -> Tuple[List[Tuple[str, int]], List[Tuple[str, str]]]:
+    """
+    Converts all inputs in a process pool, returns the (target, mesh count) of every converted file and
+    the (source, error message) of every file that failed.
+    """
+    tasks = []
+    for source, relative in findInputs(paths):
+        if outputDirectory is None:
+            target = os.path.splitext(source)[0] + '.mesh'
+        else:
+            target = os.path.join(outputDirectory, os.path.splitext(relative)[0] + '.mesh')
+        tasks.append((source, target))
+
+    converted = []
+    failed = []
+    with ProcessPoolExecutor(jobs) as executor:
+        futures = [(source, executor.submit(convertFile, source, target)) for source, target in tasks]
+        for source, future in futures:
+            try:
+                converted.append(future.result())
+            except Exception as e:
+                failed.append((source, '%s: %s' % (type(e).__name__, e)))
+    return converted, failed
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Converts glTF, OBJ and Maya ASCII files to .mesh files.')
+    parser.add_argument('paths', nargs='+', help='files or directories to convert')
+    parser.add_argument('-o', '--output', help='output directory, by default files are written next to their source')
+    parser.add_argument('-j', '--jobs', type=int, help='number of processes, by default the number of cores')
+    args = parser.parse_args()
+
+    converted, failed = convertFiles(args.paths, args.output, args.jobs)
+    for target, meshCount in converted:
+        print('%s (%i meshes)' % (target, meshCount))
+    for source, error in failed:
+        print('failed to convert %s: %s' % (source, error), file=sys.stderr)
+    sys.exit(1 if failed else 0)
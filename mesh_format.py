@@ -0,0 +1,690 @@
+"""
+Reading and writing of .mesh files.
+This module does not depend on PyOpenGL so it can be used from Maya and from offline tools.
+
+Version 0 is the sequential format written by older versions of maya_mesh, see its docstring for the layout.
+
+Version 1 starts with a table of contents, so a reader can list the meshes and jump
+straight to the data of any of them without reading past the preceding meshes:
+
+u8[3]: ascii file type "MSH"
+u8: binary file version (1)
+u8[4]: ascii exporter identifier
+u32: mesh count
+u32: table of contents size in bytes (counted from the end of this field)
+for each mesh:
+  u32: name length
+  u8[name length]: utf8 encoded name
+  u32: material name length
+  u8[material name length]: utf8 encoded name
+  u32: attribute count
+  for each attribute:
+    u32: semantic ID (see VertexAttribute.Semantic)
+    u32: number of components (must be 1, 2, 3 or 4)
+    u32: component type, this is the OpenGL type enum (see VertexAttribute.Type)
+    u32: 1 if the components are normalized integers, else 0
+  u32: number of vertices
+  u32: number of indices, we only support triangle data so this must be divisible by 3
+  u32: bytes per index (1, 2 or 4)
+  u32: section count
+  for each section:
+    u8[4]: ascii section tag
+    u64: byte offset of the section from the start of the file
+    u64: section size in bytes
+section data, every section starts at a 16 byte aligned offset
+
+Sections:
+"VTX\0": all vertex data, interleaved in the order the attributes were specified
+"IDX\0": all index data
+"BNDS": bounds of the POSITION attribute, f32[3] minimum, f32[3] maximum, f32[3] sphere center, f32 sphere radius.
+        Written for every mesh with positions, and computed at load time for files that don't have it.
+Readers skip sections they do not know, so new per-mesh data can be added without a version bump.
+"""
+import enum
+import mmap
+import os
+import struct
+from typing import *
+import numpy as np
+
+# OpenGL enums, copied so we don't need PyOpenGL to read and write files
+GL_BYTE = 0x1400
+GL_UNSIGNED_BYTE = 0x1401
+GL_SHORT = 0x1402
+GL_UNSIGNED_SHORT = 0x1403
+GL_FLOAT = 0x1406
+GL_HALF_FLOAT = 0x140B
+GL_UNSIGNED_INT_2_10_10_10_REV = 0x8368
+GL_INT_2_10_10_10_REV = 0x8D9F
+
+FORMAT_VERSION = 1
+SECTION_ALIGNMENT = 16
+VERTEX_SECTION = b'VTX\0'
+INDEX_SECTION = b'IDX\0'
+BOUNDS_SECTION = b'BNDS'
+
+
+class VertexAttribute:
+    class Semantic(enum.Enum):
+        POSITION = 0
+        NORMAL = 1
+        TANGENT = 2
+        TEXCOORD0 = 3
+        TEXCOORD1 = 4
+        TEXCOORD2 = 5
+        TEXCOORD3 = 6
+        TEXCOORD4 = 7
+        TEXCOORD5 = 8
+        TEXCOORD6 = 9
+        TEXCOORD7 = 10
+        BLENDINDICES = 11
+        BLENDWEIGHT = 12
+        COLOR0 = 13
+        COLOR1 = 14
+        COLOR2 = 15
+        COLOR3 = 16
+        # COLOR# = COLOR0 + i
+
+    class Size(enum.Enum):
+        Single = 1
+        Vec2 = 2
+        Vec3 = 3
+        Vec4 = 4
+
+    class Type(enum.Enum):
+        Float = GL_FLOAT
+        HalfFloat = GL_HALF_FLOAT
+        Byte = GL_BYTE
+        UnsignedByte = GL_UNSIGNED_BYTE
+        Short = GL_SHORT
+        UnsignedShort = GL_UNSIGNED_SHORT
+        # packed types store all 4 components in a single 32 bit integer
+        Int2101010Rev = GL_INT_2_10_10_10_REV
+        UnsignedInt2101010Rev = GL_UNSIGNED_INT_2_10_10_10_REV
+
+    def __init__(self, semantic, size, type, normalized: bool = False, stream: int = 0):
+        # normalized maps integer types to [0, 1] (unsigned) or [-1, 1] (signed) instead of converting them to float as-is
+        # stream is the vertex buffer the attribute is read from when drawing, files always store a single stream
+        if isinstance(semantic, str):
+            semantic = getattr(VertexAttribute.Semantic, semantic)
+        self.semantic: Semantic = VertexAttribute.Semantic(semantic)
+        self.size: Size = VertexAttribute.Size(size)
+        self.type: Type = VertexAttribute.Type(type)
+        self.normalized: bool = bool(normalized)
+        self.stream: int = stream
+        assert not self.isPacked() or self.size == VertexAttribute.Size.Vec4, 'Packed attributes must have 4 components.'
+
+    def __repr__(self):
+        if self.stream:
+            return '(%s, %s, %s, stream %i)' % (self.semantic, self.size, self.type, self.stream)
+        return '(%s, %s, %s)' % (self.semantic, self.size, self.type)
+
+    def __eq__(self, other):
+        if not isinstance(other, VertexAttribute):
+            return NotImplemented
+        return self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def key(self) -> Tuple[int, int, int, bool]:
+        # what is stored in the file, the stream is not part of the data
+        return self.semantic.value, self.size.value, self.type.value, self.normalized
+
+    def isPacked(self) -> bool:
+        return self.type in (VertexAttribute.Type.Int2101010Rev, VertexAttribute.Type.UnsignedInt2101010Rev)
+
+    def dtype(self) -> str:
+        # numpy type of a single component, packed attributes are a single uint32
+        return _dtypes[self.type]
+
+    def componentCount(self) -> int:
+        # number of elements of dtype() per vertex
+        return 1 if self.isPacked() else self.size.value
+
+    def sizeInBytes(self):
+        return np.dtype(self.dtype()).itemsize * self.componentCount()
+
+    def inStream(self, stream: int) -> "VertexAttribute":
+        return VertexAttribute(self.semantic, self.size, self.type, self.normalized, stream)
+
+
+_dtypes = {
+    VertexAttribute.Type.Float: '<f4',
+    VertexAttribute.Type.HalfFloat: '<f2',
+    VertexAttribute.Type.Byte: 'i1',
+    VertexAttribute.Type.UnsignedByte: 'u1',
+    VertexAttribute.Type.Short: '<i2',
+    VertexAttribute.Type.UnsignedShort: '<u2',
+    VertexAttribute.Type.Int2101010Rev: '<u4',
+    VertexAttribute.Type.UnsignedInt2101010Rev: '<u4',
+}
+
+
+class MeshInfo(object):
+    """
+    Table of contents entry, describes a mesh and where its sections live in the file.
+    """
+
+    def __init__(self, name: str, materialName: str, attributeLayout: List[VertexAttribute],
+                 vertexCount: int, indexCount: int, indexSize: int, sections: Dict[bytes, Tuple[int, int]]):
+        self.name: str = name
+        self.materialName: str = materialName
+        self.attributeLayout: List[VertexAttribute] = attributeLayout
+        self.vertexCount: int = vertexCount
+        self.indexCount: int = indexCount
+        self.indexSize: int = indexSize
+        self.sections: Dict[bytes, Tuple[int, int]] = sections
+
+    def __repr__(self):
+        return 'MeshInfo(%r, %r, %i vertices, %i indices)' % (self.name, self.materialName, self.vertexCount, self.indexCount)
+
+    @property
+    def stride(self) -> int:
+        return sum(va.sizeInBytes() for va in self.attributeLayout)
+
+
+class MeshData(object):
+    """
+    CPU side mesh data, vertexData, indexData and sections can be anything that supports the buffer protocol.
+    When read from a MeshFileReader they are views into the file and only valid until the reader is closed.
+    """
+
+    def __init__(self, name: str, materialName: str, attributeLayout: List[VertexAttribute],
+                 vertexData: Any, indexData: Any, indexSize: int = 4, sections: Optional[Dict[bytes, Any]] = None):
+        self.name: str = name
+        self.materialName: str = materialName
+        self.attributeLayout: List[VertexAttribute] = attributeLayout
+        self.vertexData = vertexData
+        self.indexData = indexData
+        self.indexSize: int = indexSize
+        # additional sections to read or write, without the vertex and index sections
+        self.sections: Dict[bytes, Any] = {} if sections is None else sections
+
+    def __repr__(self):
+        return 'MeshData(%r, %r, %i vertices, %i indices)' % (self.name, self.materialName, self.vertexCount, self.indexCount)
+
+    @property
+    def stride(self) -> int:
+        return sum(va.sizeInBytes() for va in self.attributeLayout)
+
+    @property
+    def vertexCount(self) -> int:
+        return memoryview(self.vertexData).nbytes // self.stride
+
+    @property
+    def indexCount(self) -> int:
+        return memoryview(self.indexData).nbytes // self.indexSize
+
+    def layoutKey(self) -> Tuple[Any, ...]:
+        # meshes with the same key can be merged into a single draw call
+        return tuple(self.attributeLayout), self.materialName
+
+    def indexArray(self) -> np.ndarray:
+        return np.frombuffer(self.indexData, '<u%i' % self.indexSize)
+
+    def attribute(self, semantic: VertexAttribute.Semantic) -> Optional[VertexAttribute]:
+        for va in self.attributeLayout:
+            if va.semantic == semantic:
+                return va
+        return None
+
+    def attributeArray(self, semantic: VertexAttribute.Semantic) -> np.ndarray:
+        """
+        Returns a (vertexCount, componentCount) view of one attribute in the interleaved vertex data.
+        The view is writable if vertexData is.
+        """
+        offset = 0
+        for va in self.attributeLayout:
+            if va.semantic == semantic:
+                break
+            offset += va.sizeInBytes()
+        else:
+            raise KeyError(f'Mesh "{self.name}" has no {semantic} attribute.')
+        dtype = np.dtype(va.dtype())
+        return np.ndarray((self.vertexCount, va.componentCount()), dtype, np.frombuffer(self.vertexData, np.uint8),
+                          offset, (self.stride, dtype.itemsize))
+
+
+def streamStrides(attributeLayout: Iterable[VertexAttribute]) -> List[int]:
+    # the vertex size of every stream, attributes are packed in layout order within their stream
+    strides = []
+    for va in attributeLayout:
+        strides.extend([0] * (va.stream + 1 - len(strides)))
+        strides[va.stream] += va.sizeInBytes()
+    return strides
+
+
+def splitVertexStreams(mesh: MeshData, streams: Sequence[Iterable[VertexAttribute.Semantic]]) \
+        -> Tuple[List[VertexAttribute], List[np.ndarray]]:
+    """
+    De-interleaves the vertex data so passes that only read some attributes (like a depth pass reading POSITION)
+    only fetch those. Every entry of streams lists the semantics of one stream, the attributes that are not listed
+    go in a final stream. Streams without attributes are left out.
+    Returns the layout with the stream of every attribute, and the vertex data of every stream.
+    """
+    streams = [set(semantics) for semantics in streams]
+    streamOf = [next((i for i, semantics in enumerate(streams) if va.semantic in semantics), len(streams))
+                for va in mesh.attributeLayout]
+    used = sorted(set(streamOf))
+    rows = np.frombuffer(mesh.vertexData, np.uint8).reshape(-1, mesh.stride)
+    columns = np.repeat(streamOf, [va.sizeInBytes() for va in mesh.attributeLayout])
+    layout = [va.inStream(used.index(stream)) for va, stream in zip(mesh.attributeLayout, streamOf)]
+    return layout, [np.ascontiguousarray(rows[:, columns == stream]) for stream in used]
+
+
+class Bounds(NamedTuple):
+    """
+    Axis aligned box and a sphere around it, the sphere is centered on the box so it is not the smallest possible.
+    """
+    minimum: np.ndarray
+    maximum: np.ndarray
+    center: np.ndarray
+    radius: float
+
+    def encode(self) -> bytes:
+        return struct.pack('<10f', *self.minimum, *self.maximum, *self.center, self.radius)
+
+    @staticmethod
+    def decode(data: Any) -> "Bounds":
+        values = struct.unpack_from('<10f', data)
+        return Bounds(np.array(values[0:3], np.float32), np.array(values[3:6], np.float32),
+                      np.array(values[6:9], np.float32), values[9])
+
+    def transformed(self, matrix: np.ndarray) -> "Bounds":
+        """
+        Returns the bounds in another space, the matrix is a row-major 4x4 array (see camera.matrixToArray).
+        The box is the box around the transformed box, so it grows under rotation.
+        """
+        rotation = matrix[:3, :3]
+        boxCenter = rotation @ ((self.minimum + self.maximum) * 0.5) + matrix[:3, 3]
+        extent = np.abs(rotation) @ ((self.maximum - self.minimum) * 0.5)
+        scale = float(np.linalg.norm(rotation, axis=0).max())
+        return Bounds((boxCenter - extent).astype(np.float32), (boxCenter + extent).astype(np.float32),
+                      (rotation @ self.center + matrix[:3, 3]).astype(np.float32), self.radius * scale)
+
+    @staticmethod
+    def union(bounds: Iterable["Bounds"]) -> Optional["Bounds"]:
+        bounds = list(bounds)
+        if not bounds:
+            return None
+        minimum = np.min([b.minimum for b in bounds], axis=0)
+        maximum = np.max([b.maximum for b in bounds], axis=0)
+        center = (minimum + maximum) * 0.5
+        radius = max(float(np.linalg.norm(b.center - center)) + b.radius for b in bounds)
+        return Bounds(minimum, maximum, center, radius)
+
+
+def computeBounds(positions: np.ndarray) -> Bounds:
+    # positions is an (N, 3) array
+    if not len(positions):
+        zero = np.zeros(3, np.float32)
+        return Bounds(zero, zero, zero, 0.0)
+    minimum = positions.min(axis=0).astype(np.float32)
+    maximum = positions.max(axis=0).astype(np.float32)
+    center = (minimum + maximum) * 0.5
+    radius = float(np.sqrt(((positions - center) ** 2).sum(axis=1).max()))
+    return Bounds(minimum, maximum, center, radius)
+
+
+def positionArray(mesh: MeshData) -> Optional[np.ndarray]:
+    """
+    Returns the positions as an (N, 3) float array, or None if the mesh has no positions we can decode.
+    """
+    va = mesh.attribute(VertexAttribute.Semantic.POSITION)
+    if va is None or va.isPacked():
+        return None
+    positions = mesh.attributeArray(VertexAttribute.Semantic.POSITION)[:, :3].astype(np.float32)
+    if va.normalized:
+        positions /= np.iinfo(va.dtype()).max
+    return positions
+
+
+def meshBounds(mesh: MeshData) -> Optional[Bounds]:
+    # reads the bounds section, or computes the bounds if there is none
+    if BOUNDS_SECTION in mesh.sections:
+        return Bounds.decode(mesh.sections[BOUNDS_SECTION])
+    positions = positionArray(mesh)
+    if positions is None:
+        return None
+    return computeBounds(positions)
+
+
+def withBounds(mesh: MeshData, recompute: bool = False) -> MeshData:
+    """
+    Returns the mesh with a bounds section, the input is returned as-is if it already has one (and not recompute)
+    or if it has no positions.
+    """
+    if BOUNDS_SECTION in mesh.sections and not recompute:
+        return mesh
+    sections = {tag: data for tag, data in mesh.sections.items() if tag != BOUNDS_SECTION}
+    bounds = meshBounds(MeshData(mesh.name, mesh.materialName, mesh.attributeLayout, mesh.vertexData,
+                                 mesh.indexData, mesh.indexSize, sections))
+    if bounds is None:
+        return mesh
+    sections[BOUNDS_SECTION] = bounds.encode()
+    return MeshData(mesh.name, mesh.materialName, mesh.attributeLayout, mesh.vertexData,
+                    mesh.indexData, mesh.indexSize, sections)
+
+
+# processors transform mesh data after it is read, e.g. mesh_quantize.quantizeMeshData
+MeshProcessor = Callable[[MeshData], MeshData]
+
+
+def processMeshData(mesh: MeshData, processors: Sequence[MeshProcessor]) -> MeshData:
+    for processor in processors:
+        mesh = processor(mesh)
+    return mesh
+
+
+# batches of at most this many vertices can use 16 bit indices
+MAX_SHORT_INDEXED_VERTICES = 0x10000
+
+
+def narrowIndices(indices: np.ndarray, minIndexSize: int = 2) -> np.ndarray:
+    """
+    Converts indices to the smallest unsigned type that fits the largest index, but not smaller than minIndexSize.
+    Byte indices are valid OpenGL but a lot of hardware converts them on the CPU, so we stop at 16 bits by default.
+    Returns the input as-is if it already has the right type.
+    """
+    largest = int(indices.max()) if len(indices) else 0
+    for size in (1, 2, 4):
+        if size >= minIndexSize and largest < (1 << (size * 8)):
+            return indices.astype('<u%i' % size, copy=False)
+    raise ValueError(f'Index {largest} does not fit in 32 bits.')
+
+
+def narrowIndexData(mesh: MeshData, minIndexSize: int = 2) -> MeshData:
+    indices = narrowIndices(mesh.indexArray(), minIndexSize)
+    if indices.itemsize == mesh.indexSize:
+        return mesh
+    return MeshData(mesh.name, mesh.materialName, mesh.attributeLayout, mesh.vertexData,
+                    indices, indices.itemsize, mesh.sections)
+
+
+def _mergeBatch(meshes: List[MeshData]) -> MeshData:
+    # concatenate preallocates the result once, so this is linear in the total size
+    vbo = np.concatenate([np.frombuffer(mesh.vertexData, np.uint8) for mesh in meshes])
+    ibo = np.concatenate([mesh.indexArray() for mesh in meshes], dtype=np.uint32)
+    # indices of each sub-mesh are offset by the number of vertices that precede it
+    vertexCounts = np.fromiter((mesh.vertexCount for mesh in meshes), np.uint32, len(meshes))
+    indexCounts = np.fromiter((mesh.indexCount for mesh in meshes), np.int64, len(meshes))
+    baseVertices = np.cumsum(vertexCounts, dtype=np.uint32) - vertexCounts
+    ibo += np.repeat(baseVertices, indexCounts)
+    sections = {}
+    # meshlets are ranges of the index data, so they only move with the first index of their mesh
+    from .mesh_meshlet import MESHLET_SECTION, mergeMeshletSections
+    if all(MESHLET_SECTION in mesh.sections for mesh in meshes):
+        sections[MESHLET_SECTION] = mergeMeshletSections([mesh.sections[MESHLET_SECTION] for mesh in meshes],
+                                                         np.cumsum(indexCounts) - indexCounts)
+    return MeshData(meshes[0].name, meshes[0].materialName, meshes[0].attributeLayout, vbo, ibo, 4, sections)
+
+
+def mergeMeshData(meshes: Iterable[MeshData], minIndexSize: int = 2) -> List[MeshData]:
+    """
+    Merges meshes that share an attribute layout and material, and narrows the indices of the result.
+    A batch is closed before it exceeds MAX_SHORT_INDEXED_VERTICES vertices, so it can keep using 16 bit
+    indices, only meshes that are bigger than that on their own use 32 bits.
+    Meshes with meshlets are only merged with each other, and their meshlets are merged too. Meshes with levels
+    of detail are never merged, their levels are selected with their own bounding sphere. Other sections, like
+    the bounds, are only kept for meshes that did not need merging.
+    """
+    from .mesh_lod import LOD_SECTION
+    from .mesh_meshlet import MESHLET_SECTION
+    meshesByLayoutAndMaterial = {}
+    lodCount = 0
+    for i, mesh in enumerate(meshes):
+        if LOD_SECTION in mesh.sections:
+            # a group of its own
+            key = i
+            lodCount += 1
+        else:
+            key = mesh.layoutKey(), MESHLET_SECTION in mesh.sections
+        meshesByLayoutAndMaterial.setdefault(key, []).append(mesh)
+    result = []
+    for group in meshesByLayoutAndMaterial.values():
+        batches = [[]]
+        batchVertexCount = 0
+        for mesh in group:
+            vertexCount = mesh.vertexCount
+            if batches[-1] and batchVertexCount + vertexCount > MAX_SHORT_INDEXED_VERTICES:
+                batches.append([])
+                batchVertexCount = 0
+            batches[-1].append(mesh)
+            batchVertexCount += vertexCount
+        for batch in batches:
+            merged = batch[0] if len(batch) == 1 else _mergeBatch(batch)
+            result.append(narrowIndexData(merged, minIndexSize))
+    assert sum(LOD_SECTION in mesh.sections for mesh in result) == lodCount, 'Merging lost levels of detail.'
+    return result
+
+
+def _readString(view: memoryview, cursor: int) -> Tuple[str, int]:
+    length, = struct.unpack_from('<I', view, cursor)
+    cursor += 4
+    return bytes(view[cursor:cursor + length]).decode('utf8'), cursor + length
+
+
+def _readTableOfContentsV0(view: memoryview, path: str) -> List[MeshInfo]:
+    # version 0 has no table of contents, so we walk the headers and skip over the data
+    meshCount, = struct.unpack_from('<I', view, 8)
+    cursor = 12
+    meshes = []
+    for meshIndex in range(meshCount):
+        name, cursor = _readString(view, cursor)
+        materialName, cursor = _readString(view, cursor)
+        attributeCount, = struct.unpack_from('<I', view, cursor)
+        cursor += 4
+        attributes = struct.unpack_from('<%iI' % (attributeCount * 2), view, cursor)
+        cursor += attributeCount * 8
+        attributeLayout = [VertexAttribute(VertexAttribute.Semantic(semanticId),
+                                           VertexAttribute.Size(numFloats),
+                                           VertexAttribute.Type.Float)
+                           for semanticId, numFloats in zip(attributes[0::2], attributes[1::2])]
+        numFloats, numInts = struct.unpack_from('<II', view, cursor)
+        cursor += 8
+        vboOffset, vboSize = cursor, numFloats * 4
+        iboOffset, iboSize = vboOffset + vboSize, numInts * 4
+        cursor = iboOffset + iboSize
+        assert cursor <= len(view), f'Unexpected end of file in mesh "{name}" of file "{path}".'
+        stride = sum(va.sizeInBytes() for va in attributeLayout)
+        meshes.append(MeshInfo(name, materialName, attributeLayout, vboSize // stride, numInts, 4,
+                               {VERTEX_SECTION: (vboOffset, vboSize), INDEX_SECTION: (iboOffset, iboSize)}))
+    return meshes
+
+
+def _readTableOfContentsV1(view: memoryview, path: str) -> List[MeshInfo]:
+    meshCount, tocSize = struct.unpack_from('<II', view, 8)
+    cursor = 16
+    assert cursor + tocSize <= len(view), f'Unexpected end of file in table of contents of file "{path}".'
+    meshes = []
+    for meshIndex in range(meshCount):
+        name, cursor = _readString(view, cursor)
+        materialName, cursor = _readString(view, cursor)
+        attributeCount, = struct.unpack_from('<I', view, cursor)
+        cursor += 4
+        attributes = struct.unpack_from('<%iI' % (attributeCount * 4), view, cursor)
+        cursor += attributeCount * 16
+        attributeLayout = [VertexAttribute(*attributes[i:i + 4]) for i in range(0, len(attributes), 4)]
+        vertexCount, indexCount, indexSize, sectionCount = struct.unpack_from('<IIII', view, cursor)
+        cursor += 16
+        sections = {}
+        for sectionIndex in range(sectionCount):
+            tag, offset, size = struct.unpack_from('<4sQQ', view, cursor)
+            cursor += 20
+            assert offset + size <= len(view), f'Section {tag} of mesh "{name}" is out of bounds in file "{path}".'
+            sections[tag] = offset, size
+        meshes.append(MeshInfo(name, materialName, attributeLayout, vertexCount, indexCount, indexSize, sections))
+    return meshes
+
+
+class MeshFileReader(object):
+    """
+    Reads the table of contents of a .mesh file and gives access to the data of individual meshes on demand.
+    Version 0 and 1 files are supported.
+    """
+
+    def __init__(self, path: str, memoryMapped: bool = True):
+        self._path = path
+        with open(path, 'rb') as fh:
+            if memoryMapped:
+                self._data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._data = fh.read()
+        self._view = memoryview(self._data)
+
+        assert self._view[:3] == b'MSH', f'Unsupported file format for file "{path}".'
+        self._version: int = self._view[3]
+        self._exporter: bytes = bytes(self._view[4:8])
+        if self._version == 0:
+            self._meshes = _readTableOfContentsV0(self._view, path)
+        elif self._version == 1:
+            self._meshes = _readTableOfContentsV1(self._view, path)
+        else:
+            raise ValueError(f'Unsupported .mesh version {self._version} for file "{path}".')
+
+        self._indexByName = {}
+        for index, info in enumerate(self._meshes):
+            self._indexByName.setdefault(info.name, index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._meshes)
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def exporter(self) -> bytes:
+        return self._exporter
+
+    @property
+    def meshes(self) -> Tuple[MeshInfo, ...]:
+        return tuple(self._meshes)
+
+    def names(self) -> List[str]:
+        return [info.name for info in self._meshes]
+
+    def index(self, nameOrIndex: Union[str, int]) -> int:
+        if isinstance(nameOrIndex, str):
+            if nameOrIndex not in self._indexByName:
+                raise KeyError(f'No mesh named "{nameOrIndex}" in file "{self._path}".')
+            return self._indexByName[nameOrIndex]
+        if not -len(self._meshes) <= nameOrIndex < len(self._meshes):
+            raise IndexError(f'Mesh index {nameOrIndex} out of range in file "{self._path}".')
+        return nameOrIndex % len(self._meshes)
+
+    def info(self, nameOrIndex: Union[str, int]) -> MeshInfo:
+        return self._meshes[self.index(nameOrIndex)]
+
+    def section(self, nameOrIndex: Union[str, int], tag: bytes) -> Optional[memoryview]:
+        # returns a view into the file, or None if the mesh has no such section
+        info = self.info(nameOrIndex)
+        if tag not in info.sections:
+            return None
+        offset, size = info.sections[tag]
+        return self._view[offset:offset + size]
+
+    def meshData(self, nameOrIndex: Union[str, int]) -> MeshData:
+        info = self.info(nameOrIndex)
+        sections = {tag: self.section(nameOrIndex, tag) for tag in info.sections
+                    if tag not in (VERTEX_SECTION, INDEX_SECTION)}
+        return MeshData(info.name, info.materialName, info.attributeLayout,
+                        self.section(nameOrIndex, VERTEX_SECTION), self.section(nameOrIndex, INDEX_SECTION),
+                        info.indexSize, sections)
+
+    def close(self):
+        if self._view is None:
+            return
+        self._view.release()
+        self._view = None
+        if isinstance(self._data, mmap.mmap):
+            try:
+                self._data.close()
+            except BufferError:
+                # someone still holds a view into the file, the mapping is closed when that goes away
+                pass
+        self._data = None
+
+
+def _align(offset: int) -> int:
+    return (offset + SECTION_ALIGNMENT - 1) // SECTION_ALIGNMENT * SECTION_ALIGNMENT
+
+
+def writeMeshFile(path: str, meshes: Iterable[MeshData], exporter: bytes = b'TTGL'):
+    """
+    Writes a version 1 file, see the module docstring for the format specification.
+    """
+    assert len(exporter) == 4, exporter
+    meshes = [withBounds(mesh) for mesh in meshes]
+
+    # the size of the table of contents does not depend on the offsets it contains,
+    # so we encode everything but the section table first and then lay out the data behind it
+    entries = []
+    for mesh in meshes:
+        sections = [(VERTEX_SECTION, memoryview(mesh.vertexData).cast('B')),
+                    (INDEX_SECTION, memoryview(mesh.indexData).cast('B'))]
+        sections += [(tag, memoryview(data).cast('B')) for tag, data in mesh.sections.items()]
+        name = mesh.name.encode('utf8')
+        materialName = mesh.materialName.encode('utf8')
+        header = [struct.pack('<I', len(name)), name,
+                  struct.pack('<I', len(materialName)), materialName,
+                  struct.pack('<I', len(mesh.attributeLayout))]
+        header += [struct.pack('<IIII', *va.key()) for va in mesh.attributeLayout]
+        header.append(struct.pack('<IIII', mesh.vertexCount, mesh.indexCount, mesh.indexSize, len(sections)))
+        entries.append((b''.join(header), sections))
+    tocSize = sum(len(header) + len(sections) * 20 for header, sections in entries)
+
+    cursor = _align(16 + tocSize)
+    toc = []
+    layout = []
+    for header, sections in entries:
+        toc.append(header)
+        for tag, data in sections:
+            toc.append(struct.pack('<4sQQ', tag, cursor, data.nbytes))
+            layout.append((cursor, data))
+            cursor = _align(cursor + data.nbytes)
+
+    with open(path, 'wb') as fh:
+        fh.write(b'MSH' + bytes((FORMAT_VERSION,)) + exporter)
+        fh.write(struct.pack('<II', len(meshes), tocSize))
+        fh.write(b''.join(toc))
+        for offset, data in layout:
+            fh.write(b'\0' * (offset - fh.tell()))
+            fh.write(data)
+
+
+def readMeshFile(path: str, processors: Sequence[MeshProcessor] = (), memoryMapped: bool = True) -> List[MeshData]:
+    """
+    Reads, processes and merges all meshes in a file, the result is ready to upload and has bounds.
+    When memoryMapped, unmerged data still points into the mapping, which is closed when the result is released.
+    """
+    with MeshFileReader(path, memoryMapped) as reader:
+        meshes = mergeMeshData([processMeshData(reader.meshData(i), processors) for i in range(len(reader))])
+    # processors may have moved the vertices, in which case the stored bounds are stale
+    return [withBounds(mesh, recompute=bool(processors)) for mesh in meshes]
+
+
+def upgradeMeshFile(source: str, target: str):
+    """
+    Rewrites a .mesh file of any supported version as the current version.
+    """
+    assert os.path.abspath(source) != os.path.abspath(target), 'Can not upgrade a file in place.'
+    with MeshFileReader(source) as reader:
+        writeMeshFile(target, [reader.meshData(i) for i in range(len(reader))], reader.exporter)
+
+
+if __name__ == '__main__':
+    import sys
+
+    upgradeMeshFile(sys.argv[1], sys.argv[2])
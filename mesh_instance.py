@@ -0,0 +1,112 @@
+"""
+Finds copies of the same geometry among the meshes of a file, so they can share one GPU copy and be drawn instanced.
+
+Exporters write every mesh in world space, so two copies of a prop only have the same bytes when they overlap.
+Copies that were moved (not rotated or scaled) differ by a translation of their positions: meshes are copies when
+their index data, material and every attribute other than POSITION are byte-equal, and their positions are equal
+up to a translation (within a tolerance relative to the size of the mesh). Meshes are hashed on the byte-equal
+part first, so only meshes with the same hash are compared.
+
+The first mesh of a group keeps its data, the others become translations of it.
+"""
+import hashlib
+from typing import *
+import numpy as np
+from .mesh_format import VertexAttribute, MeshData, BOUNDS_SECTION, positionArray
+
+
+class InstanceGroup(NamedTuple):
+    # the geometry of the first instance, and a row-major (4, 4) matrix per instance placing the geometry
+    mesh: MeshData
+    matrices: np.ndarray
+
+    @property
+    def savedBytes(self) -> int:
+        # the vertex and index data we don't need to store for the other instances
+        size = memoryview(self.mesh.vertexData).nbytes + memoryview(self.mesh.indexData).nbytes
+        return size * (len(self.matrices) - 1)
+
+
+def _positionColumns(mesh: MeshData) -> np.ndarray:
+    # bool mask of the bytes in a vertex that belong to the position attribute
+    mask = np.zeros(mesh.stride, bool)
+    offset = 0
+    for va in mesh.attributeLayout:
+        if va.semantic == VertexAttribute.Semantic.POSITION:
+            mask[offset:offset + va.sizeInBytes()] = True
+        offset += va.sizeInBytes()
+    return mask
+
+
+class _Candidate(object):
+    # a mesh with the data we compare
+    def __init__(self, mesh: MeshData, translatable: bool):
+        self.mesh = mesh
+        rows = np.frombuffer(mesh.vertexData, np.uint8).reshape(-1, mesh.stride)
+        self.positions = positionArray(mesh) if translatable else None
+        # with float positions we compare everything else, otherwise all bytes must match
+        self.payload = rows[:, ~_positionColumns(mesh)] if self.positions is not None else rows
+        self.indices = np.frombuffer(mesh.indexData, np.uint8)
+
+    def key(self) -> bytes:
+        digest = hashlib.blake2b(digest_size=16)
+        header = (tuple(self.mesh.attributeLayout), self.mesh.materialName, self.mesh.indexSize,
+                  self.mesh.vertexCount, self.positions is not None, sorted(self.mesh.sections))
+        digest.update(repr(header).encode('utf8'))
+        digest.update(np.ascontiguousarray(self.payload).data)
+        digest.update(self.indices.data)
+        return digest.digest()
+
+    def sameSections(self, other: "_Candidate") -> bool:
+        # bounds move with the positions, all other sections must be byte-equal
+        return all(bytes(memoryview(data).cast('B')) == bytes(memoryview(other.mesh.sections[tag]).cast('B'))
+                   for tag, data in self.mesh.sections.items() if tag != BOUNDS_SECTION)
+
+    def offsetFrom(self, other: "_Candidate", tolerance: float) -> Optional[np.ndarray]:
+        """
+        Returns the translation from other to this mesh if they are copies, else None.
+        """
+        if not (np.array_equal(self.indices, other.indices) and np.array_equal(self.payload, other.payload)):
+            return None
+        if self.positions is None:
+            return np.zeros(3)
+        if not len(self.positions):
+            return np.zeros(3)
+        offset = self.positions[0].astype(np.float64) - other.positions[0]
+        extent = float(np.abs(other.positions - other.positions[0]).max())
+        error = np.abs(self.positions - (other.positions + offset)).max()
+        # far from the origin float32 positions are only this precise
+        rounding = 8.0 * float(np.finfo(np.float32).eps) * float(max(np.abs(self.positions).max(), np.abs(other.positions).max()))
+        return offset if error <= tolerance * max(extent, 1.0) + rounding else None
+
+
+def _translation(offset: np.ndarray) -> np.ndarray:
+    matrix = np.eye(4)
+    matrix[:3, 3] = offset
+    return matrix
+
+
+def groupInstances(meshes: Iterable[MeshData], tolerance: float = 1e-5) -> List[InstanceGroup]:
+    """
+    Groups the meshes that are copies of each other, every mesh is in exactly one group, in order of first use.
+    Sections other than the bounds (like levels of detail and meshlets) must be byte-equal too, since most of
+    them contain positions this means meshes with those sections only group when they are in the same place.
+    A tolerance of 0 only groups meshes that are entirely byte-equal.
+    """
+    groups: List[Tuple[_Candidate, List[np.ndarray]]] = []
+    groupsByKey: Dict[bytes, List[int]] = {}
+    for mesh in meshes:
+        candidate = _Candidate(mesh, tolerance > 0.0)
+        sameKey = groupsByKey.setdefault(candidate.key(), [])
+        for index in sameKey:
+            prototype, matrices = groups[index]
+            if not candidate.sameSections(prototype):
+                continue
+            offset = candidate.offsetFrom(prototype, tolerance)
+            if offset is not None:
+                matrices.append(_translation(offset))
+                break
+        else:
+            sameKey.append(len(groups))
+            groups.append((candidate, [np.eye(4)]))
+    return [InstanceGroup(prototype.mesh, np.array(matrices)) for prototype, matrices in groups]
@@ -0,0 +1,220 @@
+"""
+Loads .mesh files without blocking the GL thread.
+
+Reading, processing and merging runs in a thread pool (or a process pool, in which case the results
+come back through shared memory). The GL buffers are filled from AsyncMeshLoader.upload(), which must be
+called on the GL thread, e.g. at the start of QOpenGLWidget.paintGL, and uploads at most bytesPerFrame
+bytes per call. Big meshes are uploaded in parts over multiple frames.
+
+loader = AsyncMeshLoader()
+handle = loader.load('scene.mesh')
+...
+def paintGL(self):
+    loader.upload()
+    handle.draw()  # draws nothing until all meshes in the file are uploaded
+    if loader.busy:
+        self.update()
+"""
+import collections
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import *
+import numpy as np
+from OpenGL.GL import *
+from .core import TSignal
+from .mesh import Buffer, Mesh, meshIndexData
+from .mesh_cache import MeshCache
+from .mesh_format import MeshData, meshBounds, MeshProcessor, readMeshFile
+from .mesh_meshlet import meshMeshlets
+
+
+def _readMeshFile(path: str, processors: Sequence[MeshProcessor], cache: Optional[MeshCache]) -> List[MeshData]:
+    if cache is not None:
+        return cache.read(path, processors)
+    return readMeshFile(path, processors)
+
+
+def _readMeshFileShared(path: str, processors: Sequence[MeshProcessor],
+                        cache: Optional[MeshCache]) -> List[Tuple[str, MeshData, int, int]]:
+    # runs in a worker process, the vertex and index data are moved to shared memory so they don't need pickling
+    result = []
+    for mesh in _readMeshFile(path, processors, cache):
+        vertexData = memoryview(mesh.vertexData).cast('B')
+        indexData = memoryview(mesh.indexData).cast('B')
+        block = SharedMemory(create=True, size=max(1, vertexData.nbytes + indexData.nbytes))
+        block.buf[:vertexData.nbytes] = vertexData
+        block.buf[vertexData.nbytes:vertexData.nbytes + indexData.nbytes] = indexData
+        sections = {tag: bytes(data) for tag, data in mesh.sections.items()}
+        header = MeshData(mesh.name, mesh.materialName, mesh.attributeLayout, b'', b'', mesh.indexSize, sections)
+        result.append((block.name, header, vertexData.nbytes, indexData.nbytes))
+        del vertexData, indexData
+        block.close()
+        # the main process unlinks the block, without this the resource tracker of the worker would unlink it on exit
+        resource_tracker.unregister(block._name, 'shared_memory')
+    return result
+
+
+def _attachShared(name: str, header: MeshData, vertexSize: int, indexSize: int) -> Tuple[MeshData, SharedMemory]:
+    block = SharedMemory(name)
+    data = np.ndarray((vertexSize + indexSize,), np.uint8, block.buf)
+    mesh = MeshData(header.name, header.materialName, header.attributeLayout,
+                    data[:vertexSize], data[vertexSize:], header.indexSize, header.sections)
+    return mesh, block
+
+
+class MeshHandle(object):
+    """
+    The meshes of a file that is being loaded, meshes is empty until all of them are uploaded.
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        # emitted on the GL thread once the meshes are drawable
+        self.uploaded = TSignal()
+        self._meshes: Tuple[Tuple[Mesh, str], ...] = ()
+        self._ready: bool = False
+        self._error: Optional[BaseException] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    @property
+    def error(self) -> Optional[BaseException]:
+        return self._error
+
+    @property
+    def meshes(self) -> Tuple[Tuple[Mesh, str], ...]:
+        # (mesh, material name) pairs, like loadBinaryMesh returns
+        return self._meshes
+
+    def draw(self):
+        for mesh, _ in self._meshes:
+            mesh.draw()
+
+
+class _PendingMesh(object):
+    # GL buffers of a single mesh that are being filled
+    def __init__(self, mesh: MeshData, block: Optional[SharedMemory]):
+        self.mesh = mesh
+        self.block = block
+        self.materialName = mesh.materialName
+        indexData, self.indexType, self.levels = meshIndexData(mesh)
+        self.vertexData = np.frombuffer(mesh.vertexData, np.uint8)
+        self.indexData = np.frombuffer(indexData, np.uint8)
+        self.vertexBuffer: Optional[Buffer] = None
+        self.indexBuffer: Optional[Buffer] = None
+        self.cursor = 0
+
+    @property
+    def remaining(self) -> int:
+        return self.vertexData.nbytes + self.indexData.nbytes - self.cursor
+
+    def upload(self, budget: int) -> int:
+        if self.vertexBuffer is None:
+            self.vertexBuffer = Buffer(GL_ARRAY_BUFFER, self.vertexData.nbytes)
+            self.indexBuffer = Buffer(GL_ELEMENT_ARRAY_BUFFER, self.indexData.nbytes)
+        uploaded = 0
+        for buffer, data, start in ((self.vertexBuffer, self.vertexData, 0),
+                                    (self.indexBuffer, self.indexData, self.vertexData.nbytes)):
+            offset = self.cursor - start
+            if not 0 <= offset < data.nbytes or uploaded >= budget:
+                continue
+            size = min(data.nbytes - offset, budget - uploaded)
+            buffer.update(data[offset:offset + size], offset)
+            self.cursor += size
+            uploaded += size
+        return uploaded
+
+    def finish(self) -> Mesh:
+        mesh = Mesh(self.mesh.attributeLayout, self.vertexBuffer, self.indexBuffer, indexType=self.indexType)
+        if self.levels is not None:
+            mesh.setLevels(*self.levels)
+        mesh.bounds = meshBounds(self.mesh)
+        mesh.meshlets = meshMeshlets(self.mesh)
+        # drop our views before releasing the shared memory
+        self.vertexData = self.indexData = self.mesh = None
+        if self.block is not None:
+            self.block.close()
+            self.block.unlink()
+        return mesh
+
+
+class AsyncMeshLoader(object):
+    def __init__(self, bytesPerFrame: int = 16 * 1024 * 1024, maxWorkers: Optional[int] = None,
+                 useProcesses: bool = False, executor: Optional[Executor] = None, cache: Optional[MeshCache] = None):
+        """
+        With useProcesses CPU heavy processors (such as mesh_optimize.MeshOptimizer) run in parallel,
+        the processors must be picklable in that case. Alternatively pass your own executor.
+        With a cache, processed files are stored and loaded from there, see mesh_cache.
+        """
+        self.bytesPerFrame: int = bytesPerFrame
+        self.cache: Optional[MeshCache] = cache
+        self._useProcesses = useProcesses or isinstance(executor, ProcessPoolExecutor)
+        if executor is None:
+            executor = ProcessPoolExecutor(maxWorkers) if useProcesses else ThreadPoolExecutor(maxWorkers)
+        self._executor: Executor = executor
+        # handles in the order they were requested, with the future of the CPU side work
+        self._loading: List[Tuple[MeshHandle, Future]] = []
+        # handles that are being uploaded and their meshes
+        self._uploading: Deque[Tuple[MeshHandle, List[_PendingMesh], List[Tuple[Mesh, str]]]] = collections.deque()
+        self.bytesUploaded: int = 0
+
+    @property
+    def busy(self) -> bool:
+        return bool(self._loading or self._uploading)
+
+    def load(self, path: str, processors: Sequence[MeshProcessor] = ()) -> MeshHandle:
+        handle = MeshHandle(path)
+        if self._useProcesses:
+            future = self._executor.submit(_readMeshFileShared, path, tuple(processors), self.cache)
+        else:
+            future = self._executor.submit(_readMeshFile, path, tuple(processors), self.cache)
+        self._loading.append((handle, future))
+        return handle
+
+    def _collect(self):
+        # move finished CPU work to the upload queue, keeping the order of the requests that are done
+        loading = []
+        for handle, future in self._loading:
+            if not future.done():
+                loading.append((handle, future))
+                continue
+            try:
+                result = future.result()
+            except Exception as e:
+                handle._error = e
+                handle._ready = True
+                handle.uploaded.emit()
+                continue
+            if self._useProcesses:
+                pending = [_PendingMesh(*_attachShared(*args)) for args in result]
+            else:
+                pending = [_PendingMesh(mesh, None) for mesh in result]
+            self._uploading.append((handle, pending, []))
+        self._loading = loading
+
+    def upload(self, bytesPerFrame: Optional[int] = None) -> int:
+        """
+        Call this on the GL thread once per frame, returns the number of bytes uploaded.
+        """
+        self._collect()
+        budget = self.bytesPerFrame if bytesPerFrame is None else bytesPerFrame
+        uploaded = 0
+        while self._uploading and uploaded < budget:
+            handle, pending, done = self._uploading[0]
+            uploaded += pending[0].upload(budget - uploaded) if pending else 0
+            if pending and pending[0].remaining == 0:
+                finished = pending.pop(0)
+                done.append((finished.finish(), finished.materialName))
+            if not pending:
+                self._uploading.popleft()
+                handle._meshes = tuple(done)
+                handle._ready = True
+                handle.uploaded.emit()
+        self.bytesUploaded += uploaded
+        return uploaded
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait)
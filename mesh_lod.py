@@ -0,0 +1,256 @@
+"""
+Level of detail generation.
+The levels are extra index buffers into the regular vertex data: we only do half-edge collapses, so every
+vertex of a simplified mesh is one of the original vertices and all levels can share one vertex buffer.
+
+Use a LodGenerator as the last of the processors when loading, or generate the levels offline with:
+python -m TTOpenGL.mesh_lod source.mesh target.mesh [ratio ...]
+
+The levels are stored in the "LOD\0" section of a mesh:
+u32: number of levels, not counting level 0 (which is the regular index data)
+u32: bytes per index (1, 2 or 4)
+f32[4]: bounding sphere center and radius of the mesh
+for each level:
+  u32: first index, counted from the start of the index data of this section
+  u32: number of indices
+  f32: geometric error, an estimate of how far the level deviates from the original mesh
+u8[]: index data of all levels
+"""
+import struct
+from typing import *
+import numpy as np
+from .mesh_format import VertexAttribute, MeshData, MeshFileReader, writeMeshFile, narrowIndices, computeBounds
+
+LOD_SECTION = b'LOD\0'
+
+
+class LodLevel(NamedTuple):
+    firstIndex: int
+    indexCount: int
+    error: float
+
+
+def boundingSphere(positions: np.ndarray) -> Tuple[np.ndarray, float]:
+    # centered on the bounding box, not the smallest sphere but close and cheap
+    bounds = computeBounds(positions)
+    return bounds.center, bounds.radius
+
+
+def _lockedVertices(triangles: np.ndarray, weld: np.ndarray) -> np.ndarray:
+    # vertices that share a position with another vertex (attribute seams),
+    # and vertices on open or non-manifold edges, would tear the surface if we moved them
+    locked = np.bincount(weld)[weld] > 1
+    welded = weld[triangles]
+    edges = np.sort(welded[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1)
+    uniqueEdges, counts = np.unique(edges, axis=0, return_counts=True)
+    border = np.zeros(weld.max() + 1, bool)
+    border[uniqueEdges[counts != 2].ravel()] = True
+    return locked | border[weld]
+
+
+def planeQuadrics(indices: np.ndarray, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the (N, 4, 4) quadrics of the planes of the triangles around every vertex, weighted by triangle area,
+    and the (N,) summed weights. A quadric divided by its weight gives the mean squared distance to its planes.
+    """
+    positions = positions[:, :3].astype(np.float64)
+    triangles = indices.reshape(-1, 3).astype(np.int64)
+    corners = positions[triangles]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    areas = np.linalg.norm(normals, axis=1)
+    normals /= np.maximum(areas, 1e-20)[:, None]
+    areas *= 0.5
+    planes = np.concatenate([normals, -np.einsum('ij,ij->i', normals, corners[:, 0])[:, None]], axis=1)
+    quadrics = (planes[:, :, None] * planes[:, None, :]).reshape(-1, 16) * areas[:, None]
+    result = np.empty((len(positions), 16))
+    for i in range(16):
+        result[:, i] = np.bincount(triangles.ravel(), np.repeat(quadrics[:, i], 3), len(positions))
+    return result.reshape(-1, 4, 4), np.bincount(triangles.ravel(), np.repeat(areas, 3), len(positions))
+
+
+def _quadricError(quadrics: np.ndarray, weights: np.ndarray, points: np.ndarray) -> np.ndarray:
+    # mean squared distance of the points to the planes of the quadrics
+    homogeneous = np.concatenate([points, np.ones((len(points), 1))], axis=1)
+    return np.einsum('ni,nij,nj->n', homogeneous, quadrics, homogeneous) / np.maximum(weights, 1e-30)
+
+
+def simplify(indices: np.ndarray, positions: np.ndarray, targetIndexCount: int,
+             quadrics: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Tuple[np.ndarray, float]:
+    """
+    Quadric error edge collapse: in every pass we pick a batch of cheap collapses that don't share any
+    triangles, drop the ones that would flip a triangle, and apply the rest in one go.
+    Returns the new indices (same type as the input) and the geometric error of the result, the largest
+    root mean square distance of a kept vertex to the original planes around the vertices collapsed into it.
+    The result may have more indices than requested if no more edges can be collapsed.
+    quadrics are planeQuadrics of the original mesh, they are updated in place: pass the same ones when simplifying
+    the result further, so its error is measured against the original mesh too.
+    """
+    positions = positions[:, :3].astype(np.float64)
+    triangles = indices.reshape(-1, 3).astype(np.int64)
+    vertexCount = len(positions)
+    if len(triangles) == 0:
+        return indices.copy(), 0.0
+    _, weld = np.unique(positions, axis=0, return_inverse=True)
+    locked = _lockedVertices(triangles, weld.ravel())
+    quadrics, weights = planeQuadrics(indices, positions) if quadrics is None else quadrics
+    maxCost = 0.0
+
+    while len(triangles) * 3 > targetIndexCount:
+        # all collapse candidates u -> v, in both directions
+        edges = triangles[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2)
+        edges = np.unique(np.concatenate([edges, edges[:, ::-1]]), axis=0)
+        edges = edges[~locked[edges[:, 0]]]
+        if not len(edges):
+            break
+        costs = _quadricError(quadrics[edges[:, 0]] + quadrics[edges[:, 1]], weights[edges[:, 0]] + weights[edges[:, 1]],
+                              positions[edges[:, 1]])
+        edges = edges[np.argsort(costs, kind='stable')]
+        costs = np.sort(costs, kind='stable')
+
+        # greedily pick collapses, a collapse claims the source vertex and its whole neighbourhood
+        neighbourEdges = edges[np.argsort(edges[:, 0], kind='stable')]
+        neighbourOffsets = np.searchsorted(neighbourEdges[:, 0], np.arange(vertexCount + 1)).tolist()
+        neighbours = neighbourEdges[:, 1].tolist()
+        claimed = np.zeros(vertexCount, bool).tolist()
+        wanted = max(1, (len(triangles) - targetIndexCount // 3) // 2)
+        selected = []
+        for i, (u, v) in enumerate(edges.tolist()):
+            if claimed[u] or claimed[v]:
+                continue
+            selected.append(i)
+            claimed[u] = claimed[v] = True
+            for k in range(neighbourOffsets[u], neighbourOffsets[u + 1]):
+                claimed[neighbours[k]] = True
+            if len(selected) >= wanted:
+                break
+        selected = np.array(selected, np.int64)
+
+        # reject collapses that flip any of the triangles that survive them
+        remap = np.arange(vertexCount)
+        remap[edges[selected, 0]] = edges[selected, 1]
+        collapsed = remap[triangles]
+        moved = (collapsed != triangles).any(axis=1)
+        degenerate = (collapsed[:, 0] == collapsed[:, 1]) | (collapsed[:, 1] == collapsed[:, 2]) | (collapsed[:, 2] == collapsed[:, 0])
+        check = np.flatnonzero(moved & ~degenerate)
+        before = positions[triangles[check]]
+        after = positions[collapsed[check]]
+        normalsBefore = np.cross(before[:, 1] - before[:, 0], before[:, 2] - before[:, 0])
+        normalsAfter = np.cross(after[:, 1] - after[:, 0], after[:, 2] - after[:, 0])
+        flipped = check[np.einsum('ij,ij->i', normalsBefore, normalsAfter) <= 0.0]
+        rejected = np.zeros(vertexCount, bool)
+        sources = triangles[flipped]
+        rejected[sources[remap[sources] != sources]] = True
+        accepted = selected[~rejected[edges[selected, 0]]]
+        if not len(accepted):
+            break
+
+        u, v = edges[accepted, 0], edges[accepted, 1]
+        remap = np.arange(vertexCount)
+        remap[u] = v
+        quadrics[v] += quadrics[u]
+        weights[v] += weights[u]
+        maxCost = max(maxCost, float(costs[accepted].max()))
+        triangles = remap[triangles]
+        triangles = triangles[(triangles[:, 0] != triangles[:, 1]) &
+                              (triangles[:, 1] != triangles[:, 2]) &
+                              (triangles[:, 2] != triangles[:, 0])]
+        if not len(triangles):
+            break
+
+    return triangles.ravel().astype(indices.dtype), float(np.sqrt(max(maxCost, 0.0)))
+
+
+def encodeLodSection(levels: List[np.ndarray], errors: List[float], center: np.ndarray, radius: float) -> bytes:
+    indices = narrowIndices(np.concatenate(levels)) if levels else np.zeros(0, '<u2')
+    chunks = [struct.pack('<II4f', len(levels), indices.itemsize, *center[:3], radius)]
+    firstIndex = 0
+    for level, error in zip(levels, errors):
+        chunks.append(struct.pack('<IIf', firstIndex, len(level), error))
+        firstIndex += len(level)
+    chunks.append(indices.tobytes())
+    return b''.join(chunks)
+
+
+def decodeLodSection(data: Any) -> Tuple[np.ndarray, float, List[LodLevel], np.ndarray]:
+    """
+    Returns the bounding sphere center and radius, the levels (not including level 0) and the index data of all levels.
+    """
+    levelCount, indexSize, x, y, z, radius = struct.unpack_from('<II4f', data, 0)
+    levels = [LodLevel(*struct.unpack_from('<IIf', data, 24 + 12 * i)) for i in range(levelCount)]
+    indices = np.frombuffer(data, '<u%i' % indexSize, offset=24 + 12 * levelCount)
+    return np.array((x, y, z), np.float32), radius, levels, indices
+
+
+def remapLodSection(data: Any, remap: np.ndarray) -> bytes:
+    # for passes that reorder the vertices, remap[oldIndex] = newIndex
+    center, radius, levels, indices = decodeLodSection(data)
+    indices = remap[indices]
+    return encodeLodSection([indices[level.firstIndex:level.firstIndex + level.indexCount] for level in levels],
+                            [level.error for level in levels], center, radius)
+
+
+def selectLevel(errors: Sequence[float], center: np.ndarray, radius: float, cameraPosition: np.ndarray,
+                projectionScale: float, viewportHeight: int, pixelError: float = 1.0) -> int:
+    """
+    Returns the coarsest level whose error is at most pixelError pixels on screen.
+    Errors are in the same space as center and radius, and must increase with the level.
+    projectionScale is element [1][1] of the projection matrix.
+    """
+    distance = float(np.linalg.norm(np.asarray(cameraPosition[:3], np.float64) - center[:3])) - radius
+    if distance <= 0.0:
+        return 0
+    pixelsPerUnit = projectionScale * viewportHeight * 0.5 / distance
+    level = 0
+    for i, error in enumerate(errors):
+        if error * pixelsPerUnit > pixelError:
+            break
+        level = i
+    return level
+
+
+class LodGenerator(object):
+    """
+    Mesh processor that adds a LOD section with a level for each of the given ratios of the original index count.
+    Levels that can't be simplified any further than the previous level are left out.
+    """
+
+    def __init__(self, ratios: Sequence[float] = (0.5, 0.25, 0.125)):
+        self.ratios: Tuple[float, ...] = tuple(ratios)
+
+    def __repr__(self):
+        return 'LodGenerator(ratios=%r)' % (self.ratios,)
+
+    def __call__(self, mesh: MeshData) -> MeshData:
+        positionAttribute = mesh.attribute(VertexAttribute.Semantic.POSITION)
+        if positionAttribute is None or positionAttribute.isPacked():
+            return mesh
+        positions = mesh.attributeArray(VertexAttribute.Semantic.POSITION)[:, :3].astype(np.float32)
+        center, radius = boundingSphere(positions)
+        indices = mesh.indexArray()
+        # levels are simplified from the previous level, with the quadrics of the original mesh
+        quadrics = planeQuadrics(indices, positions)
+        levels = []
+        errors = []
+        for ratio in self.ratios:
+            simplified, error = simplify(indices, positions, int(mesh.indexCount * ratio) // 3 * 3, quadrics)
+            if len(simplified) >= len(indices):
+                break
+            indices = simplified
+            levels.append(simplified)
+            errors.append(max(error, errors[-1] if errors else 0.0))
+        sections = dict(mesh.sections)
+        sections[LOD_SECTION] = encodeLodSection(levels, errors, center, radius)
+        return MeshData(mesh.name, mesh.materialName, mesh.attributeLayout, mesh.vertexData,
+                        mesh.indexData, mesh.indexSize, sections)
+
+
+def generateLodFile(source: str, target: str, ratios: Sequence[float] = (0.5, 0.25, 0.125)):
+    generator = LodGenerator(ratios)
+    with MeshFileReader(source) as reader:
+        writeMeshFile(target, [generator(reader.meshData(i)) for i in range(len(reader))], reader.exporter)
+
+
+if __name__ == '__main__':
+    import sys
+
+    generateLodFile(sys.argv[1], sys.argv[2], [float(arg) for arg in sys.argv[3:]] or (0.5, 0.25, 0.125))
@@ -0,0 +1,252 @@
+"""
+Meshlets: the triangles of a mesh split into small clusters, each with a bounding sphere and a cone around the
+normals of its triangles, so clusters outside the view or facing away from the camera can be skipped.
+
+The triangles of every meshlet are a contiguous range of the index buffer, so visible meshlets are drawn with
+ranged glDrawElements calls (adjacent visible meshlets merged into one), see Mesh.drawMeshlets.
+
+Use a MeshletBuilder as the last of the processors when loading (after MeshOptimizer, which reorders triangles),
+or build the meshlets offline with:
+python -m TTOpenGL.mesh_meshlet source.mesh target.mesh [maxVertices maxTriangles]
+
+Meshes with meshlets are only merged with other meshes with meshlets when loading, the meshlets of the merged mesh
+are those of its parts, with their first indices moved along with the index data.
+
+The meshlets are stored in the "MLET" section of a mesh:
+u32: number of meshlets
+u32: maximum number of vertices per meshlet
+u32: maximum number of triangles per meshlet
+for each meshlet:
+  u32: first index
+  u32: number of indices
+  f32[3]: bounding sphere center
+  f32: bounding sphere radius
+  f32[3]: cone axis, the average direction of the triangle normals
+  f32: cone cutoff, the sine of the angle between the axis and the normal furthest from it, 1 if the cone is
+       wider than a hemisphere (the meshlet can never be back-face culled)
+"""
+import struct
+from typing import *
+import numpy as np
+from .mesh_format import MeshData, MeshFileReader, writeMeshFile, positionArray
+
+MESHLET_SECTION = b'MLET'
+MESHLET_DTYPE = np.dtype([('firstIndex', '<u4'), ('indexCount', '<u4'), ('center', '<f4', 3), ('radius', '<f4'),
+                          ('coneAxis', '<f4', 3), ('coneCutoff', '<f4')])
+
+
+def _mortonCodes(points: np.ndarray) -> np.ndarray:
+    # 30 bit morton codes of points in their bounding box, 10 bits per axis
+    minimum = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0) - minimum, 1e-20)
+    cells = np.minimum((points - minimum) / extent * 1024.0, 1023.0).astype(np.uint32)
+    codes = np.zeros(len(points), np.uint32)
+    for axis in range(3):
+        # spread the 10 bits so there are 2 zero bits between each of them
+        v = cells[:, axis]
+        v = (v | (v << 16)) & 0x030000FF
+        v = (v | (v << 8)) & 0x0300F00F
+        v = (v | (v << 4)) & 0x030C30C3
+        v = (v | (v << 2)) & 0x09249249
+        codes |= v << axis
+    return codes
+
+
+def clusterTriangles(triangles: np.ndarray, maxVertices: int, maxTriangles: int) -> np.ndarray:
+    """
+    Greedily cuts the (N, 3) triangles into meshlets in their current order, a meshlet is closed when the next
+    triangle would exceed either limit. Returns the index of the first triangle of every meshlet.
+    """
+    assert maxVertices >= 3 and maxTriangles >= 1
+    vertexCount = int(triangles.max()) + 1 if len(triangles) else 0
+    # the meshlet that last used each vertex, so a vertex counts once per meshlet
+    usedBy = [-1] * vertexCount
+    starts = [0]
+    meshlet = 0
+    meshletVertices = 0
+    meshletTriangles = 0
+    for i, (a, b, c) in enumerate(triangles.tolist()):
+        added = (usedBy[a] != meshlet) + (usedBy[b] != meshlet) + (usedBy[c] != meshlet)
+        if meshletVertices + added > maxVertices or meshletTriangles == maxTriangles:
+            meshlet += 1
+            starts.append(i)
+            meshletVertices = 0
+            meshletTriangles = 0
+            added = len({a, b, c})
+        usedBy[a] = usedBy[b] = usedBy[c] = meshlet
+        meshletVertices += added
+        meshletTriangles += 1
+    return np.array(starts if len(triangles) else [], np.int64)
+
+
+def meshletBounds(triangles: np.ndarray, positions: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Returns the MESHLET_DTYPE records of meshlets that start at the given triangles.
+    """
+    records = np.zeros(len(starts), MESHLET_DTYPE)
+    if not len(starts):
+        return records
+    counts = np.diff(np.append(starts, len(triangles)))
+    records['firstIndex'] = starts * 3
+    records['indexCount'] = counts * 3
+
+    # spheres around the boxes of the corners
+    corners = positions[triangles.ravel()].astype(np.float64)
+    minimum = np.minimum.reduceat(corners, starts * 3, axis=0)
+    maximum = np.maximum.reduceat(corners, starts * 3, axis=0)
+    centers = (minimum + maximum) * 0.5
+    distances = np.linalg.norm(corners - np.repeat(centers, counts * 3, axis=0), axis=1)
+    records['center'] = centers
+    records['radius'] = np.maximum.reduceat(distances, starts * 3)
+
+    # cones around the normals, degenerate triangles don't have a direction and don't count
+    p0, p1, p2 = corners[0::3], corners[1::3], corners[2::3]
+    e1, e2 = p1 - p0, p2 - p0
+    normals = np.stack([e1[:, 1] * e2[:, 2] - e1[:, 2] * e2[:, 1],
+                        e1[:, 2] * e2[:, 0] - e1[:, 0] * e2[:, 2],
+                        e1[:, 0] * e2[:, 1] - e1[:, 1] * e2[:, 0]], axis=1)
+    lengths = np.linalg.norm(normals, axis=1)
+    degenerate = lengths <= 1e-20
+    normals /= np.where(degenerate, 1.0, lengths)[:, None]
+    axes = np.add.reduceat(normals, starts, axis=0)
+    axisLengths = np.linalg.norm(axes, axis=1)
+    axes /= np.maximum(axisLengths, 1e-20)[:, None]
+    dots = np.where(degenerate, 1.0, (normals * np.repeat(axes, counts, axis=0)).sum(axis=1))
+    smallestDot = np.minimum.reduceat(dots, starts)
+    cutoffs = np.sqrt(np.maximum(1.0 - smallestDot * smallestDot, 0.0))
+    records['coneAxis'] = axes
+    records['coneCutoff'] = np.where((smallestDot <= 0.0) | (axisLengths <= 1e-20), 1.0, cutoffs)
+    return records
+
+
+def buildMeshlets(indices: np.ndarray, positions: np.ndarray, maxVertices: int = 64,
+                  maxTriangles: int = 124) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reorders the triangles along a morton curve through their centroids, so the greedy clustering gives spatially
+    compact meshlets. Returns the reordered indices (same type as the input) and the meshlet records.
+    """
+    triangles = indices.reshape(-1, 3)
+    if len(triangles):
+        centroids = positions[triangles].mean(axis=1)
+        triangles = triangles[np.argsort(_mortonCodes(centroids), kind='stable')]
+    starts = clusterTriangles(triangles, maxVertices, maxTriangles)
+    return triangles.ravel(), meshletBounds(triangles, positions, starts)
+
+
+def encodeMeshletSection(records: np.ndarray, maxVertices: int, maxTriangles: int) -> bytes:
+    return struct.pack('<III', len(records), maxVertices, maxTriangles) + records.astype(MESHLET_DTYPE).tobytes()
+
+
+def decodeMeshletSection(data: Any) -> np.ndarray:
+    count, _, _ = struct.unpack_from('<III', data, 0)
+    return np.frombuffer(data, MESHLET_DTYPE, count, 12)
+
+
+def mergeMeshletSections(sections: Sequence[Any], firstIndices: Sequence[int]) -> bytes:
+    """
+    Returns the meshlet section of meshes whose index data was concatenated, firstIndices is where the indices of
+    every mesh start in the merged index data. The limits are the largest of the merged sections.
+    """
+    headers = [struct.unpack_from('<III', section, 0) for section in sections]
+    records = []
+    for section, firstIndex in zip(sections, firstIndices):
+        meshlets = decodeMeshletSection(section).copy()
+        meshlets['firstIndex'] += np.uint32(firstIndex)
+        records.append(meshlets)
+    return encodeMeshletSection(np.concatenate(records), max(header[1] for header in headers),
+                                max(header[2] for header in headers))
+
+
+class Meshlets(object):
+    """
+    Object space meshlet bounds of one mesh, laid out for culling them all at once.
+    """
+
+    def __init__(self, records: np.ndarray):
+        self.firstIndices: np.ndarray = records['firstIndex'].astype(np.int64)
+        self.indexCounts: np.ndarray = records['indexCount'].astype(np.int64)
+        self.centers: np.ndarray = np.ascontiguousarray(records['center'], np.float32)
+        self.radii: np.ndarray = np.ascontiguousarray(records['radius'], np.float32)
+        self.coneAxes: np.ndarray = np.ascontiguousarray(records['coneAxis'], np.float32)
+        self.coneCutoffs: np.ndarray = np.ascontiguousarray(records['coneCutoff'], np.float32)
+
+    def __len__(self):
+        return len(self.firstIndices)
+
+    @property
+    def indexCount(self) -> int:
+        return int(self.indexCounts.sum())
+
+    def backFacing(self, cameraPosition: np.ndarray) -> np.ndarray:
+        """
+        Returns a bool mask of the meshlets whose triangles all face away from the camera, from anywhere in their
+        bounding sphere, with the camera position in the same space as the meshlets.
+        """
+        offsets = self.centers - np.asarray(cameraPosition[:3], np.float32)
+        distances = np.sqrt(np.einsum('ij,ij->i', offsets, offsets))
+        return np.einsum('ij,ij->i', offsets, self.coneAxes) >= self.coneCutoffs * distances + self.radii
+
+    def visibilityMask(self, planes: np.ndarray, cameraPosition: Optional[np.ndarray] = None) -> np.ndarray:
+        # frustum culling against planes in the space of the meshlets, and cone culling if a camera position is given
+        # culling needs MMath through camera, meshlets can be built without it
+        from .culling import cullSpheres
+        visible = cullSpheres(planes, self.centers, self.radii)
+        if cameraPosition is not None:
+            visible &= ~self.backFacing(cameraPosition)
+        return visible
+
+    def ranges(self, visible: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the first indices and index counts to draw the visible meshlets, meshlets next to each other in
+        the index buffer are drawn with one range.
+        """
+        meshlets = np.flatnonzero(visible)
+        if not len(meshlets):
+            return meshlets, meshlets
+        breaks = np.flatnonzero(np.diff(meshlets) != 1)
+        firsts = meshlets[np.concatenate([[0], breaks + 1])]
+        lasts = meshlets[np.append(breaks, len(meshlets) - 1)]
+        starts = self.firstIndices[firsts]
+        return starts, self.firstIndices[lasts] + self.indexCounts[lasts] - starts
+
+
+def meshMeshlets(mesh: MeshData) -> Optional[Meshlets]:
+    if MESHLET_SECTION not in mesh.sections:
+        return None
+    return Meshlets(decodeMeshletSection(mesh.sections[MESHLET_SECTION]))
+
+
+class MeshletBuilder(object):
+    """
+    Mesh processor that reorders the triangles into meshlets and adds a meshlet section.
+    Meshes without positions we can read are returned as they are.
+    """
+
+    def __init__(self, maxVertices: int = 64, maxTriangles: int = 124):
+        self.maxVertices: int = maxVertices
+        self.maxTriangles: int = maxTriangles
+
+    def __repr__(self):
+        return 'MeshletBuilder(maxVertices=%i, maxTriangles=%i)' % (self.maxVertices, self.maxTriangles)
+
+    def __call__(self, mesh: MeshData) -> MeshData:
+        positions = positionArray(mesh)
+        if positions is None:
+            return mesh
+        indices, records = buildMeshlets(mesh.indexArray(), positions, self.maxVertices, self.maxTriangles)
+        sections = dict(mesh.sections)
+        sections[MESHLET_SECTION] = encodeMeshletSection(records, self.maxVertices, self.maxTriangles)
+        return MeshData(mesh.name, mesh.materialName, mesh.attributeLayout, mesh.vertexData,
+                        indices, mesh.indexSize, sections)
+
+
+def generateMeshletFile(source: str, target: str, maxVertices: int = 64, maxTriangles: int = 124):
+    builder = MeshletBuilder(maxVertices, maxTriangles)
+    with MeshFileReader(source) as reader:
+        writeMeshFile(target, [builder(reader.meshData(i)) for i in range(len(reader))], reader.exporter)
+
+
+if __name__ == '__main__':
+    import sys
+
+    generateMeshletFile(sys.argv[1], sys.argv[2], *(int(arg) for arg in sys.argv[3:5]))
@@ -0,0 +1,243 @@
+"""
+Reorders triangle lists for the GPU's post-transform vertex cache, and optionally to reduce overdraw,
+then reorders the vertices to the order in which the indices first use them.
+
+Use a MeshOptimizer as one of the processors when loading, or optimize files offline with:
+python -m TTOpenGL.mesh_optimize source.mesh target.mesh [--overdraw]
+
+ACMR is the average number of vertex shader invocations per triangle (0.5 is ideal for a large grid, 3 is the worst).
+ATVR is the number of invocations per unique vertex (1 is ideal).
+Both are measured with a FIFO cache, which is the conservative model for most hardware.
+"""
+import collections
+from typing import *
+import numpy as np
+from .mesh_format import VertexAttribute, MeshData, MeshFileReader, writeMeshFile
+from .mesh_lod import LOD_SECTION, remapLodSection
+from .mesh_meshlet import MESHLET_SECTION
+
+
+class VertexCacheStats(NamedTuple):
+    acmr: float
+    atvr: float
+
+
+class OptimizationReport(NamedTuple):
+    name: str
+    before: VertexCacheStats
+    after: VertexCacheStats
+
+    def __str__(self):
+        return '%s: ACMR %.3f -> %.3f, ATVR %.3f -> %.3f' % (self.name, self.before.acmr, self.after.acmr,
+                                                             self.before.atvr, self.after.atvr)
+
+
+def _fifoMisses(indices: np.ndarray, cacheSize: int) -> np.ndarray:
+    # returns for every index whether it missed the simulated cache
+    cache = collections.deque()
+    cached = set()
+    misses = []
+    for vertex in indices.tolist():
+        if vertex in cached:
+            misses.append(False)
+            continue
+        misses.append(True)
+        cache.append(vertex)
+        cached.add(vertex)
+        if len(cache) > cacheSize:
+            cached.discard(cache.popleft())
+    return np.array(misses, bool)
+
+
+def analyzeVertexCache(indices: np.ndarray, cacheSize: int = 32) -> VertexCacheStats:
+    if not len(indices):
+        return VertexCacheStats(0.0, 0.0)
+    misses = int(_fifoMisses(indices, cacheSize).sum())
+    return VertexCacheStats(misses / (len(indices) // 3), misses / len(np.unique(indices)))
+
+
+# scoring constants from Tom Forsyth's "Linear-Speed Vertex Cache Optimisation"
+_CACHE_DECAY_POWER = 1.5
+_LAST_TRIANGLE_SCORE = 0.75
+_VALENCE_BOOST_SCALE = 2.0
+_VALENCE_BOOST_POWER = 0.5
+
+
+def optimizeVertexCache(indices: np.ndarray, vertexCount: int, cacheSize: int = 32) -> np.ndarray:
+    """
+    Reorders the triangles (not the vertices) for locality in an LRU cache of the given size, using Forsyth's algorithm.
+    Returns a new index array of the same type.
+    """
+    triangleCount = len(indices) // 3
+    if triangleCount < 2:
+        return indices.copy()
+    flat = indices.astype(np.int64)
+
+    # per vertex list of triangles that still need to be emitted, laid out back to back,
+    # the first live[v] entries after offsets[v] are the triangles that are left
+    valence = np.bincount(flat, minlength=vertexCount)
+    offsets = (np.cumsum(valence) - valence).tolist()
+    adjacency = (np.argsort(flat, kind='stable') // 3).tolist()
+    live = valence.tolist()
+    triangles = flat.reshape(-1, 3).tolist()
+
+    cacheScores = [_LAST_TRIANGLE_SCORE] * 3 + [(1.0 - i / (cacheSize - 3)) ** _CACHE_DECAY_POWER
+                                               for i in range(cacheSize - 3)]
+    valenceScores = [0.0] + [_VALENCE_BOOST_SCALE * v ** -_VALENCE_BOOST_POWER for v in range(1, int(valence.max()) + 1)]
+
+    vertexScores = [valenceScores[v] for v in live]
+    triangleScores = [vertexScores[a] + vertexScores[b] + vertexScores[c] for a, b, c in triangles]
+    emitted = [False] * triangleCount
+    cachePositions = [-1] * vertexCount
+    cache = []
+
+    order = []
+    best = int(np.argmax(triangleScores))
+    fallback = 0
+    for _ in range(triangleCount):
+        if best == -1:
+            # dead end, no cached vertex has triangles left, continue with the next triangle in the input
+            while emitted[fallback]:
+                fallback += 1
+            best = fallback
+        order.append(best)
+        emitted[best] = True
+        triangle = triangles[best]
+
+        for vertex in triangle:
+            start = offsets[vertex]
+            end = start + live[vertex] - 1
+            for k in range(start, end + 1):
+                if adjacency[k] == best:
+                    adjacency[k] = adjacency[end]
+                    adjacency[end] = best
+                    break
+            live[vertex] -= 1
+
+        a, b, c = triangle
+        touched = triangle + [vertex for vertex in cache if vertex != a and vertex != b and vertex != c]
+        for position, vertex in enumerate(touched):
+            if position < cacheSize:
+                cachePositions[vertex] = position
+                score = cacheScores[position]
+            else:
+                cachePositions[vertex] = -1
+                score = 0.0
+            valence = live[vertex]
+            vertexScores[vertex] = score + valenceScores[valence] if valence else -1.0
+        cache = touched[:cacheSize]
+
+        best = -1
+        bestScore = -1.0
+        for vertex in touched:
+            start = offsets[vertex]
+            for k in range(start, start + live[vertex]):
+                t = adjacency[k]
+                a, b, c = triangles[t]
+                score = vertexScores[a] + vertexScores[b] + vertexScores[c]
+                triangleScores[t] = score
+                if score > bestScore:
+                    best = t
+                    bestScore = score
+
+    return indices.reshape(-1, 3)[np.array(order)].ravel()
+
+
+def optimizeOverdraw(indices: np.ndarray, positions: np.ndarray, cacheSize: int = 32) -> np.ndarray:
+    """
+    Splits the triangles into clusters where the vertex cache is cold anyway (all 3 vertices miss),
+    so the vertex cache efficiency stays the same, then orders the clusters so the ones on the outside
+    of the mesh that face outwards are drawn first and occlude the rest.
+    Expects cache optimized indices, returns a new index array of the same type.
+    """
+    triangleCount = len(indices) // 3
+    if triangleCount < 2:
+        return indices.copy()
+    misses = _fifoMisses(indices, cacheSize).reshape(-1, 3).sum(axis=1)
+    starts = np.flatnonzero(misses == 3)
+    if not len(starts) or starts[0] != 0:
+        starts = np.concatenate([[0], starts])
+
+    corners = positions[indices.astype(np.int64)].reshape(-1, 3, 3).astype(np.float64)
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])  # length is twice the area
+    areas = np.linalg.norm(normals, axis=1)
+    centroids = corners.mean(axis=1)
+    meshCentroid = (centroids * areas[:, None]).sum(axis=0) / max(areas.sum(), 1e-20)
+
+    clusterNormals = np.add.reduceat(normals, starts)
+    clusterNormals /= np.maximum(np.linalg.norm(clusterNormals, axis=1), 1e-20)[:, None]
+    clusterAreas = np.maximum(np.add.reduceat(areas, starts), 1e-20)
+    clusterCentroids = np.add.reduceat(centroids * areas[:, None], starts) / clusterAreas[:, None]
+    keys = np.einsum('ij,ij->i', clusterCentroids - meshCentroid, clusterNormals)
+
+    clusterOrder = np.argsort(-keys, kind='stable')
+    lengths = np.diff(np.append(starts, triangleCount))[clusterOrder]
+    firsts = starts[clusterOrder]
+    # concatenate the triangle ranges of all clusters in the new order
+    triangleOrder = np.arange(triangleCount) + np.repeat(firsts - (np.cumsum(lengths) - lengths), lengths)
+    return indices.reshape(-1, 3)[triangleOrder].ravel()
+
+
+def optimizeVertexFetch(mesh: MeshData) -> MeshData:
+    """
+    Reorders the vertices in the order the index buffer first references them, unreferenced vertices are dropped.
+    Level of detail indices are remapped too, but their vertices must also be used by the regular indices.
+    """
+    indices = mesh.indexArray()
+    unique, firstUse = np.unique(indices, return_index=True)
+    used = unique[np.argsort(firstUse, kind='stable')]
+    remap = np.zeros(mesh.vertexCount, indices.dtype)
+    remap[used] = np.arange(len(used))
+    vertices = np.frombuffer(mesh.vertexData, np.uint8).reshape(-1, mesh.stride)[used]
+    sections = dict(mesh.sections)
+    if LOD_SECTION in sections:
+        sections[LOD_SECTION] = remapLodSection(sections[LOD_SECTION], remap)
+    return MeshData(mesh.name, mesh.materialName, mesh.attributeLayout, vertices.ravel(), remap[indices],
+                    mesh.indexSize, sections)
+
+
+class MeshOptimizer(object):
+    """
+    Mesh processor that runs the vertex cache, (optionally) overdraw and vertex fetch optimizations.
+    The ACMR/ATVR before and after of every processed mesh is appended to reports.
+    Forsyth's algorithm is a Python loop, so for big meshes prefer optimizing the files offline.
+    """
+
+    def __init__(self, cacheSize: int = 32, overdraw: bool = False):
+        self.cacheSize: int = cacheSize
+        self.overdraw: bool = overdraw
+        self.reports: List[OptimizationReport] = []
+
+    def __repr__(self):
+        return 'MeshOptimizer(cacheSize=%i, overdraw=%s)' % (self.cacheSize, self.overdraw)
+
+    def __call__(self, mesh: MeshData) -> MeshData:
+        indices = mesh.indexArray()
+        before = analyzeVertexCache(indices, self.cacheSize)
+        indices = optimizeVertexCache(indices, mesh.vertexCount, self.cacheSize)
+        positionAttribute = mesh.attribute(VertexAttribute.Semantic.POSITION)
+        if self.overdraw and positionAttribute is not None and not positionAttribute.isPacked():
+            positions = mesh.attributeArray(VertexAttribute.Semantic.POSITION)[:, :3].astype(np.float32)
+            indices = optimizeOverdraw(indices, positions, self.cacheSize)
+        # meshlets are ranges of the triangle order we just changed
+        sections = {tag: data for tag, data in mesh.sections.items() if tag != MESHLET_SECTION}
+        mesh = MeshData(mesh.name, mesh.materialName, mesh.attributeLayout, mesh.vertexData, indices,
+                        mesh.indexSize, sections)
+        mesh = optimizeVertexFetch(mesh)
+        self.reports.append(OptimizationReport(mesh.name, before, analyzeVertexCache(mesh.indexArray(), self.cacheSize)))
+        return mesh
+
+
+def optimizeMeshFile(source: str, target: str, cacheSize: int = 32, overdraw: bool = False) -> List[OptimizationReport]:
+    optimizer = MeshOptimizer(cacheSize, overdraw)
+    with MeshFileReader(source) as reader:
+        meshes = [optimizer(reader.meshData(i)) for i in range(len(reader))]
+        writeMeshFile(target, meshes, reader.exporter)
+    return optimizer.reports
+
+
+if __name__ == '__main__':
+    import sys
+
+    for report in optimizeMeshFile(sys.argv[1], sys.argv[2], overdraw='--overdraw' in sys.argv[3:]):
+        print(report)
@@ -0,0 +1,186 @@
+"""
+Many meshes with the same attribute layout in one vertex and one index buffer, drawn with a single
+glMultiDrawElementsIndirect call instead of a bind and a draw call per mesh.
+
+Every mesh is a PooledMesh handle with its range in the shared buffers, the indices are not rebased, the draw
+commands carry the base vertex instead. The pool keeps the ranges and bounds of all meshes in arrays, so the draw
+commands of the visible meshes are built without a Python loop:
+
+pool = GeometryPool(layout, vertexCapacity=1 << 20, indexCapacity=1 << 22)
+handles = pool.addFile('props.mesh')
+every frame:
+    visible = cullBoxes(frustumPlanes(camera, aspectRatio), pool.minimums, pool.maximums)
+    pool.draw(visible)
+
+Meshes without bounds have an empty box at the origin and are in pool.unbounded, draw adds them to any selection.
+
+The base instance of every command is the index of its mesh in the pool, so shaders can look up per-mesh data with
+gl_BaseInstance (GL 4.6 or ARB_shader_draw_parameters), gl_InstanceID starts at 0 for every mesh.
+Meshes are added for the lifetime of the pool, levels of detail and meshlets are not used.
+"""
+from typing import *
+import numpy as np
+from OpenGL.GL import *
+from .mesh import Buffer, Mesh, VertexArrayCache
+from .mesh_format import VertexAttribute, MeshData, MeshFileReader, MeshProcessor, Bounds, processMeshData, \
+    meshBounds
+
+# the layout of glMultiDrawElementsIndirect commands
+DRAW_COMMAND_DTYPE = np.dtype([('count', '<u4'), ('instanceCount', '<u4'), ('firstIndex', '<u4'),
+                               ('baseVertex', '<i4'), ('baseInstance', '<u4')])
+
+
+class PooledMesh(NamedTuple):
+    # a mesh in a GeometryPool, index is its position in the pool arrays
+    index: int
+    name: str
+    materialName: str
+    firstIndex: int
+    indexCount: int
+    baseVertex: int
+    vertexCount: int
+    bounds: Optional[Bounds]
+
+
+class GeometryPool(object):
+    def __init__(self, attributeLayout: Iterable[VertexAttribute], vertexCapacity: int, indexCapacity: int,
+                 vertexArrays: Optional[VertexArrayCache] = None):
+        # capacities are in vertices and in (32 bit) indices, the buffers don't grow
+        self.attributeLayout: List[VertexAttribute] = list(attributeLayout)
+        self.stride: int = sum(va.sizeInBytes() for va in self.attributeLayout)
+        self.vertexCapacity: int = vertexCapacity
+        self.indexCapacity: int = indexCapacity
+        vertexBuffer = Buffer(GL_ARRAY_BUFFER, vertexCapacity * self.stride)
+        indexBuffer = Buffer(GL_ELEMENT_ARRAY_BUFFER, indexCapacity * 4)
+        self._mesh: Mesh = Mesh(self.attributeLayout, vertexBuffer, indexBuffer, indexType=GL_UNSIGNED_INT,
+                                vertexArrays=vertexArrays)
+        self._commandBuffer: Optional[Buffer] = None
+        self._vertexCount: int = 0
+        self._indexCount: int = 0
+
+        self.meshes: List[PooledMesh] = []
+        self._firstIndices: List[int] = []
+        self._indexCounts: List[int] = []
+        self._baseVertices: List[int] = []
+        self._minimums: List[np.ndarray] = []
+        self._maximums: List[np.ndarray] = []
+        self._unbounded: List[bool] = []
+        # the above as arrays, rebuilt when meshes were added
+        self._arrays: Optional[Tuple[np.ndarray, ...]] = None
+
+    def __len__(self):
+        return len(self.meshes)
+
+    @property
+    def vertexCount(self) -> int:
+        return self._vertexCount
+
+    @property
+    def indexCount(self) -> int:
+        return self._indexCount
+
+    def add(self, mesh: MeshData) -> PooledMesh:
+        assert mesh.attributeLayout == self.attributeLayout, \
+            f'Mesh "{mesh.name}" has layout {mesh.attributeLayout}, the pool has {self.attributeLayout}.'
+        vertexCount, indexCount = mesh.vertexCount, mesh.indexCount
+        assert self._vertexCount + vertexCount <= self.vertexCapacity, f'Mesh "{mesh.name}" does not fit in the pool vertices.'
+        assert self._indexCount + indexCount <= self.indexCapacity, f'Mesh "{mesh.name}" does not fit in the pool indices.'
+        self._mesh.vertexBuffer.update(mesh.vertexData, self._vertexCount * self.stride)
+        self._mesh.indexBuffer.update(mesh.indexArray().astype('<u4'), self._indexCount * 4)
+
+        bounds = meshBounds(mesh)
+        handle = PooledMesh(len(self.meshes), mesh.name, mesh.materialName, self._indexCount, indexCount,
+                            self._vertexCount, vertexCount, bounds)
+        self.meshes.append(handle)
+        self._firstIndices.append(self._indexCount)
+        self._indexCounts.append(indexCount)
+        self._baseVertices.append(self._vertexCount)
+        # meshes without bounds are never culled, infinite boxes would give nan centers and be culled always
+        self._minimums.append(bounds.minimum if bounds is not None else np.zeros(3, np.float32))
+        self._maximums.append(bounds.maximum if bounds is not None else np.zeros(3, np.float32))
+        self._unbounded.append(bounds is None)
+        self._arrays = None
+        self._vertexCount += vertexCount
+        self._indexCount += indexCount
+        return handle
+
+    def addFile(self, path: str, processors: Sequence[MeshProcessor] = ()) -> List[PooledMesh]:
+        # adds every mesh in the file, without merging them
+        with MeshFileReader(path, True) as reader:
+            return [self.add(processMeshData(reader.meshData(i), processors)) for i in range(len(reader))]
+
+    def _poolArrays(self) -> Tuple[np.ndarray, ...]:
+        if self._arrays is None:
+            self._arrays = (np.array(self._firstIndices, np.uint32), np.array(self._indexCounts, np.uint32),
+                            np.array(self._baseVertices, np.int32),
+                            np.array(self._minimums, np.float32).reshape(-1, 3),
+                            np.array(self._maximums, np.float32).reshape(-1, 3),
+                            np.array(self._unbounded, bool))
+        return self._arrays
+
+    @property
+    def minimums(self) -> np.ndarray:
+        # (N, 3) bounding box minimums of all meshes, for culling.cullBoxes
+        return self._poolArrays()[3]
+
+    @property
+    def maximums(self) -> np.ndarray:
+        return self._poolArrays()[4]
+
+    @property
+    def unbounded(self) -> np.ndarray:
+        # bool mask of the meshes without bounds, drawCommands adds them to every selection
+        return self._poolArrays()[5]
+
+    def drawCommands(self, selection: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Returns the DRAW_COMMAND_DTYPE commands of the selected meshes, a bool mask or indices, None selects all.
+        Meshes without bounds are always selected.
+        """
+        firstIndices, indexCounts, baseVertices, _, _, unbounded = self._poolArrays()
+        meshes = np.arange(len(self.meshes)) if selection is None else np.asarray(selection)
+        if meshes.dtype == bool:
+            meshes = np.flatnonzero(meshes | unbounded)
+        elif unbounded.any():
+            meshes = np.union1d(meshes.astype(np.int64), np.flatnonzero(unbounded))
+        commands = np.empty(len(meshes), DRAW_COMMAND_DTYPE)
+        commands['count'] = indexCounts[meshes]
+        commands['instanceCount'] = 1
+        commands['firstIndex'] = firstIndices[meshes]
+        commands['baseVertex'] = baseVertices[meshes]
+        commands['baseInstance'] = meshes
+        return commands
+
+    def drawIndirect(self, commands: np.ndarray):
+        # submits DRAW_COMMAND_DTYPE commands, e.g. from drawCommands with the instance counts changed
+        if not len(commands):
+            return
+        commands = np.ascontiguousarray(commands, DRAW_COMMAND_DTYPE)
+        # the command buffer only grows, so it is reused as long as the visible meshes fit
+        if self._commandBuffer is None or self._commandBuffer.size < commands.nbytes:
+            if self._commandBuffer is not None:
+                self._commandBuffer.delete()
+            self._commandBuffer = Buffer(GL_DRAW_INDIRECT_BUFFER,
+                                         max(commands.nbytes, len(self.meshes) * DRAW_COMMAND_DTYPE.itemsize),
+                                         GL_STREAM_DRAW)
+        # orphaned, so we don't wait for the previous frame's draws to read their commands
+        self._commandBuffer.update(commands, orphan=True)
+        self._mesh.bind()
+        self._commandBuffer.bind()
+        glMultiDrawElementsIndirect(self._mesh.mode, GL_UNSIGNED_INT, None, len(commands), 0)
+        self._commandBuffer.unbind()
+
+    def draw(self, selection: Optional[np.ndarray] = None) -> int:
+        """
+        Draws the selected meshes (a bool mask or indices, None draws all) with one call.
+        Returns the number of meshes drawn.
+        """
+        commands = self.drawCommands(selection)
+        self.drawIndirect(commands)
+        return len(commands)
+
+    def delete(self):
+        self._mesh.delete()
+        if self._commandBuffer is not None:
+            self._commandBuffer.delete()
+            self._commandBuffer = None
@@ -0,0 +1,192 @@
+"""
+Converts float vertex attributes to smaller types.
+Use quantizeMeshData as one of the processors when loading a mesh, or convert files offline with:
+python -m TTOpenGL.mesh_quantize source.mesh target.mesh
+
+Every encoded attribute is padded to a multiple of 4 bytes, missing components get the values
+OpenGL would use for them (0, 0, 0, 1) so shaders can keep using the same vertex inputs.
+The only exception is Octahedral, which needs octahedralDecode from OCTAHEDRAL_GLSL in the shader.
+"""
+import enum
+from typing import *
+import numpy as np
+from .mesh_format import VertexAttribute, MeshData, MeshFileReader, writeMeshFile
+
+
+class Encoding(enum.Enum):
+    Float = 0  # leave the attribute as-is
+    HalfFloat = 1
+    UNorm8 = 2
+    SNorm8 = 3
+    UNorm16 = 4
+    SNorm16 = 5
+    UInt8 = 6  # whole numbers such as joint ids, not normalized
+    UInt16 = 7
+    Packed2101010 = 8  # signed normalized xyz in 10 bits each and w in 2 bits, meant for unit vectors
+    Octahedral = 9  # unit vectors as 2 signed normalized shorts, must be decoded in the shader
+
+
+OCTAHEDRAL_GLSL = '''
+vec3 octahedralDecode(vec2 e) {
+    vec3 n = vec3(e, 1.0 - abs(e.x) - abs(e.y));
+    float t = max(-n.z, 0.0);
+    n.xy += vec2(n.x >= 0.0 ? -t : t, n.y >= 0.0 ? -t : t);
+    return normalize(n);
+}
+'''
+
+
+def defaultEncodings() -> Dict[VertexAttribute.Semantic, Encoding]:
+    # these are all decoded by the vertex fetch, so existing shaders keep working
+    S = VertexAttribute.Semantic
+    encodings = {
+        S.POSITION: Encoding.Float,
+        S.NORMAL: Encoding.Packed2101010,
+        S.TANGENT: Encoding.Packed2101010,
+        S.BLENDINDICES: Encoding.UInt16,
+        S.BLENDWEIGHT: Encoding.UNorm8,
+    }
+    for semantic in S:
+        if semantic.name.startswith('TEXCOORD') or semantic.name.startswith('COLOR'):
+            encodings[semantic] = Encoding.HalfFloat
+    return encodings
+
+
+def _pad(values: np.ndarray, components: int) -> np.ndarray:
+    count, current = values.shape
+    if current >= components:
+        return values
+    defaults = np.array((0.0, 0.0, 0.0, 1.0), values.dtype)[current:components]
+    return np.concatenate([values, np.broadcast_to(defaults, (count, components - current))], axis=1)
+
+
+def _alignedComponents(components: int, itemSize: int) -> int:
+    while (components * itemSize) % 4:
+        components += 1
+    return components
+
+
+def _encodeHalfFloat(values: np.ndarray) -> Tuple[np.ndarray, VertexAttribute.Type, bool]:
+    return values.astype('<f2'), VertexAttribute.Type.HalfFloat, False
+
+
+def _encodeNormalized(dtype: str, signed: bool):
+    def encode(values: np.ndarray) -> Tuple[np.ndarray, VertexAttribute.Type, bool]:
+        limit = np.iinfo(dtype).max
+        clipped = np.clip(values, -1.0 if signed else 0.0, 1.0)
+        return np.round(clipped * limit).astype(dtype), _types[dtype], True
+
+    return encode
+
+
+def _encodeInteger(dtype: str):
+    def encode(values: np.ndarray) -> Tuple[np.ndarray, VertexAttribute.Type, bool]:
+        rounded = np.round(values)
+        info = np.iinfo(dtype)
+        if rounded.size and (rounded.min() < info.min or rounded.max() > info.max):
+            raise ValueError(f'Attribute values do not fit in {dtype}.')
+        return rounded.astype(dtype), _types[dtype], False
+
+    return encode
+
+
+_types = {
+    'u1': VertexAttribute.Type.UnsignedByte,
+    'i1': VertexAttribute.Type.Byte,
+    '<u2': VertexAttribute.Type.UnsignedShort,
+    '<i2': VertexAttribute.Type.Short,
+}
+
+_componentEncoders = {
+    Encoding.HalfFloat: (2, _encodeHalfFloat),
+    Encoding.UNorm8: (1, _encodeNormalized('u1', False)),
+    Encoding.SNorm8: (1, _encodeNormalized('i1', True)),
+    Encoding.UNorm16: (2, _encodeNormalized('<u2', False)),
+    Encoding.SNorm16: (2, _encodeNormalized('<i2', True)),
+    Encoding.UInt8: (1, _encodeInteger('u1')),
+    Encoding.UInt16: (2, _encodeInteger('<u2')),
+}
+
+
+def packSNorm2101010(values: np.ndarray) -> np.ndarray:
+    """
+    Packs (N, 3) or (N, 4) floats in [-1, 1] into N uint32 for VertexAttribute.Type.Int2101010Rev.
+    When there is no w it is set to 1, otherwise it is rounded to -1, 0 or 1.
+    """
+    xyz = np.round(np.clip(values[:, :3], -1.0, 1.0) * 511.0).astype(np.int32) & 0x3FF
+    if values.shape[1] > 3:
+        w = np.clip(np.round(values[:, 3]), -1.0, 1.0).astype(np.int32) & 0x3
+    else:
+        w = np.ones(len(values), np.int32)
+    xyz = xyz.astype(np.uint32)
+    return xyz[:, 0] | (xyz[:, 1] << 10) | (xyz[:, 2] << 20) | (w.astype(np.uint32) << 30)
+
+
+def octahedralEncode(values: np.ndarray) -> np.ndarray:
+    """
+    Maps (N, 3) unit vectors to (N, 2) points in [-1, 1], see OCTAHEDRAL_GLSL for the inverse.
+    """
+    xyz = values[:, :3].astype(np.float32)
+    xyz = xyz / np.maximum(np.abs(xyz).sum(axis=1, keepdims=True), 1e-20)
+    result = xyz[:, :2].copy()
+    lower = xyz[:, 2] < 0.0
+    signs = np.where(result[lower] >= 0.0, 1.0, -1.0)
+    result[lower] = (1.0 - np.abs(result[lower][:, ::-1])) * signs
+    return result
+
+
+def _encode(attribute: VertexAttribute, values: np.ndarray, encoding: Encoding) -> Tuple[VertexAttribute, np.ndarray]:
+    values = values.astype(np.float32)
+    if encoding == Encoding.Packed2101010:
+        if values.shape[1] < 3:
+            raise ValueError(f'Can not pack {attribute} as a 3 or 4 component vector.')
+        return (VertexAttribute(attribute.semantic, VertexAttribute.Size.Vec4, VertexAttribute.Type.Int2101010Rev, True),
+                packSNorm2101010(values)[:, None])
+    if encoding == Encoding.Octahedral:
+        if values.shape[1] < 3:
+            raise ValueError(f'Can not octahedral encode {attribute}, it is not a 3D vector.')
+        values, encoding = octahedralEncode(values), Encoding.SNorm16
+    itemSize, encoder = _componentEncoders[encoding]
+    values = _pad(values, _alignedComponents(values.shape[1], itemSize))
+    encoded, type, normalized = encoder(values)
+    return VertexAttribute(attribute.semantic, encoded.shape[1], type, normalized), encoded
+
+
+def quantizeMeshData(mesh: MeshData, encodings: Optional[Dict[VertexAttribute.Semantic, Encoding]] = None) -> MeshData:
+    """
+    Returns a copy of the mesh with its float attributes encoded as given, attributes that are
+    not float or not in encodings are copied as-is. By default defaultEncodings() is used.
+    """
+    if encodings is None:
+        encodings = defaultEncodings()
+    attributeLayout = []
+    columns = []
+    for va in mesh.attributeLayout:
+        values = mesh.attributeArray(va.semantic)
+        encoding = encodings.get(va.semantic, Encoding.Float)
+        if va.type != VertexAttribute.Type.Float or encoding == Encoding.Float:
+            attributeLayout.append(va)
+            columns.append(values)
+            continue
+        va, values = _encode(va, values, encoding)
+        attributeLayout.append(va)
+        columns.append(values)
+
+    stride = sum(va.sizeInBytes() for va in attributeLayout)
+    result = MeshData(mesh.name, mesh.materialName, attributeLayout, np.zeros(mesh.vertexCount * stride, np.uint8),
+                      mesh.indexData, mesh.indexSize, dict(mesh.sections))
+    for va, values in zip(attributeLayout, columns):
+        result.attributeArray(va.semantic)[:] = values
+    return result
+
+
+def quantizeMeshFile(source: str, target: str, encodings: Optional[Dict[VertexAttribute.Semantic, Encoding]] = None):
+    with MeshFileReader(source) as reader:
+        meshes = [quantizeMeshData(reader.meshData(i), encodings) for i in range(len(reader))]
+        writeMeshFile(target, meshes, reader.exporter)
+
+
+if __name__ == '__main__':
+    import sys
+
+    quantizeMeshFile(sys.argv[1], sys.argv[2])
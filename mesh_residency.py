@@ -0,0 +1,197 @@
+"""
+Keeps the meshes of large worlds within a GPU memory budget.
+
+Meshes are registered by their .mesh file, only the table of contents and the bounds are read up front.
+Drawing a mesh that is not on the GPU counts as a miss and queues it; every frame update() loads the queued meshes
+closest to the camera first, evicting the meshes that were drawn least recently to stay within the budget.
+Meshes drawn in the last frame are never evicted, so a budget that is too small shows up as misses.
+
+residency = MeshResidency(budgetBytes=512 * 1024 * 1024)
+handles = residency.addFile('world.mesh')
+every frame:
+    residency.update(cameraPosition)
+    for handle in handles:
+        residency.draw(handle)
+print(residency.stats)
+"""
+from typing import *
+import numpy as np
+from .mesh import Mesh, MeshFile
+from .mesh_format import Bounds, MeshProcessor, BOUNDS_SECTION
+
+
+class ResidencyStats(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    loads: int
+    residentBytes: int
+    budgetBytes: int
+
+
+class ResidentMesh(object):
+    """
+    A mesh that can be loaded from and evicted back to its file, mesh is None while it is not on the GPU.
+    """
+
+    def __init__(self, path: str, index: int, name: str, materialName: str, bounds: Optional[Bounds],
+                 processors: Sequence[MeshProcessor]):
+        self.path: str = path
+        self.index: int = index
+        self.name: str = name
+        self.materialName: str = materialName
+        # world space bounds, for the load order
+        self.bounds: Optional[Bounds] = bounds
+        self.processors: Tuple[MeshProcessor, ...] = tuple(processors)
+        self.mesh: Optional[Mesh] = None
+        self.lastDrawnFrame: int = -1
+
+    def __repr__(self):
+        return 'ResidentMesh(%r, %r, %s)' % (self.path, self.name, 'resident' if self.mesh is not None else 'evicted')
+
+    @property
+    def resident(self) -> bool:
+        return self.mesh is not None
+
+    def distance(self, cameraPosition: np.ndarray) -> float:
+        # distance from the camera to the bounding sphere, meshes without bounds go first
+        if self.bounds is None:
+            return 0.0
+        return max(float(np.linalg.norm(self.bounds.center - cameraPosition[:3])) - self.bounds.radius, 0.0)
+
+
+class MeshResidency(object):
+    def __init__(self, budgetBytes: int = 512 * 1024 * 1024, bytesPerFrame: int = 16 * 1024 * 1024):
+        self.budgetBytes: int = budgetBytes
+        # how much update() may upload per frame, it always tries to load at least one mesh
+        self.bytesPerFrame: int = bytesPerFrame
+        self.meshes: List[ResidentMesh] = []
+        self._files: Dict[str, MeshFile] = {}
+        self._requested: Dict[int, ResidentMesh] = {}
+        self._frame: int = 0
+        self._residentBytes: int = 0
+        self._hits: int = 0
+        self._misses: int = 0
+        self._evictions: int = 0
+        self._loads: int = 0
+
+    def _file(self, path: str) -> MeshFile:
+        # files stay mapped, so reloading a mesh only reads that mesh
+        if path not in self._files:
+            self._files[path] = MeshFile(path)
+        return self._files[path]
+
+    def addFile(self, path: str, processors: Sequence[MeshProcessor] = ()) -> List[ResidentMesh]:
+        """
+        Registers all meshes in a file, nothing is loaded until the meshes are drawn.
+        """
+        reader = self._file(path)
+        result = []
+        for i, info in enumerate(reader.meshes):
+            section = reader.section(i, BOUNDS_SECTION)
+            bounds = Bounds.decode(section) if section is not None else None
+            result.append(ResidentMesh(path, i, info.name, info.materialName, bounds, processors))
+        self.meshes.extend(result)
+        return result
+
+    @property
+    def residentBytes(self) -> int:
+        return self._residentBytes
+
+    @property
+    def stats(self) -> ResidencyStats:
+        return ResidencyStats(self._hits, self._misses, self._evictions, self._loads, self._residentBytes,
+                              self.budgetBytes)
+
+    def resetStats(self):
+        self._hits = self._misses = self._evictions = self._loads = 0
+
+    def acquire(self, handle: ResidentMesh) -> Optional[Mesh]:
+        """
+        Returns the mesh to draw this frame, or None (and queues it) if it is not on the GPU.
+        Use this instead of draw() to draw in other ways, like Mesh.drawLod.
+        """
+        handle.lastDrawnFrame = self._frame
+        if handle.mesh is not None:
+            self._hits += 1
+            return handle.mesh
+        self._misses += 1
+        self._requested[id(handle)] = handle
+        return None
+
+    def draw(self, handle: ResidentMesh) -> bool:
+        # returns whether the mesh was drawn
+        mesh = self.acquire(handle)
+        if mesh is None:
+            return False
+        mesh.draw()
+        return True
+
+    def evict(self, handle: ResidentMesh):
+        if handle.mesh is None:
+            return
+        self._residentBytes -= handle.mesh.sizeInBytes
+        handle.mesh.delete()
+        handle.mesh = None
+        self._evictions += 1
+
+    def _makeRoom(self, sizeInBytes: int) -> bool:
+        # evicts meshes not drawn in the current frame, least recently drawn first, until sizeInBytes fits
+        if self._residentBytes + sizeInBytes <= self.budgetBytes:
+            return True
+        candidates = sorted((handle for handle in self.meshes
+                             if handle.mesh is not None and handle.lastDrawnFrame < self._frame),
+                            key=lambda handle: handle.lastDrawnFrame)
+        # don't throw away resident meshes for a load that won't fit anyway
+        evictable = sum(handle.mesh.sizeInBytes for handle in candidates)
+        if self._residentBytes - evictable + sizeInBytes > self.budgetBytes:
+            return False
+        for handle in candidates:
+            self.evict(handle)
+            if self._residentBytes + sizeInBytes <= self.budgetBytes:
+                return True
+        return False
+
+    def _load(self, handle: ResidentMesh) -> bool:
+        reader = self._file(handle.path)
+        info = reader.info(handle.index)
+        # the buffers are at least this big, levels of detail add more indices
+        # MeshFile.load narrows the indices, so they take 16 bits whenever the vertex count allows it
+        indexSize = 2 if info.vertexCount <= 65536 else 4
+        if not self._makeRoom(info.vertexCount * info.stride + info.indexCount * indexSize):
+            return False
+        handle.mesh = reader.load(handle.index, handle.processors)
+        self._residentBytes += handle.mesh.sizeInBytes
+        self._loads += 1
+        # make room for what the levels added, if anything
+        self._makeRoom(0)
+        return True
+
+    def update(self, cameraPosition: np.ndarray) -> int:
+        """
+        Call once per frame before drawing: loads the meshes that missed during the previous frame, closest to the
+        camera first, and starts a new frame. Returns the number of bytes loaded.
+        Meshes that don't fit in this frame's bytesPerFrame are requested again when they are drawn again.
+        """
+        cameraPosition = np.asarray(cameraPosition, np.float64)
+        requested = sorted(self._requested.values(), key=lambda handle: handle.distance(cameraPosition))
+        self._requested.clear()
+        loaded = 0
+        for handle in requested:
+            # the meshes drawn in the frame that just ended are protected, so a full budget stops loading
+            if handle.mesh is not None:
+                continue
+            if loaded >= self.bytesPerFrame or not self._load(handle):
+                break
+            loaded += handle.mesh.sizeInBytes
+        self._frame += 1
+        return loaded
+
+    def clear(self):
+        # evicts everything and closes the files
+        for handle in self.meshes:
+            self.evict(handle)
+        self._requested.clear()
+        for reader in self._files.values():
+            reader.close()
+        self._files.clear()
@@ -0,0 +1,180 @@
+"""
+Collects draws for a frame and submits them sorted by state, so every program, material and vertex array is bound
+as few times as possible. Material.use and Mesh.draw already skip binding what is bound, sorting makes sure draws
+that share state are next to each other.
+
+queue = RenderQueue()
+every frame:
+    for obj in objects:
+        queue.add(obj.material, obj.mesh, {'uModel': obj.modelMatrix}, depth=viewDepth(obj))
+    stats = queue.submit()  # also clears the queue
+
+Draws are sorted by a 64 bit key, most significant first:
+u3: render pass, passes are drawn in increasing order
+u1: transparent, transparent draws come after the opaque draws of their pass
+opaque:       u12 program, u16 material, u12 vertex array, u20 depth front-to-back
+transparent:  u20 depth back-to-front, u12 program, u16 material, u12 vertex array
+The depth is quantized over the range of depths in the queue, so only its order matters.
+"""
+from typing import *
+import numpy as np
+from .mesh import Mesh
+from .program import Material
+from .texture import Texture
+
+PASS_BITS = 3
+PROGRAM_BITS = 12
+MATERIAL_BITS = 16
+VERTEX_ARRAY_BITS = 12
+DEPTH_BITS = 20
+
+
+class RenderQueueStats(NamedTuple):
+    draws: int
+    programSwitches: int
+    materialSwitches: int
+    # textures bound by the material switches
+    textureBinds: int
+    vertexArraySwitches: int
+    # the same if the draws were submitted in the order they were added
+    unsortedProgramSwitches: int
+    unsortedMaterialSwitches: int
+    unsortedTextureBinds: int
+    unsortedVertexArraySwitches: int
+
+    @property
+    def saved(self) -> int:
+        # state changes avoided by sorting
+        return (self.unsortedProgramSwitches + self.unsortedMaterialSwitches + self.unsortedTextureBinds +
+                self.unsortedVertexArraySwitches) - \
+               (self.programSwitches + self.materialSwitches + self.textureBinds + self.vertexArraySwitches)
+
+
+def _denseIds(keys: List[Any]) -> np.ndarray:
+    # numbers the distinct keys in order of first use
+    ids = {}
+    return np.array([ids.setdefault(key, len(ids)) for key in keys], np.uint64)
+
+
+def _switches(ids: np.ndarray) -> np.ndarray:
+    # bool mask of the draws that bind something else than the draw before them
+    changed = np.ones(len(ids), bool)
+    changed[1:] = ids[1:] != ids[:-1]
+    return changed
+
+
+class RenderQueue(object):
+    def __init__(self):
+        self._materials: List[Material] = []
+        self._meshes: List[Mesh] = []
+        self._uniforms: List[Optional[Dict[str, Any]]] = []
+        self._depths: List[float] = []
+        self._passes: List[int] = []
+
+    def __len__(self):
+        return len(self._meshes)
+
+    def add(self, material: Material, mesh: Mesh, uniforms: Optional[Dict[str, Any]] = None, depth: float = 0.0,
+            renderPass: int = 0, transparent: bool = False):
+        """
+        Queues a draw, uniforms are set on the program right before the mesh is drawn, they override the values of
+        the material for this draw only.
+        depth is the distance from the camera, used to draw opaque meshes front-to-back and transparent ones
+        back-to-front.
+        """
+        assert 0 <= renderPass < 1 << PASS_BITS, f'Render pass {renderPass} is out of range.'
+        self._materials.append(material)
+        self._meshes.append(mesh)
+        self._uniforms.append(uniforms)
+        self._depths.append(depth)
+        self._passes.append(renderPass << 1 | int(transparent))
+
+    def clear(self):
+        self._materials.clear()
+        self._meshes.clear()
+        self._uniforms.clear()
+        self._depths.clear()
+        self._passes.clear()
+
+    def _stateIds(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        programs = _denseIds([material._handle for material in self._materials])
+        materials = _denseIds([id(material) for material in self._materials])
+        vertexArrays = _denseIds([mesh.vertexArrayHandle for mesh in self._meshes])
+        assert programs.max() < 1 << PROGRAM_BITS, 'Too many programs in the render queue.'
+        assert materials.max() < 1 << MATERIAL_BITS, 'Too many materials in the render queue.'
+        assert vertexArrays.max() < 1 << VERTEX_ARRAY_BITS, 'Too many vertex arrays in the render queue.'
+        return programs, materials, vertexArrays
+
+    def sortKeys(self, stateIds: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None) -> np.ndarray:
+        """
+        Returns the 64 bit sort key of every queued draw.
+        """
+        if not self._meshes:
+            return np.zeros(0, np.uint64)
+        programs, materials, vertexArrays = self._stateIds() if stateIds is None else stateIds
+        passes = np.array(self._passes, np.uint64)
+        depths = np.array(self._depths, np.float64)
+        low, high = depths.min(), depths.max()
+        maximum = (1 << DEPTH_BITS) - 1
+        depths = np.round((depths - low) / max(high - low, 1e-30) * maximum).astype(np.uint64)
+
+        state = (programs << np.uint64(MATERIAL_BITS + VERTEX_ARRAY_BITS)) | \
+                (materials << np.uint64(VERTEX_ARRAY_BITS)) | vertexArrays
+        opaque = (state << np.uint64(DEPTH_BITS)) | depths
+        transparent = ((np.uint64(maximum) - depths) << np.uint64(PROGRAM_BITS + MATERIAL_BITS + VERTEX_ARRAY_BITS)) | state
+        keys = np.where((passes & np.uint64(1)).astype(bool), transparent, opaque)
+        return keys | (passes << np.uint64(64 - PASS_BITS - 1))
+
+    @staticmethod
+    def _stats(order: np.ndarray, stateIds: Tuple[np.ndarray, np.ndarray, np.ndarray],
+               textures: np.ndarray) -> Tuple[int, int, int, int]:
+        programs, materials, vertexArrays = (ids[order] for ids in stateIds)
+        textures = textures[order]
+        materialSwitches = _switches(materials)
+        return (int(_switches(programs).sum()), int(materialSwitches.sum()), int(textures[materialSwitches].sum()),
+                int(_switches(vertexArrays).sum()))
+
+    def submit(self) -> RenderQueueStats:
+        """
+        Draws everything in sorted order and clears the queue.
+        Returns the state changes of the sorted order and of the order the draws were added in.
+        """
+        if not self._meshes:
+            return RenderQueueStats(*[0] * 9)
+        stateIds = self._stateIds()
+        textures = np.array([sum(isinstance(value, Texture) for value in material._values.values())
+                             for material in self._materials], np.int64)
+        order = np.argsort(self.sortKeys(stateIds), kind='stable')
+        stats = RenderQueueStats(len(order), *self._stats(order, stateIds, textures),
+                                 *self._stats(np.arange(len(order)), stateIds, textures))
+        for i in order.tolist():
+            material = self._materials[i]
+            material.use()
+            uniforms = self._uniforms[i]
+            if uniforms:
+                self._setDrawUniforms(material, uniforms)
+            self._meshes[i].draw()
+            if uniforms:
+                self._restoreUniforms(material, uniforms)
+        self.clear()
+        return stats
+
+    @staticmethod
+    def _setDrawUniforms(material: Material, uniforms: Dict[str, Any]):
+        # set on the program only, so they are not stored in the material and replayed by later uses of it
+        # textures go to the units after the material's own textures, use() only counts those when it binds them
+        material._texture_counter = sum(isinstance(value, Texture) and material.uniformLocation(key) != -1
+                                        for key, value in material._values.items())
+        for key, value in uniforms.items():
+            material._setUniform(key, value)
+
+    @staticmethod
+    def _restoreUniforms(material: Material, uniforms: Dict[str, Any]):
+        # put back the material's own values that a draw overrode
+        overridden = [key for key in uniforms if key in material._values]
+        if any(isinstance(material._values[key], Texture) for key in overridden):
+            # texture units are assigned in order, let the next use() bind everything again
+            Material._activeMaterial = None
+            return
+        for key in overridden:
+            material._setUniform(key, material._values[key])
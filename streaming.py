@@ -0,0 +1,132 @@
+"""
+Per-frame dynamic data (particles, debug lines, per-object constants) without allocating buffers or stalling the driver.
+
+A StreamingBuffer is one immutable buffer (glBufferStorage) that stays mapped for its lifetime. It is split into
+frameCount regions, every frame writes to the next region while the GPU may still read the previous ones.
+A fence is placed after the draws of each frame, and the region is only reused once the GPU passed its fence.
+
+stream = StreamingBuffer(GL_ARRAY_BUFFER, 1024 * 1024)
+every frame:
+    stream.beginFrame()
+    offset = stream.write(lineVertices)
+    glBindVertexBuffer(0, stream.handle, offset, stride)  # or bindRange() for uniform and storage buffers
+    ...draw...
+    stream.endFrame()
+"""
+from typing import *
+import numpy as np
+from OpenGL.GL import *
+from .core import GLObject
+
+
+class StreamingBuffer(GLObject):
+    def __init__(self, target: int, frameSize: int, frameCount: int = 3, alignment: int = 256):
+        # alignment of every allocation, 256 satisfies GL_UNIFORM_BUFFER_OFFSET_ALIGNMENT on all hardware we know of
+        super().__init__()
+        self._target: int = target
+        self.alignment: int = alignment
+        self.frameSize: int = (frameSize + alignment - 1) // alignment * alignment
+        self.frameCount: int = frameCount
+        self._size: int = self.frameSize * frameCount
+
+        flags = GL_MAP_WRITE_BIT | GL_MAP_PERSISTENT_BIT | GL_MAP_COHERENT_BIT
+        self._handle = glGenBuffers(1)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self._handle)
+        glBufferStorage(GL_COPY_WRITE_BUFFER, self._size, None, flags)
+        address = glMapBufferRange(GL_COPY_WRITE_BUFFER, 0, self._size, flags)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+        assert address, 'Failed to map the streaming buffer.'
+        # coherent, so writes are visible to draws issued after them without flushing
+        self._mapping: np.ndarray = np.frombuffer((ctypes.c_ubyte * self._size).from_address(address), np.uint8)
+
+        self._fences: List[Optional[int]] = [None] * frameCount
+        self._frame: int = 0
+        self._cursor: int = 0
+        self._inFrame: bool = False
+        # how often beginFrame had to wait for the GPU, if this grows use more frames
+        self.stalls: int = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def target(self) -> int:
+        return self._target
+
+    @property
+    def regionOffset(self) -> int:
+        # start of the region of the current frame
+        return self._frame * self.frameSize
+
+    @property
+    def used(self) -> int:
+        # bytes allocated this frame
+        return self._cursor
+
+    def beginFrame(self):
+        """
+        Waits until the GPU is done with the region of this frame, nothing may be written before this.
+        """
+        assert not self._inFrame, 'beginFrame called twice without endFrame.'
+        fence = self._fences[self._frame]
+        if fence is not None:
+            status = glClientWaitSync(fence, 0, 0)
+            if status == GL_TIMEOUT_EXPIRED:
+                self.stalls += 1
+                while status == GL_TIMEOUT_EXPIRED:
+                    # flush so the fence is guaranteed to signal, wait in 1ms steps
+                    status = glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 1000000)
+            assert status != GL_WAIT_FAILED, 'Waiting for the streaming buffer fence failed.'
+            glDeleteSync(fence)
+            self._fences[self._frame] = None
+        self._cursor = 0
+        self._inFrame = True
+
+    def allocate(self, size: int, alignment: Optional[int] = None) -> Tuple[int, np.ndarray]:
+        """
+        Reserves size bytes in the region of this frame.
+        Returns the offset from the start of the buffer, for binding, and a writable uint8 view of the bytes.
+        """
+        assert self._inFrame, 'Allocate between beginFrame and endFrame.'
+        alignment = self.alignment if alignment is None else alignment
+        start = (self._cursor + alignment - 1) // alignment * alignment
+        assert start + size <= self.frameSize, \
+            f'Streaming buffer frame overflow: {start + size} of {self.frameSize} bytes.'
+        self._cursor = start + size
+        offset = self.regionOffset + start
+        return offset, self._mapping[offset:offset + size]
+
+    def write(self, data: Any, alignment: Optional[int] = None) -> int:
+        # copies anything that supports the buffer protocol, returns its offset
+        data = np.frombuffer(memoryview(data).cast('B'), np.uint8)
+        offset, view = self.allocate(data.nbytes, alignment)
+        view[:] = data
+        return offset
+
+    def bindRange(self, index: int, offset: int, size: int, target: Optional[int] = None):
+        # binds an allocation to an indexed uniform or shader storage binding
+        glBindBufferRange(self._target if target is None else target, index, self._handle, offset, size)
+
+    def endFrame(self):
+        """
+        Call after the last draw that reads this frame's data.
+        """
+        assert self._inFrame, 'endFrame called without beginFrame.'
+        self._fences[self._frame] = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        self._frame = (self._frame + 1) % self.frameCount
+        self._inFrame = False
+
+    def delete(self):
+        if self._handle == -1:
+            return
+        for fence in self._fences:
+            if fence is not None:
+                glDeleteSync(fence)
+        self._fences = [None] * self.frameCount
+        self._mapping = None
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self._handle)
+        glUnmapBuffer(GL_COPY_WRITE_BUFFER)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, 0)
+        glDeleteBuffers(1, [self._handle])
+        self._handle = -1